@@ -0,0 +1,149 @@
+"""
+Бенчмарк /my_cafe: чтение состояния игрока из базы (четыре запроса до,
+один составной запрос player_state.load_state после) и построение подписи с
+клавиатурой (на каждый просмотр до, кэш по версии состояния в cafe_view.py
+после). Просмотры идут сериями по --repeat подряд для одного игрока, как при
+повторном открытии кофейни без изменений. Результат — JSON.
+
+Запуск из корня репозитория:
+    python bench/bench_cafe_view.py --players 10000 --views 20000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup  # noqa: E402
+
+import cafe_view  # noqa: E402
+from bootstrap import bootstrap_database  # noqa: E402
+from callbacks import UPGRADE_CAFE, encode  # noqa: E402
+from catalog import load_snapshot  # noqa: E402
+from player_state import PlayerState, load_state  # noqa: E402
+
+
+# -----------------------
+# Прежняя реализация
+# -----------------------
+
+def legacy_load_state(conn, user_id):
+    player = conn.execute(
+        "SELECT cafe_name, balance, level, last_income FROM players WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if player is None:
+        return None
+    resources = dict(conn.execute(
+        "SELECT resource_id, quantity FROM user_resources WHERE user_id = ?", (user_id,)
+    ))
+    buildings = dict(conn.execute(
+        "SELECT building_id, level FROM user_buildings WHERE user_id = ?", (user_id,)
+    ))
+    achievements = {row[0] for row in conn.execute(
+        "SELECT achievement_id FROM user_achievements WHERE user_id = ?", (user_id,)
+    )}
+    cafe_name, balance, level, last_income = player
+    return PlayerState(cafe_name, balance or 0, level or 1, last_income or 0, resources, buildings, achievements)
+
+
+def legacy_render(state, snapshot):
+    response = f"🏠 **Кофейня:** {state.cafe_name}\n💰 **Баланс:** {state.balance} монет\n🔼 **Уровень:** {state.level}"
+    if state.buildings:
+        response += "\n\n🏢 **Здания:**"
+        buildings_by_id = snapshot.buildings_by_id
+        for building_id, building_level in state.buildings.items():
+            if building_id in buildings_by_id:
+                response += f"\n- {buildings_by_id[building_id].name} (Уровень {building_level})"
+    else:
+        response += "\n\n🏢 **Зданий:** Нет"
+    upgrade_button = InlineKeyboardButton(text="Улучшить кофейню (50 монет)", callback_data=encode(UPGRADE_CAFE))
+    return response, InlineKeyboardMarkup(inline_keyboard=[[upgrade_button]])
+
+
+IMPLEMENTATIONS = {
+    "before": (legacy_load_state, legacy_render),
+    "after": (load_state, cafe_view.render),
+}
+
+
+def seed(conn, players, rng):
+    snapshot = load_snapshot(conn)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO players (user_id, cafe_name, balance, last_income, level) VALUES (?, 'Bench', ?, 0, ?)",
+        [(user_id, rng.randint(0, 100_000), rng.randint(1, 20)) for user_id in range(1, players + 1)]
+    )
+    conn.executemany(
+        "INSERT INTO user_resources (user_id, resource_id, quantity) VALUES (?, ?, ?)",
+        [(user_id, r.resource_id, rng.randint(1, 500))
+         for user_id in range(1, players + 1) for r in snapshot.resources]
+    )
+    conn.executemany(
+        "INSERT INTO user_buildings (user_id, building_id, level) VALUES (?, ?, ?)",
+        [(user_id, b.building_id, rng.randint(1, 10))
+         for user_id in range(1, players + 1) for b in snapshot.buildings if rng.random() < 0.5]
+    )
+    conn.executemany(
+        "INSERT INTO user_achievements (user_id, achievement_id) VALUES (?, ?)",
+        [(user_id, a.achievement_id)
+         for user_id in range(1, players + 1) for a in snapshot.achievements if rng.random() < 0.5]
+    )
+    conn.execute("COMMIT")
+    return snapshot
+
+
+def summarize(latencies):
+    latencies.sort()
+    return {
+        "mean_us": round(sum(latencies) / len(latencies) * 1e6, 2),
+        "p50_us": round(latencies[len(latencies) // 2] * 1e6, 2),
+        "p99_us": round(latencies[int(len(latencies) * 0.99)] * 1e6, 2),
+    }
+
+
+def run(conn, snapshot, variant, players, views, repeat, seed_value):
+    load, render = IMPLEMENTATIONS[variant]
+    rng = random.Random(seed_value)
+    user_ids = [rng.randint(1, players) for _ in range(views // repeat)]
+    load_latencies = []
+    render_latencies = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        state = load(conn, user_id)
+        load_latencies.append(time.perf_counter() - started)
+        # Повторные просмотры одного и того же состояния (горячий игрок)
+        for _ in range(repeat):
+            started = time.perf_counter()
+            render(state, snapshot)
+            render_latencies.append(time.perf_counter() - started)
+    return {"load_state": summarize(load_latencies), "render": summarize(render_latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=10_000)
+    parser.add_argument("--views", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5, help="просмотров подряд без изменений")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"), isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        bootstrap_database(conn)
+        snapshot = seed(conn, args.players, random.Random(args.seed))
+        report = {
+            variant: run(conn, snapshot, variant, args.players, args.views, args.repeat, args.seed)
+            for variant in IMPLEMENTATIONS
+        }
+        conn.close()
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
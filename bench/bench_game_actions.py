@@ -0,0 +1,164 @@
+"""
+Микробенчмарк игровых действий: число SQL-запросов и задержка на действие
+до (чтение-изменение-запись) и после (условный UPDATE ... RETURNING, модуль game_actions).
+
+Запуск из корня репозитория:
+    python bench/bench_game_actions.py --players 1000 --iterations 5000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+import game_actions  # noqa: E402
+from achievement_rules import AchievementEngine  # noqa: E402
+from catalog import load_snapshot  # noqa: E402
+from bootstrap import bootstrap_database  # noqa: E402
+
+
+# -----------------------
+# Прежняя реализация (чтение, проверка в Python, запись)
+# -----------------------
+
+def legacy_upgrade_cafe(conn, user_id, engine):
+    player = conn.execute("SELECT balance, level FROM players WHERE user_id = ?", (user_id,)).fetchone()
+    if not player or player[0] < 50:
+        return game_actions.NO_COINS, None
+    new_balance, new_level = player[0] - 50, player[1] + 1
+    conn.execute("UPDATE players SET balance = ?, level = ? WHERE user_id = ?", (new_balance, new_level, user_id))
+    earned = engine.grant(conn, user_id, [("level", None, player[1], new_level)])
+    return game_actions.OK, (new_level, new_balance, earned)
+
+
+def legacy_buy_building(conn, user_id, building, engine):
+    player = conn.execute("SELECT balance FROM players WHERE user_id = ?", (user_id,)).fetchone()
+    if not player:
+        return game_actions.NOT_REGISTERED, None
+    if player[0] < building.base_cost:
+        return game_actions.NO_COINS, player[0]
+    if building.required_resource:
+        resource = conn.execute(
+            "SELECT quantity FROM user_resources WHERE user_id = ? AND resource_id = ?",
+            (user_id, building.required_resource_id)
+        ).fetchone()
+        if not resource or resource[0] < building.resource_cost:
+            return game_actions.NO_RESOURCE, None
+        conn.execute(
+            "UPDATE user_resources SET quantity = ? WHERE user_id = ? AND resource_id = ?",
+            (resource[0] - building.resource_cost, user_id, building.required_resource_id)
+        )
+    new_level = conn.execute("""
+        INSERT INTO user_buildings (user_id, building_id, level) VALUES (?, ?, 1)
+        ON CONFLICT(user_id, building_id) DO UPDATE SET level = level + 1 RETURNING level
+    """, (user_id, building.building_id)).fetchone()[0]
+    new_balance = player[0] - building.base_cost
+    conn.execute("UPDATE players SET balance = ? WHERE user_id = ?", (new_balance, user_id))
+    earned = engine.grant(conn, user_id, [("building", building.name, new_level - 1, new_level)])
+    return game_actions.OK, (new_level, new_balance, earned)
+
+
+def legacy_collect(conn, user_id, resource, amount, engine):
+    player = conn.execute("SELECT balance FROM players WHERE user_id = ?", (user_id,)).fetchone()
+    if not player:
+        return game_actions.NOT_REGISTERED, None
+    row = conn.execute(
+        "SELECT quantity FROM user_resources WHERE user_id = ? AND resource_id = ?", (user_id, resource.resource_id)
+    ).fetchone()
+    if row:
+        conn.execute(
+            "UPDATE user_resources SET quantity = ? WHERE user_id = ? AND resource_id = ?",
+            (row[0] + amount, user_id, resource.resource_id)
+        )
+    else:
+        conn.execute(
+            "INSERT INTO user_resources (user_id, resource_id, quantity) VALUES (?, ?, ?)",
+            (user_id, resource.resource_id, amount)
+        )
+    return game_actions.OK, None
+
+
+IMPLEMENTATIONS = {
+    "before": {
+        "upgrade_cafe": legacy_upgrade_cafe,
+        "buy_building": legacy_buy_building,
+        "collect": legacy_collect,
+    },
+    "after": {
+        "upgrade_cafe": game_actions.upgrade_cafe,
+        "buy_building": game_actions.buy_building,
+        "collect": game_actions.collect,
+    },
+}
+
+
+def run(variant, players, iterations, seed):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "bench.db"))
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        bootstrap_database(conn)
+        conn.executemany(
+            "INSERT INTO players (user_id, cafe_name, balance, last_income, level) VALUES (?, 'Bench', ?, NULL, 1)",
+            [(user_id, 10 ** 9) for user_id in range(1, players + 1)]
+        )
+        snapshot = load_snapshot(conn)
+        # Запас ресурсов, чтобы покупки проходили по «успешному» пути
+        conn.executemany(
+            "INSERT INTO user_resources (user_id, resource_id, quantity) VALUES (?, ?, ?)",
+            [(user_id, resource.resource_id, 10 ** 9)
+             for user_id in range(1, players + 1) for resource in snapshot.resources]
+        )
+        conn.commit()
+        engine = AchievementEngine(snapshot.achievements)
+        actions = IMPLEMENTATIONS[variant]
+
+        statements = [0]
+        conn.set_trace_callback(lambda sql: statements.__setitem__(0, statements[0] + 1))
+
+        rng = random.Random(seed)
+        results = {}
+        for name in ("collect", "upgrade_cafe", "buy_building"):
+            statements[0] = 0
+            latencies = []
+            for _ in range(iterations):
+                user_id = rng.randint(1, players)
+                if name == "collect":
+                    args = (rng.choice(snapshot.resources), rng.randint(1, 5), engine)
+                elif name == "buy_building":
+                    args = (rng.choice(snapshot.buildings), engine)
+                else:
+                    args = (engine,)
+                started = time.perf_counter()
+                with conn:
+                    actions[name](conn, user_id, *args)
+                latencies.append(time.perf_counter() - started)
+            latencies.sort()
+            # BEGIN/COMMIT тоже попадают в трассировку — считаем только запросы действия
+            results[name] = {
+                "statements_per_action": round(statements[0] / iterations - 2, 2),
+                "mean_us": round(sum(latencies) / len(latencies) * 1e6, 1),
+                "p95_us": round(latencies[int(len(latencies) * 0.95)] * 1e6, 1),
+            }
+        conn.close()
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=1000)
+    parser.add_argument("--iterations", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    report = {variant: run(variant, args.players, args.iterations, args.seed) for variant in IMPLEMENTATIONS}
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Нагрузочный бенчмарк команд бота: настоящий Dispatcher и роутер bot_main,
+сгенерированные обновления и заглушка Bot, которая записывает вызовы Bot API
+вместо отправки в Telegram.
+
+Виртуальные пользователи сначала регистрируются (/start), затем выполняют
+случайные команды по заданной смеси. Обновления одного пользователя идут по
+порядку, разные пользователи — параллельно (--concurrency). База — временный
+game.db. Результат — JSON с пропускной способностью и p50/p95/p99 задержки
+обработки обновления по каждой команде; --output сохраняет его в файл для
+сравнения коммитов.
+
+Запуск из корня репозитория:
+    python bench/bench_load.py --users 2000 --updates 20000
+    python bench/bench_load.py --mix "/collect=5,buy_*=3,/leaderboard=1" --output load.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_DIR = os.path.join(BENCH_DIR, "..", "bot")
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, BOT_DIR)
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from fake_telegram import make_callback_update, make_message_update  # noqa: E402
+from callbacks import BUY_BUILDING, UPGRADE_CAFE, encode  # noqa: E402
+
+DEFAULT_MIX = "/start=1,/collect=30,/shop=10,buy_*=15,/upgrade=15,/leaderboard=10,/my_cafe=10,/inventory=9"
+NO_THROTTLE = "*=1000000/1,/collect=1000000/1,/upgrade=1000000/1,upgrade_cafe=1000000/1,buy=1000000/1"
+
+
+# -----------------------
+# Заглушка Bot API
+# -----------------------
+
+class RecordingSession(BaseSession):
+    """Сессия aiogram без сети: считает вызовы методов и отвечает правдоподобными результатами."""
+
+    def __init__(self):
+        super().__init__()
+        self.calls = Counter()
+        self._message_ids = 0
+
+    def _result(self, method):
+        name = method.__api_method__
+        if name.startswith("send") or name.startswith("edit"):
+            self._message_ids += 1
+            chat_id = getattr(method, "chat_id", None) or 0
+            return {
+                "message_id": self._message_ids,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": getattr(method, "text", None) or "",
+            }
+        if name == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "BenchBot", "username": "bench_bot"}
+        return True
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls[method.__api_method__] += 1
+        content = json.dumps({"ok": True, "result": self._result(method)})
+        return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+# -----------------------
+# Генерация нагрузки
+# -----------------------
+
+def parse_mix(spec):
+    """"/collect=30,buy_*=15" -> {"/collect": 30.0, "buy_*": 15.0}"""
+    mix = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        command, _, weight = item.partition("=")
+        mix[command.strip()] = float(weight or 1)
+    if not mix:
+        raise ValueError("Пустая смесь команд")
+    return mix
+
+
+def make_update(user_id, command, rng, buildings):
+    if command == "buy_*":
+        return make_callback_update(user_id, encode(BUY_BUILDING, rng.choice(buildings)))
+    if command == "upgrade_cafe":
+        return make_callback_update(user_id, encode(UPGRADE_CAFE))
+    return make_message_update(user_id, command)
+
+
+def generate_load(users, count, mix, buildings, seed):
+    """Возвращает (регистрация, смесь): списки (команда, user_id, raw update)."""
+    rng = random.Random(seed)
+    commands, weights = list(mix), list(mix.values())
+    registration = [("/start", user_id, make_message_update(user_id, "/start")) for user_id in range(1, users + 1)]
+    load = []
+    for _ in range(count):
+        user_id = rng.randint(1, users)
+        command = rng.choices(commands, weights)[0]
+        load.append((command, user_id, make_update(user_id, command, rng, buildings)))
+    return registration, load
+
+
+# -----------------------
+# Прогон
+# -----------------------
+
+def percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))
+    return sorted_samples[index]
+
+
+def summarize(latencies, errors, elapsed):
+    report = {}
+    for command in sorted(latencies):
+        samples = sorted(latencies[command])
+        report[command] = {
+            "count": len(samples),
+            "errors": errors[command],
+            "p50_ms": round(percentile(samples, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(samples, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(samples, 0.99) * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+        }
+    total = sum(len(samples) for samples in latencies.values())
+    return {
+        "updates": total,
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(total / elapsed, 1) if elapsed else None,
+        "commands": report,
+    }
+
+
+async def drive(bot_main, bot, items, concurrency):
+    """Обрабатывает обновления: пользователь закреплён за одним воркером, порядок его команд сохраняется."""
+    lanes = [[] for _ in range(concurrency)]
+    for item in items:
+        lanes[item[1] % concurrency].append(item)
+    latencies = defaultdict(list)
+    errors = Counter()
+
+    async def lane_worker(lane):
+        for command, _, raw_update in lane:
+            update = Update.model_validate(raw_update, context={"bot": bot})
+            started = time.perf_counter()
+            try:
+                await bot_main.dispatcher.feed_update(bot, update)
+            except Exception:
+                errors[command] += 1
+            latencies[command].append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(lane_worker(lane) for lane in lanes if lane))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+async def run(bot_main, args):
+    session = RecordingSession()
+    bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"], session=session)
+    bot_main.bot = bot
+    buildings = [building.building_id for building in bot_main.catalog.snapshot.buildings]
+    registration, load = generate_load(args.users, args.updates, parse_mix(args.mix), buildings, args.seed)
+    try:
+        registration_report = await drive(bot_main, bot, registration, args.concurrency)
+        if args.balance >= 0:
+            # Стартовый капитал, чтобы покупки и улучшения шли по «успешному» пути
+            await bot_main.db.execute("UPDATE players SET balance = ?", (args.balance,))
+            bot_main.hot_store.invalidate_all()
+        load_report = await drive(bot_main, bot, load, args.concurrency)
+    finally:
+        await bot_main.stop_services()
+    return registration_report, load_report, session.calls
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BENCH_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--mix", default=DEFAULT_MIX,
+                        help='веса команд "команда=вес,...": /start, /collect, /shop, buy_*, /upgrade, '
+                             'upgrade_cafe, /leaderboard, /my_cafe, /inventory, /achievements')
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--balance", type=int, default=100000,
+                        help="баланс игроков после регистрации; -1 — оставить стартовый")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="дополнительно записать результат в файл")
+    args = parser.parse_args()
+    output_path = os.path.abspath(args.output) if args.output else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        # Бот читает настройки из окружения при инициализации; логи и game.db — во временном каталоге
+        os.environ.update({
+            "HOME": workdir,
+            "TELEGRAM_BOT_TOKEN": "123456:bench",
+            "WEB_APP_URL": "https://example.com",
+            "LOG_CONSOLE": "0",
+            "THROTTLE_RATES": NO_THROTTLE,
+            "INCOME_SETTLE_INTERVAL": "0",
+        })
+        os.chdir(workdir)
+        import bot_main
+
+        bot_main.setup()
+        registration, load, calls = asyncio.run(run(bot_main, args))
+
+    result = {
+        "revision": git_revision(),
+        "users": args.users,
+        "concurrency": args.concurrency,
+        "mix": parse_mix(args.mix),
+        "registration": registration,
+        "load": load,
+        "bot_api_calls": dict(calls),
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as output:
+            output.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
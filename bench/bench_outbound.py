@@ -0,0 +1,133 @@
+"""
+Бенчмарк очереди исходящих сообщений (bot/outbound.py) на локальном фейковом
+Bot API с лимитами Telegram: --chat-limit сообщений в секунду в чат и
+--global-limit всего, при превышении — 429 с retry_after.
+
+Нагрузка: --chats пользователей одновременно получают по --replies ответов
+(ответы на несколько одновременных обновлений), параллельно идёт рассылка
+--broadcast сообщений в разные чаты с низким приоритетом. Прогон делается
+дважды: без очереди (прямые вызовы aiogram, 429 — ошибка) и через очередь.
+Результат — JSON: ответы 429, ошибки, число вызовов Bot API и p50/p99
+задержки отправки для ответов и рассылки.
+
+Запуск из корня репозитория:
+    python bench/bench_outbound.py --chats 200 --replies 3 --broadcast 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.join(BENCH_DIR, "..", "bot"))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+from fake_telegram import FakeBotAPI  # noqa: E402
+from outbound import OutboundQueue, bulk_sends  # noqa: E402
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))
+    return round(sorted_samples[index] * 1000, 1)
+
+
+def summarize(latencies, errors):
+    samples = sorted(latencies)
+    return {
+        "sends": len(samples) + errors,
+        "errors": errors,
+        "p50_ms": percentile(samples, 0.50),
+        "p99_ms": percentile(samples, 0.99),
+        "max_ms": percentile(samples, 1.0),
+    }
+
+
+async def run_mode(args, use_queue, port):
+    api = FakeBotAPI(retry_after=args.retry_after, chat_limit=args.chat_limit, global_limit=args.global_limit)
+    runner = await api.start("127.0.0.1", port)
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{port}"))
+    bot = Bot(token="123456:bench", session=session)
+    queue = None
+    if use_queue:
+        # Запас корзины + восполнение за секунду не превышают лимиты фейкового API
+        queue = OutboundQueue(
+            global_rate=args.global_limit - 5, global_burst=5, chat_rate=1.0, chat_burst=args.chat_limit - 1
+        )
+        session.middleware(queue)
+    results = {"interactive": ([], [0]), "bulk": ([], [0])}
+
+    async def send(kind, chat_id, text):
+        latencies, errors = results[kind]
+        started = time.perf_counter()
+        try:
+            await bot.send_message(chat_id, text)
+        except Exception:
+            errors[0] += 1
+            return
+        latencies.append(time.perf_counter() - started)
+
+    async def user(chat_id):
+        # Ответы на несколько одновременных обновлений пользователя
+        await asyncio.gather(*(send("interactive", chat_id, f"Ответ {index + 1}") for index in range(args.replies)))
+
+    async def broadcast():
+        with bulk_sends():
+            await asyncio.gather(*(
+                send("bulk", 1_000_000 + index, "Новости кофейни") for index in range(args.broadcast)
+            ))
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(broadcast(), *(user(chat_id) for chat_id in range(1, args.chats + 1)))
+    finally:
+        elapsed = time.perf_counter() - started
+        if queue is not None:
+            await queue.close()
+        await session.close()
+        await runner.cleanup()
+    return {
+        "seconds": round(elapsed, 2),
+        "bot_api_calls": sum(api.calls.values()),
+        "flood_responses": sum(api.flooded.values()),
+        "interactive": summarize(results["interactive"][0], results["interactive"][1][0]),
+        "bulk": summarize(results["bulk"][0], results["bulk"][1][0]),
+        "queue": queue.stats() if queue is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--replies", type=int, default=3)
+    parser.add_argument("--broadcast", type=int, default=300)
+    parser.add_argument("--chat-limit", type=int, default=3, help="не меньше 2")
+    parser.add_argument("--global-limit", type=int, default=30, help="больше 5")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--port", type=int, default=18081)
+    parser.add_argument("--output", help="дополнительно записать результат в файл")
+    args = parser.parse_args()
+
+    result = {
+        "chats": args.chats,
+        "replies": args.replies,
+        "broadcast": args.broadcast,
+        "direct": asyncio.run(run_mode(args, False, args.port)),
+        "queue": asyncio.run(run_mode(args, True, args.port)),
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Бенчмарк схемы таблиц игрока: user_resources/user_buildings с названием
+ресурса/здания в каждой строке (версия схемы 5) и с resource_id/building_id
+в таблице WITHOUT ROWID с ключом (user_id, id) (миграция 6).
+
+На сгенерированной базе из --players игроков (по умолчанию миллион) с
+ресурсами и зданиями измеряются: размер файла после VACUUM (и таблиц с
+индексами, если SQLite собран с dbstat), время миграции и задержка чтения
+/inventory (ресурсы игрока с названиями) и полного состояния игрока
+(player_state.load_state) для случайных игроков. Результат — JSON.
+
+Запуск из корня репозитория:
+    python bench/bench_schema.py --players 1000000 --lookups 20000
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from bootstrap import bootstrap_database  # noqa: E402
+from catalog import load_snapshot  # noqa: E402
+from migrations import MIGRATIONS, apply_migrations  # noqa: E402
+from player_state import load_state  # noqa: E402
+
+LEGACY_VERSION = 5
+
+
+# -----------------------
+# Чтение до миграции (как player_state.load_state на схеме версии 5)
+# -----------------------
+
+def legacy_inventory(conn, snapshot, user_id):
+    return list(conn.execute(
+        "SELECT resource_name, quantity FROM user_resources WHERE user_id = ? ORDER BY id", (user_id,)
+    ))
+
+
+def legacy_load_state(conn, snapshot, user_id):
+    player = conn.execute(
+        "SELECT cafe_name, balance, level, last_income FROM players WHERE user_id = ?", (user_id,)
+    ).fetchone()
+    if player is None:
+        return None
+    resources = dict(conn.execute(
+        "SELECT resource_name, quantity FROM user_resources WHERE user_id = ? ORDER BY id", (user_id,)
+    ))
+    buildings = dict(conn.execute(
+        "SELECT building_name, level FROM user_buildings WHERE user_id = ? ORDER BY id", (user_id,)
+    ))
+    achievements = {row[0] for row in conn.execute(
+        "SELECT achievement_id FROM user_achievements WHERE user_id = ?", (user_id,)
+    )}
+    return player, resources, buildings, achievements
+
+
+def inventory(conn, snapshot, user_id):
+    # Как /inventory: id из базы, названия — из справочника
+    resources_by_id = snapshot.resources_by_id
+    return [
+        (resources_by_id[resource_id].name, quantity)
+        for resource_id, quantity in conn.execute(
+            "SELECT resource_id, quantity FROM user_resources WHERE user_id = ?", (user_id,)
+        )
+    ]
+
+
+def full_state(conn, snapshot, user_id):
+    return load_state(conn, user_id)
+
+
+READS = {
+    "before": {"inventory": legacy_inventory, "load_state": legacy_load_state},
+    "after": {"inventory": inventory, "load_state": full_state},
+}
+
+
+# -----------------------
+# Данные
+# -----------------------
+
+def generate(conn, players, seed, batch=50_000):
+    """
+    Игроки со схемой версии 5: у каждого часть ресурсов и 0–3 здания. Строки разных игроков
+    перемешаны в пределах пачки, как при появлении со временем (в рабочей базе rowid идёт
+    по времени, и строки одного игрока разбросаны по таблице).
+    """
+    rng = random.Random(seed)
+    snapshot = load_snapshot(conn)
+    resource_names = [r.name for r in snapshot.resources]
+    building_names = [b.name for b in snapshot.buildings]
+    for start in range(1, players + 1, batch):
+        user_ids = range(start, min(players, start + batch - 1) + 1)
+        resources = []
+        buildings = []
+        for user_id in user_ids:
+            for name in rng.sample(resource_names, rng.randint(1, len(resource_names))):
+                resources.append((user_id, name, rng.randint(1, 500)))
+            for name in rng.sample(building_names, rng.randint(0, len(building_names))):
+                buildings.append((user_id, name, rng.randint(1, 10)))
+        rng.shuffle(resources)
+        rng.shuffle(buildings)
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO players (user_id, cafe_name, balance, last_income, level) VALUES (?, 'Bench', ?, 0, ?)",
+            [(user_id, rng.randint(0, 100_000), rng.randint(1, 20)) for user_id in user_ids]
+        )
+        conn.executemany(
+            "INSERT INTO user_resources (user_id, resource_name, quantity) VALUES (?, ?, ?)", resources
+        )
+        conn.executemany(
+            "INSERT INTO user_buildings (user_id, building_name, level) VALUES (?, ?, ?)", buildings
+        )
+        conn.execute("COMMIT")
+
+
+# -----------------------
+# Измерения
+# -----------------------
+
+def percentile(sorted_samples, fraction):
+    index = min(len(sorted_samples) - 1, int(len(sorted_samples) * fraction))
+    return round(sorted_samples[index] * 1e6, 1)
+
+
+def table_sizes(conn):
+    # dbstat есть не во всех сборках SQLite
+    try:
+        rows = conn.execute("""
+            SELECT name, SUM(pgsize) FROM dbstat
+            WHERE name IN (SELECT name FROM sqlite_master WHERE tbl_name IN ('user_resources', 'user_buildings'))
+            GROUP BY name ORDER BY name
+        """).fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return {name: size for name, size in rows}
+
+
+def measure(path, players, lookups, seed):
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("VACUUM")
+    # В режиме WAL файл базы уменьшается только после checkpoint
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    result = {
+        "schema_version": conn.execute("PRAGMA user_version").fetchone()[0],
+        "file_bytes": os.path.getsize(path),
+        "pages": conn.execute("PRAGMA page_count").fetchone()[0],
+        "page_size": page_size,
+        "tables_bytes": table_sizes(conn),
+        "rows": {
+            table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ("user_resources", "user_buildings")
+        },
+    }
+    conn.close()
+
+    variant = "before" if result["schema_version"] <= LEGACY_VERSION else "after"
+    conn = sqlite3.connect(path)
+    snapshot = load_snapshot(conn)
+    rng = random.Random(seed)
+    user_ids = [rng.randint(1, players) for _ in range(lookups)]
+    for name, read in READS[variant].items():
+        # Прогрев: первые обращения читают страницы с диска
+        for user_id in user_ids[:lookups // 10]:
+            read(conn, snapshot, user_id)
+        latencies = []
+        for user_id in user_ids:
+            started = time.perf_counter()
+            read(conn, snapshot, user_id)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        result[name] = {
+            "p50_us": percentile(latencies, 0.50),
+            "p99_us": percentile(latencies, 0.99),
+            "mean_us": round(sum(latencies) / len(latencies) * 1e6, 1),
+        }
+    conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--players", type=int, default=1_000_000)
+    parser.add_argument("--lookups", type=int, default=20_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="дополнительно записать результат в файл")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "bench.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        bootstrap_database(conn, [m for m in MIGRATIONS if m[0] <= LEGACY_VERSION])
+        started = time.perf_counter()
+        generate(conn, args.players, args.seed)
+        generated = time.perf_counter() - started
+        conn.close()
+
+        before = measure(path, args.players, args.lookups, args.seed)
+
+        conn = sqlite3.connect(path, isolation_level=None)
+        conn.execute("PRAGMA synchronous = NORMAL")
+        started = time.perf_counter()
+        apply_migrations(conn)
+        migrated = time.perf_counter() - started
+        conn.close()
+
+        after = measure(path, args.players, args.lookups, args.seed)
+
+    result = {
+        "players": args.players,
+        "lookups": args.lookups,
+        "generate_seconds": round(generated, 1),
+        "migration_seconds": round(migrated, 1),
+        "before": before,
+        "after": after,
+        "file_bytes_ratio": round(after["file_bytes"] / before["file_bytes"], 3),
+    }
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
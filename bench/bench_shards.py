@@ -0,0 +1,117 @@
+"""
+Бенчмарк многопроцессного режима: пропускная способность бота в webhook-режиме
+одним процессом и в режиме супервизора с N процессами-воркерами.
+
+Бот запускается как подпроцесс с фейковым Bot API (fake_telegram.py), на webhook
+отправляются сгенерированные обновления; время обработки — от первой отправки
+до последнего вызова Bot API. Лимиты частоты запросов на время замера сняты.
+
+Запуск из корня репозитория:
+    python bench/bench_shards.py --processes 1 2 4 --users 200 --updates 4000
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BOT_MAIN = os.path.join(BENCH_DIR, "..", "bot", "bot_main.py")
+sys.path.insert(0, BENCH_DIR)
+
+from fake_telegram import FakeBotAPI, generate_updates, send_updates, wait_for_quiet  # noqa: E402
+
+SECRET = "bench-secret"
+NO_THROTTLE = "*=1000000/1,/collect=1000000/1,/upgrade=1000000/1,upgrade_cafe=1000000/1,buy=1000000/1"
+
+
+async def wait_for_port(url, timeout=120.0):
+    deadline = time.monotonic() + timeout
+    async with ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url):
+                    return
+            except OSError:
+                await asyncio.sleep(0.5)
+    raise TimeoutError(f"Бот не запустился: {url}")
+
+
+async def run_case(name, env_overrides, args, api_port, bot_port):
+    api = FakeBotAPI()
+    runner = await api.start("127.0.0.1", api_port)
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ)
+        env.update({
+            "HOME": workdir,
+            "TELEGRAM_BOT_TOKEN": "123456:bench",
+            "WEB_APP_URL": "https://example.com",
+            "TELEGRAM_API_URL": f"http://127.0.0.1:{api_port}",
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(bot_port),
+            "WEBHOOK_SECRET": SECRET,
+            "LOG_CONSOLE": "0",
+            "THROTTLE_RATES": NO_THROTTLE,
+            # Очередь исходящих с лимитами Telegram ограничила бы замер, а не обработку
+            "OUTBOUND_QUEUE": "0",
+            "INCOME_SETTLE_INTERVAL": "0",
+        })
+        env.update(env_overrides)
+        process = subprocess.Popen([sys.executable, BOT_MAIN], cwd=workdir, env=env)
+        try:
+            await wait_for_port(f"http://127.0.0.1:{bot_port}/")
+            updates = generate_updates(args.users, args.updates, seed=args.seed)
+            started = time.perf_counter()
+            statuses = await send_updates(f"http://127.0.0.1:{bot_port}/webhook", SECRET, updates, args.concurrency)
+            await wait_for_quiet(api, quiet_seconds=2.0, timeout=600.0)
+            elapsed = (api.last_call_at or time.perf_counter()) - started
+        finally:
+            process.send_signal(signal.SIGINT)
+            try:
+                process.wait(timeout=60)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            await runner.cleanup()
+    return {
+        "case": name,
+        "updates": len(updates),
+        "webhook_statuses": dict(statuses),
+        "bot_api_calls": sum(api.calls.values()),
+        "seconds": round(elapsed, 3),
+        "updates_per_second": round(len(updates) / elapsed, 1) if elapsed else None,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--updates", type=int, default=4000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--api-port", type=int, default=18181)
+    parser.add_argument("--bot-port", type=int, default=18180)
+    args = parser.parse_args()
+
+    results = [await run_case("single", {"BOT_MODE": "webhook"}, args, args.api_port, args.bot_port)]
+    for processes in args.processes:
+        results.append(await run_case(f"supervisor_{processes}", {
+            "BOT_MODE": "supervisor",
+            "BOT_TRANSPORT": "webhook",
+            "BOT_PROCESSES": str(processes),
+        }, args, args.api_port, args.bot_port))
+
+    baseline = results[0]["updates_per_second"]
+    for result in results:
+        result["speedup"] = round(result["updates_per_second"] / baseline, 2) if baseline else None
+    print(json.dumps({"cpu_count": os.cpu_count(), "results": results}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
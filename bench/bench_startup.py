@@ -0,0 +1,124 @@
+"""
+Бенчмарк запуска: инициализация базы до (таблица за таблицей, commit на каждую
+строку справочника, IntegrityError для идемпотентности) и после (bootstrap.py:
+проверка PRAGMA user_version и одна транзакция), на новой и на уже
+инициализированной базе; плюс время импорта bot_main и полного setup().
+
+Запуск из корня репозитория:
+    python bench/bench_startup.py --repeat 20
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot")
+sys.path.insert(0, BOT_DIR)
+
+from bootstrap import SCHEMA, SEED_ACHIEVEMENTS, SEED_BUILDINGS, SEED_RESOURCES, bootstrap_database  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+
+# -----------------------
+# Прежняя инициализация (как в bot_main.py до bootstrap.py)
+# -----------------------
+
+def legacy_bootstrap(conn):
+    seeds = {
+        1: ("INSERT INTO buildings (name, base_cost, income_multiplier, resource_cost) VALUES (?, ?, ?, ?)",
+            SEED_BUILDINGS),
+        3: ("INSERT INTO resources (name) VALUES (?)", SEED_RESOURCES),
+        5: ("INSERT INTO achievements (name, description, condition) VALUES (?, ?, ?)", SEED_ACHIEVEMENTS),
+    }
+    for index, statement in enumerate(SCHEMA):
+        conn.execute(statement)
+        conn.commit()
+        if index in seeds:
+            sql, rows = seeds[index]
+            for row in rows:
+                try:
+                    conn.execute(sql, row)
+                    conn.commit()
+                except sqlite3.IntegrityError:
+                    pass
+    apply_migrations(conn)
+
+
+IMPLEMENTATIONS = {
+    "before": legacy_bootstrap,
+    "after": lambda conn: bootstrap_database(conn),
+}
+
+
+def _timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def _summary(samples):
+    return {
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "min_ms": round(min(samples) * 1000, 3),
+        "max_ms": round(max(samples) * 1000, 3),
+    }
+
+
+def bench_bootstrap(variant, repeat):
+    cold, warm = [], []
+    init = IMPLEMENTATIONS[variant]
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "game.db")
+            for samples in (cold, warm):
+                # Новое соединение на каждый запуск, как при рестарте бота
+                conn = sqlite3.connect(path)
+                samples.append(_timed(lambda: init(conn)))
+                conn.close()
+    return {"cold": _summary(cold), "warm": _summary(warm)}
+
+
+def bench_process(snippet, repeat, env):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", snippet], cwd=env["BENCH_WORKDIR"], env=env, check=True)
+        samples.append(time.perf_counter() - started)
+    return _summary(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=20, help="повторов инициализации базы")
+    parser.add_argument("--process-repeat", type=int, default=3, help="повторов запуска интерпретатора")
+    args = parser.parse_args()
+
+    report = {"bootstrap": {variant: bench_bootstrap(variant, args.repeat) for variant in IMPLEMENTATIONS}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ)
+        env.update({
+            "BENCH_WORKDIR": tmp,
+            "HOME": tmp,
+            "PYTHONPATH": os.path.abspath(BOT_DIR),
+            "TELEGRAM_BOT_TOKEN": "123456:bench",
+            "WEB_APP_URL": "https://example.com",
+            "LOG_CONSOLE": "0",
+        })
+        report["process"] = {
+            "python": bench_process("pass", args.process_repeat, env),
+            "import_bot_main": bench_process("import bot_main", args.process_repeat, env),
+            "import_and_setup": bench_process(
+                "import bot_main; bot_main.setup(); bot_main.db.close()", args.process_repeat, env
+            ),
+        }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
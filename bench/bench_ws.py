@@ -0,0 +1,102 @@
+"""
+Нагрузочный тест WebSocket-хаба: память сервера на простаивающих соединениях.
+
+Запускает web/ws_server.py подпроцессом, открывает --connections соединений,
+подписанных на лидерборд, и сравнивает RSS сервера до и после.
+
+Запуск из корня репозитория:
+    python bench/bench_ws.py --connections 10000
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import websockets
+
+WS_SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web", "ws_server.py")
+
+
+def rss_kib(pid):
+    with open(f"/proc/{pid}/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return None
+
+
+async def wait_for_server(url, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with websockets.connect(url, compression=None):
+                return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise TimeoutError(f"Сервер не запустился: {url}")
+
+
+async def open_connections(url, count, batch, compression):
+    connections = []
+    subscribe = json.dumps({"op": "subscribe", "channel": "leaderboard"})
+
+    async def open_one():
+        websocket = await websockets.connect(url, compression=compression, ping_interval=None, open_timeout=60)
+        await websocket.send(subscribe)
+        await websocket.recv()
+        return websocket
+
+    for start in range(0, count, batch):
+        connections.extend(await asyncio.gather(*(open_one() for _ in range(min(batch, count - start)))))
+    return connections
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--connections", type=int, default=10000)
+    parser.add_argument("--batch", type=int, default=200)
+    parser.add_argument("--port", type=int, default=18765)
+    parser.add_argument("--compression", choices=("none", "deflate"), default="none")
+    parser.add_argument("--idle-seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+    env = dict(os.environ, PORT=str(args.port), WS_COMPRESSION=args.compression, LOG_LEVEL="WARNING")
+    env.pop("TELEGRAM_BOT_TOKEN", None)
+    server = subprocess.Popen([sys.executable, WS_SERVER], env=env)
+    url = f"ws://127.0.0.1:{args.port}/ws"
+    compression = "deflate" if args.compression == "deflate" else None
+    try:
+        await wait_for_server(url)
+        await asyncio.sleep(0.5)
+        rss_before = rss_kib(server.pid)
+        started = time.perf_counter()
+        connections = await open_connections(url, args.connections, args.batch, compression)
+        connect_seconds = time.perf_counter() - started
+        await asyncio.sleep(args.idle_seconds)
+        rss_after = rss_kib(server.pid)
+        alive = sum(1 for websocket in connections if websocket.state.name == "OPEN")
+        await asyncio.gather(*(websocket.close() for websocket in connections), return_exceptions=True)
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    print(json.dumps({
+        "connections": args.connections,
+        "alive_after_idle": alive,
+        "compression": args.compression,
+        "connect_seconds": round(connect_seconds, 2),
+        "server_rss_before_mib": round(rss_before / 1024, 1),
+        "server_rss_after_mib": round(rss_after / 1024, 1),
+        "kib_per_connection": round((rss_after - rss_before) / args.connections, 2),
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,243 @@
+"""
+Локальная заглушка Telegram для проверки webhook-режима без сети.
+
+Поднимает фейковый Bot API (принимает любые методы, отвечает правдоподобными
+результатами и считает вызовы) и отправляет на webhook бота сгенерированные
+обновления с секретным токеном.
+
+Пример (бот запущен с BOT_MODE=webhook, WEBHOOK_SECRET=secret,
+TELEGRAM_API_URL=http://127.0.0.1:8081):
+    python bench/fake_telegram.py --webhook http://127.0.0.1:8080/webhook --secret secret --users 50 --updates 1000
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+from aiohttp import ClientSession, web
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+DEFAULT_COMMANDS = ("/start", "/collect", "/my_cafe", "/shop", "/upgrade", "/inventory", "/leaderboard")
+
+
+# -----------------------
+# Генерация обновлений
+# -----------------------
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def _user(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+
+def make_message_update(user_id, text):
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_message_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": _user(user_id),
+            "text": text,
+        },
+    }
+
+
+def make_callback_update(user_id, data):
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": next(_message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "",
+            },
+        },
+    }
+
+
+# -----------------------
+# Фейковый Bot API
+# -----------------------
+
+class FakeBotAPI:
+    """
+    Отвечает на вызовы Bot API вида /bot<token>/<method>; может имитировать 429:
+    на каждый N-й вызов метода (flood_every) или при превышении лимитов
+    Telegram — сообщений в секунду в один чат (chat_limit) и всего (global_limit).
+    """
+
+    def __init__(self, flood_every=0, retry_after=1, chat_limit=0, global_limit=0):
+        self.calls = Counter()
+        self.chats = Counter()
+        self.flooded = Counter()
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        self.chat_limit = chat_limit
+        self.global_limit = global_limit
+        self.last_call_at = None
+        self._counter = itertools.count(1)
+        # Время отправок за последнюю секунду: по чатам и всего
+        self._chat_sends = defaultdict(deque)
+        self._global_sends = deque()
+
+    def _result(self, method, fields):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "FakeBot", "username": "fake_bot"}
+        if method.startswith("send") or method.startswith("edit"):
+            chat_id = int(fields.get("chat_id", 0) or 0)
+            return {
+                "message_id": next(self._counter),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": fields.get("text", ""),
+            }
+        if method == "getUpdates":
+            return []
+        return True
+
+    def _over_limit(self, method, chat_id, now):
+        if chat_id is None or not method.startswith(("send", "edit", "copy", "forward")):
+            return False
+        windows = [(self._global_sends, self.global_limit), (self._chat_sends[chat_id], self.chat_limit)]
+        for sends, limit in windows:
+            while sends and now - sends[0] >= 1.0:
+                sends.popleft()
+            if limit and len(sends) >= limit:
+                return True
+        for sends, _ in windows:
+            sends.append(now)
+        return False
+
+    def _flood(self, method):
+        self.flooded[method] += 1
+        return web.json_response({
+            "ok": False, "error_code": 429,
+            "description": f"Too Many Requests: retry after {self.retry_after}",
+            "parameters": {"retry_after": self.retry_after},
+        }, status=429)
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            fields = await request.json()
+        else:
+            fields = dict(await request.post())
+        self.calls[method] += 1
+        self.last_call_at = time.perf_counter()
+        if "chat_id" in fields:
+            self.chats[fields["chat_id"]] += 1
+        if self.flood_every and self.calls[method] % self.flood_every == 0:
+            return self._flood(method)
+        if self._over_limit(method, fields.get("chat_id"), time.monotonic()):
+            return self._flood(method)
+        return web.json_response({"ok": True, "result": self._result(method, fields)})
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def start(self, host="127.0.0.1", port=8081):
+        runner = web.AppRunner(self.app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+# -----------------------
+# Отправка обновлений на webhook
+# -----------------------
+
+async def send_updates(webhook_url, secret, updates, concurrency=32):
+    statuses = Counter()
+    queue = asyncio.Queue()
+    for update in updates:
+        queue.put_nowait(update)
+
+    async with ClientSession() as session:
+        async def worker():
+            while not queue.empty():
+                update = queue.get_nowait()
+                headers = {SECRET_HEADER: secret} if secret else {}
+                async with session.post(webhook_url, data=json.dumps(update), headers=headers,
+                                        timeout=None) as response:
+                    statuses[response.status] += 1
+
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return statuses
+
+
+def generate_updates(users, count, commands=DEFAULT_COMMANDS, seed=1):
+    rng = random.Random(seed)
+    # Каждый пользователь сначала регистрируется
+    updates = [make_message_update(user_id, "/start") for user_id in range(1, users + 1)]
+    for _ in range(max(0, count - users)):
+        user_id = rng.randint(1, users)
+        command = rng.choice(commands)
+        if command == "upgrade_cafe":
+            updates.append(make_callback_update(user_id, "upgrade_cafe"))
+        else:
+            updates.append(make_message_update(user_id, command))
+    return updates
+
+
+async def wait_for_quiet(api, quiet_seconds=1.0, timeout=60.0):
+    # Ждём, пока бот перестанет слать ответы
+    deadline = time.monotonic() + timeout
+    last = -1
+    while time.monotonic() < deadline:
+        total = sum(api.calls.values())
+        if total == last:
+            return
+        last = total
+        await asyncio.sleep(quiet_seconds)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram для webhook-режима бота")
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", default="")
+    parser.add_argument("--api-host", default="127.0.0.1")
+    parser.add_argument("--api-port", type=int, default=8081)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--updates", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--flood-every", type=int, default=0, help="отвечать 429 на каждый N-й вызов метода")
+    parser.add_argument("--chat-limit", type=int, default=0, help="429 при превышении N сообщений в секунду в чат")
+    parser.add_argument("--global-limit", type=int, default=0, help="429 при превышении N сообщений в секунду всего")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(flood_every=args.flood_every, chat_limit=args.chat_limit, global_limit=args.global_limit)
+    runner = await api.start(args.api_host, args.api_port)
+    try:
+        updates = generate_updates(args.users, args.updates)
+        started = time.perf_counter()
+        statuses = await send_updates(args.webhook, args.secret, updates, args.concurrency)
+        accepted = time.perf_counter() - started
+        await wait_for_quiet(api)
+        print(json.dumps({
+            "updates": len(updates),
+            "webhook_statuses": dict(statuses),
+            "accept_seconds": round(accepted, 3),
+            "accept_rate_per_second": round(len(updates) / accepted, 1) if accepted else None,
+            "bot_api_calls": dict(api.calls),
+            "flood_responses": dict(api.flooded),
+        }, ensure_ascii=False, indent=2))
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,169 @@
+import bisect
+import logging
+import re
+from dataclasses import dataclass
+from typing import Optional
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Движок правил достижений
+# =======================
+#
+# Условия из таблицы achievements компилируются один раз в пороговые правила.
+# Поддерживаемый синтаксис условия: "<метрика>[<ключ>] >= <число>", например:
+#   level >= 5                  — уровень кофейни
+#   balance >= 1000             — баланс
+#   buildings >= 3              — количество разных зданий
+#   building[Склад] >= 2        — уровень конкретного здания
+#   resource[Молоко] >= 50      — количество ресурса
+# Правила сгруппированы по (метрика, ключ) и отсортированы по порогу, поэтому
+# поиск пересечённых порогов — это bisect, а выдача — один пакетный INSERT.
+
+METRICS = ("level", "balance", "buildings", "building", "resource")
+KEYED_METRICS = ("building", "resource")
+
+_CONDITION_RE = re.compile(r"^\s*(\w+)\s*(?:\[\s*(.+?)\s*\])?\s*>=\s*(-?\d+)\s*$")
+
+
+@dataclass(frozen=True)
+class Rule:
+    achievement_id: int
+    name: str
+    metric: str
+    key: Optional[str]
+    threshold: int
+
+
+def compile_condition(achievement):
+    """Компилирует условие достижения в Rule. Бросает ValueError при неверном синтаксисе."""
+    match = _CONDITION_RE.match(achievement.condition or "")
+    if not match:
+        raise ValueError(f"Неизвестный формат условия: {achievement.condition!r}")
+    metric, key, threshold = match.group(1), match.group(2), int(match.group(3))
+    if metric not in METRICS:
+        raise ValueError(f"Неизвестная метрика в условии: {metric!r}")
+    if (metric in KEYED_METRICS) != (key is not None):
+        raise ValueError(f"Метрика {metric!r} {'требует' if metric in KEYED_METRICS else 'не допускает'} ключ")
+    return Rule(achievement.achievement_id, achievement.name, metric, key, threshold)
+
+
+class AchievementEngine:
+    def __init__(self, achievements=()):
+        self.rules = []
+        for achievement in achievements:
+            try:
+                self.rules.append(compile_condition(achievement))
+            except ValueError as e:
+                logger.warning(f"Достижение {achievement.name} пропущено: {e}")
+
+        # (метрика, ключ) -> (отсортированные пороги, правила в том же порядке)
+        grouped = {}
+        for rule in self.rules:
+            grouped.setdefault((rule.metric, rule.key), []).append(rule)
+        self._index = {}
+        for group_key, rules in grouped.items():
+            rules.sort(key=lambda r: r.threshold)
+            self._index[group_key] = ([r.threshold for r in rules], rules)
+        self._names = {rule.achievement_id: rule.name for rule in self.rules}
+
+    def tracks(self, metric, key=None):
+        return (metric, key) in self._index
+
+    def crossed(self, metric, key, old_value, new_value):
+        """Правила, чей порог лежит в (old_value, new_value]. old_value=None — все пороги до new_value."""
+        entry = self._index.get((metric, key))
+        if not entry or new_value is None:
+            return []
+        thresholds, rules = entry
+        hi = bisect.bisect_right(thresholds, new_value)
+        lo = 0 if old_value is None else bisect.bisect_right(thresholds, old_value)
+        return rules[lo:hi] if lo < hi else []
+
+    def grant(self, conn, user_id, changes):
+        """
+        Выдаёт достижения за изменения состояния одним INSERT.
+        changes — итерируемое из (метрика, ключ, старое значение, новое значение).
+        Возвращает названия впервые полученных достижений.
+        """
+        achievement_ids = []
+        for metric, key, old_value, new_value in changes:
+            achievement_ids.extend(rule.achievement_id for rule in self.crossed(metric, key, old_value, new_value))
+        if not achievement_ids:
+            return []
+
+        placeholders = ", ".join("(?, ?)" for _ in achievement_ids)
+        params = []
+        for achievement_id in achievement_ids:
+            params.extend((user_id, achievement_id))
+        granted = conn.execute(f"""
+            INSERT INTO user_achievements (user_id, achievement_id)
+            VALUES {placeholders}
+            ON CONFLICT(user_id, achievement_id) DO NOTHING
+            RETURNING achievement_id
+        """, params).fetchall()
+        granted_ids = {row[0] for row in granted}
+        # Сохраняем порядок правил (по возрастанию порога)
+        return [self._names[a] for a in dict.fromkeys(achievement_ids) if a in granted_ids]
+
+    # -----------------------
+    # Массовая перепроверка
+    # -----------------------
+
+    @staticmethod
+    def _rule_select(rule):
+        # Подзапрос игроков, удовлетворяющих правилу, в диапазоне (lower, upper] по user_id
+        if rule.metric == "level":
+            return "SELECT user_id FROM players WHERE level >= ? AND user_id > ? AND user_id <= ?", (rule.threshold,)
+        if rule.metric == "balance":
+            return "SELECT user_id FROM players WHERE balance >= ? AND user_id > ? AND user_id <= ?", (rule.threshold,)
+        if rule.metric == "buildings":
+            return """
+                SELECT user_id FROM user_buildings WHERE user_id > ? AND user_id <= ?
+                GROUP BY user_id HAVING COUNT(*) >= ?
+            """, None
+        if rule.metric == "building":
+            return """
+                SELECT user_id FROM user_buildings
+                WHERE building_id = (SELECT building_id FROM buildings WHERE name = ?) AND level >= ? AND user_id > ? AND user_id <= ?
+            """, (rule.key, rule.threshold)
+        return """
+            SELECT user_id FROM user_resources
+            WHERE resource_id = (SELECT resource_id FROM resources WHERE name = ?) AND quantity >= ? AND user_id > ? AND user_id <= ?
+        """, (rule.key, rule.threshold)
+
+    def _backfill_chunk(self, conn, lower, upper):
+        granted = 0
+        for rule in self.rules:
+            select, prefix = self._rule_select(rule)
+            params = (lower, upper, rule.threshold) if prefix is None else prefix + (lower, upper)
+            granted += conn.execute(f"""
+                INSERT INTO user_achievements (user_id, achievement_id)
+                SELECT user_id, {int(rule.achievement_id)} FROM ({select}) WHERE true
+                ON CONFLICT(user_id, achievement_id) DO NOTHING
+            """, params).rowcount
+        return granted
+
+    async def backfill(self, db, chunk_size=1000):
+        """
+        Перепроверяет все правила для всех игроков порциями по chunk_size игроков.
+        Каждая порция — отдельная короткая транзакция, чтобы не держать писателя.
+        Возвращает количество выданных достижений.
+        """
+        if not self.rules:
+            return 0
+        total = 0
+        lower = -1 << 63
+        while True:
+            row = await db.fetchone("""
+                SELECT MAX(user_id) FROM (
+                    SELECT user_id FROM players WHERE user_id > ? ORDER BY user_id LIMIT ?
+                )
+            """, (lower, chunk_size))
+            upper = row[0] if row else None
+            if upper is None:
+                break
+            total += await db.write(self._backfill_chunk, lower, upper)
+            lower = upper
+        logger.info(f"Перепроверка достижений завершена, выдано: {total}")
+        return total
@@ -0,0 +1,149 @@
+import logging
+
+from migrations import MIGRATIONS, apply_migrations, get_schema_version
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Инициализация базы данных
+# =======================
+#
+# Раньше схема создавалась на импорте bot_main.py: отдельный commit (и fsync)
+# на каждую таблицу и каждую строку справочника, идемпотентность через
+# IntegrityError. Теперь запуск сначала читает PRAGMA user_version: если схема
+# уже последней версии, база не трогается вовсе. Иначе создание таблиц,
+# заполнение справочников (upsert) и недостающие миграции выполняются одной
+# транзакцией — при ошибке база остаётся в прежнем состоянии.
+
+SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS players (
+        user_id INTEGER PRIMARY KEY,
+        cafe_name TEXT,
+        balance INTEGER,
+        last_income DATE,
+        level INTEGER DEFAULT 1
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS buildings (
+        building_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE,
+        base_cost INTEGER,
+        income_multiplier INTEGER,
+        resource_cost INTEGER DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_buildings (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        building_name TEXT,
+        level INTEGER,
+        FOREIGN KEY(user_id) REFERENCES players(user_id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS resources (
+        resource_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_resources (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        resource_name TEXT,
+        quantity INTEGER,
+        FOREIGN KEY(user_id) REFERENCES players(user_id),
+        FOREIGN KEY(resource_name) REFERENCES resources(name)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS achievements (
+        achievement_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT UNIQUE,
+        description TEXT,
+        condition TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_achievements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        achievement_id INTEGER,
+        FOREIGN KEY(user_id) REFERENCES players(user_id),
+        FOREIGN KEY(achievement_id) REFERENCES achievements(achievement_id)
+    )
+    """,
+)
+
+SEED_BUILDINGS = [
+    ("Магазин", 200, 2, 5),
+    ("Склад", 300, 3, 3),
+    ("Офис", 500, 5, 2),
+]
+
+SEED_RESOURCES = [
+    ("Кофейные зерна",),
+    ("Молоко",),
+    ("Сахар",),
+]
+
+SEED_ACHIEVEMENTS = [
+    ("Начинающий Бариста", "Достигните уровня 2 кофейни.", "level >= 2"),
+    ("Опытный Бариста", "Достигните уровня 5 кофейни.", "level >= 5"),
+    ("Мастер Кофе", "Достигните уровня 10 кофейни.", "level >= 10"),
+]
+
+
+def latest_version(migrations=MIGRATIONS):
+    return max((version for version, _ in migrations), default=0)
+
+
+def create_schema(conn):
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+
+def seed_catalog(conn):
+    # Справочники только дополняются: строки, изменённые администратором, не перезаписываются
+    conn.executemany("""
+        INSERT INTO buildings (name, base_cost, income_multiplier, resource_cost)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(name) DO NOTHING
+    """, SEED_BUILDINGS)
+    conn.executemany("INSERT INTO resources (name) VALUES (?) ON CONFLICT(name) DO NOTHING", SEED_RESOURCES)
+    conn.executemany("""
+        INSERT INTO achievements (name, description, condition)
+        VALUES (?, ?, ?)
+        ON CONFLICT(name) DO NOTHING
+    """, SEED_ACHIEVEMENTS)
+
+
+def bootstrap_database(conn, migrations=MIGRATIONS):
+    """
+    Доводит базу до последней версии схемы. Возвращает (версия, применена ли инициализация).
+    conn должен быть в режиме автокоммита или без открытой транзакции.
+    """
+    version = get_schema_version(conn)
+    target = latest_version(migrations)
+    if version >= target:
+        return version, False
+
+    if version == 0:
+        # Освобождённые страницы возвращаются постепенно (maintenance.optimize). Действует
+        # только для новой базы: в существующей режим меняется лишь полным VACUUM
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        create_schema(conn)
+        seed_catalog(conn)
+        # Миграции и user_version — в этой же транзакции
+        apply_migrations(conn, migrations)
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    logger.info(f"Схема базы данных обновлена с версии {version} до {target}.")
+    return target, True
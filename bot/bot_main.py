@@ -6,278 +6,248 @@ import sqlite3
 import random
 from aiogram import Bot, Dispatcher, types, Router
 from aiogram.filters import Command
-from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton
+from aiogram.types import Message, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder  # Импортируем InlineKeyboardBuilder для создания клавиатур
-from logging.handlers import RotatingFileHandler
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from dotenv import load_dotenv  # Добавляем импорт для загрузки переменных окружения
+from db import Database
+from media_cache import MediaCache
+from bootstrap import bootstrap_database
+from catalog import Catalog
+from achievement_rules import AchievementEngine
+import game_actions
+import cafe_view
+import income
+import ledger
+import maintenance
+from player_state import HotStore
+from scheduler import Scheduler, Interval, Cron
+from webhook import run_webhook
+from leaderboard import Leaderboards
+import callbacks
+from callbacks import CallbackRouter, BUY_BUILDING, UPGRADE_CAFE, LEADERBOARD, MENU_BUTTON
+from events import EventPublisher, LeaderboardEvents, cafe_channel
+from outbound import OutboundQueue, bulk_sends
+from metrics import HandlerMetrics, MetricsMiddleware, ErrorLogFilter, QueryMetrics, start_metrics_server, router_commands
+from throttling import ThrottlingMiddleware, parse_rates, DEFAULT_RATES
+from logging_setup import setup_logging, resolve_log_folder, LogContextMiddleware, HIGH_VOLUME
+
+logger = logging.getLogger("bot_logger")
+
+# Путь к базе данных
+db_path = "game.db"
+
+# Логирование, база, бот и диспетчер создаются в setup(), а не при импорте:
+# модуль можно импортировать из тестов и инструментов без побочных эффектов
+log_listener = None
+db = None
+media_cache = None
+hot_store = None
+outbound = None
+bot = None
+dispatcher = None
+throttling = None
+# Метрики хендлеров и запросов к базе; эндпоинт /metrics поднимается при заданном METRICS_PORT
+handler_metrics = HandlerMetrics()
+query_metrics = None
+metrics_port = None
+metrics_runner = None
+# Периодические задания (обслуживание базы, снимки журнала, прогрев кэшей); запускается в start_services()
+scheduler = Scheduler()
+# Шина событий для веб-клиента (см. events.py); без EVENTS_SOCKET публикация отключена
+events = EventPublisher()
+WEB_APP_URL = None
+
+# Справочники в памяти: горячие команды не обращаются к ним в базе
+catalog = Catalog()
+
+# Правила достижений компилируются из справочника и пересобираются при его перезагрузке
+achievement_engine = AchievementEngine()
+
+@catalog.on_reload
+def _rebuild_achievement_engine(snapshot):
+    global achievement_engine
+    achievement_engine = AchievementEngine(snapshot.achievements)
+
+# Рейтинги игроков строятся в памяти один раз и дальше обновляются инкрементально
+leaderboards = Leaderboards()
+
+router = Router()
+# Инлайн-кнопки: обработчик по id действия из callback_data (см. callbacks.py)
+callback_router = CallbackRouter()
 
 # =======================
 # 1. Настройка логирования
 # =======================
 
-# Определяем путь к рабочему столу
-desktop_path = os.path.join(os.path.expanduser("~"), "Desktop")
-log_folder = os.path.join(desktop_path, "logs")
-
-# Создаем папку для логов, если она не существует
-try:
-    os.makedirs(log_folder, exist_ok=True)
-    print(f"Папка для логов создана или уже существует: {log_folder}")
-except Exception as e:
-    print(f"Не удалось создать папку для логов: {e}")
-    # Альтернативный путь
-    log_folder = os.path.join(os.getcwd(), "logs")
-    try:
-        os.makedirs(log_folder, exist_ok=True)
-        print(f"Папка для логов создана в текущей директории: {log_folder}")
-    except Exception as e:
-        print(f"Не удалось создать папку для логов в текущей директории: {e}")
-        sys.exit(1)  # Завершаем работу, если не удалось создать папку для логов
-
-# Определяем путь к файлу логов
-log_file = os.path.join(log_folder, "bot.log")
-print(f"Путь к файлу логов: {log_file}")
+def init_logging(log_name="bot.log"):
+    global log_listener
+    # Хендлеры пишут в очередь, файл и консоль обслуживает фоновый поток (см. logging_setup.py)
+    log_folder = resolve_log_folder()
+    if log_folder is None:
+        sys.exit("Не удалось создать папку для логов.")  # Завершаем работу, если не удалось создать папку для логов
 
-# Настройка логирования с ротацией файлов
-handler = RotatingFileHandler(log_file, maxBytes=5*1024*1024, backupCount=5, encoding='utf-8')
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
-
-logger = logging.getLogger("bot_logger")
-logger.setLevel(logging.INFO)
-logger.addHandler(handler)
-logger.addHandler(logging.StreamHandler(sys.stdout))
+    # Определяем путь к файлу логов
+    log_file = os.path.join(log_folder, log_name)
+    log_listener = setup_logging(log_file)
+    logger.info(f"Путь к файлу логов: {log_file}")
 
 # =======================
 # 2. Настройка базы данных
 # =======================
 
-# Путь к базе данных
-db_path = "game.db"
-
-# Подключаемся к базе данных
-try:
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    logger.info("Соединение с базой данных установлено.")
-    print("Соединение с базой данных установлено.")
-
-    # Создаем таблицу players, если она не существует
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS players (
-        user_id INTEGER PRIMARY KEY,
-        cafe_name TEXT,
-        balance INTEGER,
-        last_income DATE,
-        level INTEGER DEFAULT 1
-    )
-    """)
-    conn.commit()
-    logger.info("Таблица players готова.")
-    print("Таблица players готова.")
-
-    # Создание таблицы buildings, если она не существует
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS buildings (
-        building_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE,
-        base_cost INTEGER,
-        income_multiplier INTEGER,
-        resource_cost INTEGER DEFAULT 0
-    )
-    """)
-    conn.commit()
-    logger.info("Таблица buildings готова.")
-    print("Таблица buildings готова.")
-
-    # Добавление зданий, если они ещё не добавлены
-    buildings = [
-        ("Магазин", 200, 2, 5),
-        ("Склад", 300, 3, 3),
-        ("Офис", 500, 5, 2)
-    ]
-
-    for building in buildings:
+def init_storage(path=None, leaderboard_paths=None):
+    """
+    Готовит базу path и загружает справочники и лидерборд.
+    leaderboard_paths — базы, из которых собирается лидерборд (по умолчанию только path).
+    """
+    path = path or db_path
+    try:
+        conn = sqlite3.connect(path)
+    except Exception as e:
+        logger.error(f"Ошибка при подключении к базе данных: {e}", exc_info=True)
+        return
+    try:
+        # Схема и справочники: при актуальной версии схемы база не изменяется (см. bootstrap.py)
         try:
-            cursor.execute("""
-            INSERT INTO buildings (name, base_cost, income_multiplier, resource_cost)
-            VALUES (?, ?, ?, ?)
-            """, building)
-            conn.commit()
-            logger.info(f"Добавлено здание: {building[0]}")
-            print(f"Добавлено здание: {building[0]}")
-        except sqlite3.IntegrityError:
-            # Здание уже существует
-            logger.info(f"Здание {building[0]} уже существует.")
-            print(f"Здание {building[0]} уже существует.")
-except Exception as e:
-    logger.error(f"Ошибка при подключении к базе данных: {e}", exc_info=True)
-    print(f"Ошибка при подключении к базе данных: {e}")
-    # Продолжаем выполнение, чтобы бот мог попытаться работать
-
-# Создаем таблицу user_buildings, если она не существует
-try:
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_buildings (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        building_name TEXT,
-        level INTEGER,
-        FOREIGN KEY(user_id) REFERENCES players(user_id)
-    )
-    """)
-    conn.commit()
-    logger.info("Таблица user_buildings готова.")
-    print("Таблица user_buildings готова.")
-except Exception as e:
-    logger.error(f"Ошибка при создании таблицы user_buildings: {e}", exc_info=True)
-    print(f"Ошибка при создании таблицы user_buildings: {e}")
-
-# Создание таблицы resources, если она не существует
-try:
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS resources (
-        resource_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE
-    )
-    """)
-    conn.commit()
-    logger.info("Таблица resources готова.")
-    print("Таблица resources готова.")
-
-    # Добавление ресурсов, если они ещё не добавлены
-    resources = [
-        ("Кофейные зерна",),
-        ("Молоко",),
-        ("Сахар",)
-    ]
-
-    for resource in resources:
+            schema_version, _ = bootstrap_database(conn)
+            logger.info(f"Версия схемы базы данных: {schema_version}")
+        except Exception as e:
+            logger.error(f"Ошибка при инициализации базы данных: {e}", exc_info=True)
+            # Продолжаем выполнение, чтобы бот мог попытаться работать
+
         try:
-            cursor.execute("""
-            INSERT INTO resources (name) VALUES (?)
-            """, resource)
-            conn.commit()
-            logger.info(f"Добавлен ресурс: {resource[0]}")
-            print(f"Добавлен ресурс: {resource[0]}")
-        except sqlite3.IntegrityError:
-            # Ресурс уже существует
-            logger.info(f"Ресурс {resource[0]} уже существует.")
-            print(f"Ресурс {resource[0]} уже существует.")
-except Exception as e:
-    logger.error(f"Ошибка при создании таблицы resources: {e}", exc_info=True)
-    print(f"Ошибка при создании таблицы resources: {e}")
-
-# Создание таблицы user_resources, если она не существует
-try:
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_resources (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        resource_name TEXT,
-        quantity INTEGER,
-        FOREIGN KEY(user_id) REFERENCES players(user_id),
-        FOREIGN KEY(resource_name) REFERENCES resources(name)
-    )
-    """)
-    conn.commit()
-    logger.info("Таблица user_resources готова.")
-    print("Таблица user_resources готова.")
-except Exception as e:
-    logger.error(f"Ошибка при создании таблицы user_resources: {e}", exc_info=True)
-    print(f"Ошибка при создании таблицы user_resources: {e}")
-
-# Создание таблицы achievements, если она не существует
-try:
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS achievements (
-        achievement_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT UNIQUE,
-        description TEXT,
-        condition TEXT
-    )
-    """)
-    conn.commit()
-    logger.info("Таблица achievements готова.")
-    print("Таблица achievements готова.")
-
-    # Добавление достижений, если они ещё не добавлены
-    achievements = [
-        ("Начинающий Бариста", "Достигните уровня 2 кофейни.", "level >= 2"),
-        ("Опытный Бариста", "Достигните уровня 5 кофейни.", "level >= 5"),
-        ("Мастер Кофе", "Достигните уровня 10 кофейни.", "level >= 10")
-    ]
-
-    for achievement in achievements:
+            catalog.load(conn)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке справочников: {e}", exc_info=True)
+
         try:
-            cursor.execute("""
-            INSERT INTO achievements (name, description, condition)
-            VALUES (?, ?, ?)
-            """, achievement)
-            conn.commit()
-            logger.info(f"Добавлено достижение: {achievement[0]}")
-            print(f"Добавлено достижение: {achievement[0]}")
-        except sqlite3.IntegrityError:
-            # Достижение уже существует
-            logger.info(f"Достижение {achievement[0]} уже существует.")
-            print(f"Достижение {achievement[0]} уже существует.")
-except Exception as e:
-    logger.error(f"Ошибка при создании таблицы achievements: {e}", exc_info=True)
-    print(f"Ошибка при создании таблицы achievements: {e}")
-
-# Создание таблицы user_achievements, если она не существует
-try:
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_achievements (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        achievement_id INTEGER,
-        FOREIGN KEY(user_id) REFERENCES players(user_id),
-        FOREIGN KEY(achievement_id) REFERENCES achievements(achievement_id)
-    )
-    """)
-    conn.commit()
-    logger.info("Таблица user_achievements готова.")
-    print("Таблица user_achievements готова.")
-except Exception as e:
-    logger.error(f"Ошибка при создании таблицы user_achievements: {e}", exc_info=True)
-    print(f"Ошибка при создании таблицы user_achievements: {e}")
+            if leaderboard_paths is None:
+                leaderboards.load(conn)
+            else:
+                # В режиме нескольких процессов рейтинг общий: собираем его из всех шардов
+                for index, shard_path in enumerate(leaderboard_paths):
+                    with sqlite3.connect(f"file:{shard_path}?mode=ro", uri=True) as shard:
+                        leaderboards.load(shard, reset=index == 0)
+        except Exception as e:
+            logger.error(f"Ошибка при загрузке лидерборда: {e}", exc_info=True)
+    finally:
+        # Соединение нужно только для инициализации: дальше работаем через пул (см. db.py)
+        conn.close()
 
 # =======================
 # 3. Настройка бота
 # =======================
 
-# Загружаем переменные окружения из файла .env
-load_dotenv()
-
-# Получение токена бота и URL веб-приложения из переменных окружения
-BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")  # Используем переменную окружения
-WEB_APP_URL = os.getenv("WEB_APP_URL")  # Используем переменную окружения
-
-if not BOT_TOKEN:
-    logger.critical("TELEGRAM_BOT_TOKEN не установлен. Пожалуйста, установите переменную окружения.")
-    print("TELEGRAM_BOT_TOKEN не установлен. Пожалуйста, установите переменную окружения.")
-    sys.exit(1)
-
-if not WEB_APP_URL:
-    logger.critical("WEB_APP_URL не установлен. Пожалуйста, установите переменную окружения.")
-    print("WEB_APP_URL не установлен. Пожалуйста, установите переменную окружения.")
-    sys.exit(1)
-
-# Создаем экземпляр бота
-try:
-    bot = Bot(token=BOT_TOKEN)
-    logger.info("Бот успешно создан с токеном.")
-    print("Бот успешно создан с токеном.")
-except Exception as e:
-    logger.critical(f"Критическая ошибка при создании бота: {e}", exc_info=True)
-    print(f"Критическая ошибка при создании бота: {e}")
-    sys.exit(1)  # Завершаем работу, если бот не создан
-
-# Создаем экземпляр роутера и диспетчера
-router = Router()
-dispatcher = Dispatcher()
-dispatcher.include_router(router)
+def create_bot():
+    # Загружаем переменные окружения из файла .env
+    load_dotenv()
+
+    # Получение токена бота из переменных окружения
+    bot_token = os.getenv("TELEGRAM_BOT_TOKEN")  # Используем переменную окружения
+    if not bot_token:
+        logger.critical("TELEGRAM_BOT_TOKEN не установлен. Пожалуйста, установите переменную окружения.")
+        sys.exit(1)
+
+    # Адрес Bot API: свой сервер Bot API или локальная заглушка (bench/fake_telegram.py)
+    telegram_api_url = os.getenv("TELEGRAM_API_URL")
+
+    # Создаем экземпляр бота
+    try:
+        session = AiohttpSession(api=TelegramAPIServer.from_base(telegram_api_url)) if telegram_api_url else None
+        new_bot = Bot(token=bot_token, session=session)
+        logger.info("Бот успешно создан с токеном.")
+        return new_bot
+    except Exception as e:
+        logger.critical(f"Критическая ошибка при создании бота: {e}", exc_info=True)
+        sys.exit(1)  # Завершаем работу, если бот не создан
+
+
+def init_bot(processes=1):
+    """processes — число процессов, отправляющих от имени бота (воркеры супервизора)."""
+    global db, media_cache, hot_store, outbound, bot, dispatcher, throttling, events, query_metrics, metrics_port, WEB_APP_URL
+
+    bot = create_bot()
+
+    # Исходящие сообщения — через очередь с лимитами Telegram (OUTBOUND_QUEUE=0 — отправлять напрямую)
+    # Лимит OUTBOUND_GLOBAL_RATE — на весь бот: воркеры супервизора делят его поровну.
+    # Чат пользователя обслуживает один воркер, поэтому лимиты чатов не делятся
+    if os.getenv("OUTBOUND_QUEUE", "1") != "0":
+        outbound = OutboundQueue(
+            global_rate=float(os.getenv("OUTBOUND_GLOBAL_RATE", "25")) / processes,
+            global_burst=max(1, int(os.getenv("OUTBOUND_GLOBAL_BURST", "5")) // processes),
+            chat_rate=float(os.getenv("OUTBOUND_CHAT_RATE", "1")),
+            chat_burst=int(os.getenv("OUTBOUND_CHAT_BURST", "2")),
+            group_rate=float(os.getenv("OUTBOUND_GROUP_RATE_PER_MINUTE", "20")) / 60,
+            merge=os.getenv("OUTBOUND_MERGE", "1") != "0"
+        )
+        bot.session.middleware(outbound)
+
+    # URL веб-приложения из переменных окружения
+    WEB_APP_URL = os.getenv("WEB_APP_URL")  # Используем переменную окружения
+
+    if not WEB_APP_URL:
+        logger.critical("WEB_APP_URL не установлен. Пожалуйста, установите переменную окружения.")
+        sys.exit(1)
+
+    # Замеры SQL-запросов (DB_METRICS=0 — отключить); запросы дольше DB_SLOW_QUERY_MS пишутся в лог
+    if os.getenv("DB_METRICS", "1") != "0":
+        query_metrics = QueryMetrics(slow_query_ms=float(os.getenv("DB_SLOW_QUERY_MS", "100")))
+    metrics_port = int(os.getenv("METRICS_PORT")) if os.getenv("METRICS_PORT") else None
+    logger.addFilter(ErrorLogFilter(handler_metrics))
+    # Метки метрик — только для зарегистрированных команд и кнопок
+    handler_metrics.register(router_commands(router) | callbacks.action_names())
+
+    # Асинхронный доступ к базе: хендлеры не блокируют event loop.
+    # Групповой коммит: записи копятся до DB_GROUP_COMMIT_INTERVAL_MS мс или DB_GROUP_COMMIT_MAX_BATCH операций
+    db = Database(
+        db_path,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "4")),
+        busy_timeout_ms=int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),
+        group_commit=os.getenv("DB_GROUP_COMMIT", "0") == "1",
+        group_commit_interval_ms=float(os.getenv("DB_GROUP_COMMIT_INTERVAL_MS", "2")),
+        group_commit_max_batch=int(os.getenv("DB_GROUP_COMMIT_MAX_BATCH", "64")),
+        query_metrics=query_metrics
+    )
+
+    # Недавно активные игроки в памяти: /my_cafe и /inventory без запросов к базе,
+    # /collect и зачисление дохода при просмотре пишутся в базу раз в HOT_STORE_FLUSH_INTERVAL секунд
+    hot_store = HotStore(
+        db, catalog,
+        max_players=int(os.getenv("HOT_STORE_SIZE", "20000")),
+        flush_interval=float(os.getenv("HOT_STORE_FLUSH_INTERVAL", "1"))
+    )
+
+    # Изменения баланса, уровня и топа уходят в ws_server через локальный сокет
+    events = EventPublisher(os.getenv("EVENTS_SOCKET"))
+    leaderboards.on_update(LeaderboardEvents(leaderboards, events))
+
+    # file_id картинок кофейни; изменения файлов проверяются раз в MEDIA_CHECK_INTERVAL секунд
+    media_cache = MediaCache(db, check_interval=float(os.getenv("MEDIA_CHECK_INTERVAL", "60")))
+
+    # Создаем экземпляр диспетчера
+    dispatcher = Dispatcher()
+    # Контекст логов (user_id, command) для всех хендлеров
+    dispatcher.update.outer_middleware(LogContextMiddleware())
+    # Время, ошибки и число обновлений в обработке по командам (включая отклонённые ограничителем)
+    dispatcher.update.outer_middleware(MetricsMiddleware(handler_metrics))
+    # Ограничение частоты запросов до хендлеров и базы; лимиты дополняются из THROTTLE_RATES
+    # в формате "/collect=5/10,buy=3/10" (запросов / секунд), "*" — общий лимит пользователя
+    throttling = ThrottlingMiddleware(
+        rates={**DEFAULT_RATES, **parse_rates(os.getenv("THROTTLE_RATES"))},
+        max_buckets=int(os.getenv("THROTTLE_MAX_BUCKETS", "100000")),
+        idle_ttl=float(os.getenv("THROTTLE_IDLE_TTL", "600"))
+    )
+    dispatcher.update.outer_middleware(throttling)
+    dispatcher.include_router(router)
+
+
+def setup():
+    """Полная инициализация перед запуском: логи, база, бот."""
+    init_logging()
+    init_storage()
+    init_bot()
 
 # =======================
 # 4. Хендлеры команд
@@ -290,8 +260,8 @@ ADMIN_USER_ID = 1490675453  # Замените на ваш реальный user
 def get_main_inline_keyboard():
     builder = InlineKeyboardBuilder()
     builder.row(
-        InlineKeyboardButton(text="Кнопка 1", callback_data="button1"),
-        InlineKeyboardButton(text="Кнопка 2", callback_data="button2")
+        InlineKeyboardButton(text="Кнопка 1", callback_data=callbacks.encode(MENU_BUTTON, 1)),
+        InlineKeyboardButton(text="Кнопка 2", callback_data=callbacks.encode(MENU_BUTTON, 2))
     )
     builder.row(
         InlineKeyboardButton(text="Open Game", url=WEB_APP_URL)
@@ -303,18 +273,17 @@ def get_main_inline_keyboard():
 async def test_handler(message: types.Message):
     await message.answer("Команда /test работает!")
     logger.info(f"Пользователь {message.from_user.id} вызвал команду /test.")
-    print(f"Пользователь {message.from_user.id} вызвал команду /test.")
 
 @router.message(Command(commands=["start"]))
 async def start_handler(message: types.Message):
     try:
-        cursor.execute("""
-            INSERT OR IGNORE INTO players (user_id, cafe_name, balance, last_income, level)
-            VALUES (?, ?, ?, ?, ?)
-        """, (message.from_user.id, "Street Cafe", 100, None, 1))
-        conn.commit()
+        _, inserted = await hot_store.write(game_actions.register_player, message.from_user.id)
+        if inserted:
+            leaderboards.update(
+                message.from_user.id, cafe_name=game_actions.START_CAFE_NAME,
+                balance=game_actions.START_BALANCE, level=1, buildings=0
+            )
         logger.info(f"Пользователь {message.from_user.id} зарегистрирован.")
-        print(f"Пользователь {message.from_user.id} зарегистрирован.")
         await message.answer("Добро пожаловать в Crypto Coffee! У вас теперь есть маленькая кофейня.", reply_markup=get_main_inline_keyboard())
     except Exception as e:
         logger.error(f"Ошибка в команде /start для пользователя {message.from_user.id}: {e}", exc_info=True)
@@ -323,49 +292,31 @@ async def start_handler(message: types.Message):
 @router.message(Command(commands=["my_cafe"]))
 async def my_cafe_handler(message: Message):
     try:
-        cursor.execute("""
-            SELECT cafe_name, balance, level FROM players WHERE user_id = ?
-        """, (message.from_user.id,))
-        player = cursor.fetchone()
-        if player:
-            cafe_name, balance, level = player
-            response = f"🏠 **Кофейня:** {cafe_name}\n💰 **Баланс:** {balance} монет\n🔼 **Уровень:** {level}"
-
-            # Получаем список зданий пользователя
-            cursor.execute("""
-                SELECT building_name, level FROM user_buildings WHERE user_id = ?
-            """, (message.from_user.id,))
-            buildings = cursor.fetchall()
-            if buildings:
-                response += "\n\n🏢 **Здания:**"
-                for building in buildings:
-                    building_name, building_level = building
-                    response += f"\n- {building_name} (Уровень {building_level})"
-            else:
-                response += "\n\n🏢 **Зданий:** Нет"
-
-            # Создаем клавиатуру с кнопкой улучшения
-            upgrade_button = InlineKeyboardButton(text="Улучшить кофейню (50 монет)", callback_data="upgrade_cafe")
-            keyboard = InlineKeyboardMarkup(inline_keyboard=[[upgrade_button]])
-
-            # Определяем путь к изображению на основе уровня
-            image_path = f"images/cafe_level_{level}.jpg"
-            if not os.path.exists(image_path):
-                image_path = "images/default_cafe.jpg"  # Запасной вариант
-
-            # Проверяем, существует ли изображение
-            if os.path.exists(image_path):
-                with open(image_path, "rb") as photo:
-                    await message.answer_photo(photo, caption=response, parse_mode="Markdown", reply_markup=keyboard)
-            else:
+        state = await hot_store.get(message.from_user.id)
+        if state:
+            # Зачисляем накопленный пассивный доход, чтобы показать актуальный баланс (в базу — отложенно)
+            settled_balance, earned_achievements = hot_store.settle_income(
+                message.from_user.id, state, achievement_engine
+            )
+            if settled_balance is not None:
+                leaderboards.update(message.from_user.id, balance=settled_balance)
+
+            # Подпись перестраивается только после изменения состояния (см. cafe_view.py)
+            response, keyboard = cafe_view.render(state, catalog.snapshot)
+
+            # Картинка уровня отправляется по file_id из кэша, файл загружается только один раз
+            sent_photo = await media_cache.answer_photo(
+                message, state.level, caption=response, parse_mode="Markdown", reply_markup=keyboard
+            )
+            if not sent_photo:
                 await message.answer(response, parse_mode="Markdown", reply_markup=keyboard)
+            if earned_achievements:
+                await message.answer(f"🎉 Поздравляем! Вы достигли: {', '.join(earned_achievements)}")
 
-            logger.info(f"Пользователь {message.from_user.id} просмотрел свою кофейню.")
-            print(f"Пользователь {message.from_user.id} просмотрел свою кофейню.")
+            logger.info(f"Пользователь {message.from_user.id} просмотрел свою кофейню.", extra=HIGH_VOLUME)
         else:
             await message.answer("Сначала начните игру командой /start.")
             logger.warning(f"Пользователь {message.from_user.id} попытался просмотреть кофейню без регистрации.")
-            print(f"Пользователь {message.from_user.id} попытался просмотреть кофейню без регистрации.")
     except Exception as e:
         logger.error(f"Ошибка в команде /my_cafe для пользователя {message.from_user.id}: {e}", exc_info=True)
         await message.answer("Произошла ошибка при получении информации о кофейне.")
@@ -373,53 +324,18 @@ async def my_cafe_handler(message: Message):
 @router.message(Command(commands=["upgrade"]))
 async def upgrade_handler(message: Message):
     try:
-        cursor.execute("""
-            SELECT balance, level FROM players WHERE user_id = ?
-        """, (message.from_user.id,))
-        player = cursor.fetchone()
-        if player and player[0] >= 50:
-            new_balance = player[0] - 50
-            new_level = player[1] + 1
-            cursor.execute("""
-                UPDATE players SET balance = ?, level = ?
-                WHERE user_id = ?
-            """, (new_balance, new_level, message.from_user.id))
-
-            # Проверка достижений
-            cursor.execute("""
-                SELECT achievement_id, name, condition FROM achievements
-            """)
-            achievements = cursor.fetchall()
-            earned_achievements = []
-            for achievement in achievements:
-                achievement_id, name, condition = achievement
-                # Парсим условие (предполагается, что условие в формате "level >= X")
-                if "level >=" in condition:
-                    required_level = int(condition.split(">=")[1].strip())
-                    if new_level >= required_level:
-                        # Проверяем, было ли уже достигнуто
-                        cursor.execute("""
-                            SELECT id FROM user_achievements WHERE user_id = ? AND achievement_id = ?
-                        """, (message.from_user.id, achievement_id))
-                        if not cursor.fetchone():
-                            # Добавляем достижение
-                            cursor.execute("""
-                                INSERT INTO user_achievements (user_id, achievement_id)
-                                VALUES (?, ?)
-                            """, (message.from_user.id, achievement_id))
-                            earned_achievements.append(name)
-
-            conn.commit()
+        status, payload = await hot_store.write(game_actions.upgrade_cafe, message.from_user.id, achievement_engine)
+        if status == game_actions.OK:
+            new_level, new_balance, earned_achievements = payload
+            leaderboards.update(message.from_user.id, balance=new_balance, level=new_level)
             await message.answer(f"Кофейня улучшена до уровня {new_level}! Теперь вы зарабатываете больше.")
             if earned_achievements:
                 achievements_text = ", ".join(earned_achievements)
                 await message.answer(f"🎉 Поздравляем! Вы достигли: {achievements_text}")
-            logger.info(f"Пользователь {message.from_user.id} улучшил кофейню до уровня {new_level}. Остаток баланса: {new_balance}")
-            print(f"Пользователь {message.from_user.id} улучшил кофейню до уровня {new_level}. Остаток баланса: {new_balance}")
+            logger.info(f"Пользователь {message.from_user.id} улучшил кофейню до уровня {new_level}. Остаток баланса: {new_balance}", extra=HIGH_VOLUME)
         else:
             await message.answer("Недостаточно монет для улучшения. Нужно 50 монет.")
             logger.warning(f"Пользователь {message.from_user.id} попытался улучшить кофейню без достаточного баланса.")
-            print(f"Пользователь {message.from_user.id} недостаточно монет для улучшения.")
     except Exception as e:
         logger.error(f"Ошибка в команде /upgrade для пользователя {message.from_user.id}: {e}", exc_info=True)
         await message.answer("Произошла ошибка при улучшении кофейни.")
@@ -427,29 +343,14 @@ async def upgrade_handler(message: Message):
 @router.message(Command(commands=["shop"]))
 async def shop_handler(message: Message):
     try:
-        logger.info(f"Пользователь {message.from_user.id} вызвал команду /shop")
-        cursor.execute("SELECT name, base_cost FROM buildings")
-        buildings = cursor.fetchall()
-        logger.info(f"Найдено зданий: {buildings}")
-
-        if buildings:
-            response = "🏪 **Доступные здания для покупки:**\n"
-            for name, cost in buildings:
-                response += f"- *{name}*: Стоимость - {cost} монет\n"
-
-            # Создаём клавиатуру с помощью InlineKeyboardBuilder
-            builder = InlineKeyboardBuilder()
-            for name, cost in buildings:
-                callback_data = f"buy_{name.replace(' ', '_')}"
-                button = InlineKeyboardButton(text=f"Купить {name} ({cost} монет)", callback_data=callback_data)
-                builder.add(button)
-
-            # Преобразуем builder в InlineKeyboardMarkup
-            keyboard = builder.as_markup()
-
-            await message.answer(response, parse_mode="Markdown", reply_markup=keyboard)
-            logger.info(f"Пользователь {message.from_user.id} открыл магазин.")
-            print(f"Пользователь {message.from_user.id} открыл магазин.")
+        logger.info(f"Пользователь {message.from_user.id} вызвал команду /shop", extra=HIGH_VOLUME)
+        snapshot = catalog.snapshot
+        logger.debug(f"Найдено зданий: {len(snapshot.buildings)}")
+
+        if snapshot.shop_text:
+            # Текст и клавиатура магазина собраны заранее при загрузке справочников
+            await message.answer(snapshot.shop_text, parse_mode="Markdown", reply_markup=snapshot.shop_keyboard)
+            logger.info(f"Пользователь {message.from_user.id} открыл магазин.", extra=HIGH_VOLUME)
         else:
             await message.answer("На данный момент доступных зданий нет.")
             logger.info(f"Пользователь {message.from_user.id} открыл магазин, но зданий нет.")
@@ -457,81 +358,54 @@ async def shop_handler(message: Message):
         logger.error(f"Ошибка в команде /shop для пользователя {message.from_user.id}: {e}", exc_info=True)
         await message.answer("Произошла ошибка при получении списка зданий.")
 
-@router.callback_query(lambda c: c.data and c.data.startswith('buy_'))
-async def buy_building_callback(query: types.CallbackQuery):
+def _legacy_building_id(values):
+    # Кнопки до кодека: "buy_<название с _ вместо пробелов>"
+    (name,) = values
+    buildings_by_name = catalog.snapshot.buildings_by_name
+    building = buildings_by_name.get(name) or buildings_by_name.get(name.replace('_', ' '))
+    return (building.building_id if building else 0,)
+
+@callback_router.handler(BUY_BUILDING, upgrades={0: _legacy_building_id})
+async def buy_building_callback(query: types.CallbackQuery, building_id: int):
     user_id = query.from_user.id
-    building_name = query.data.split('_', 1)[1].replace('_', ' ')
+    building = catalog.snapshot.buildings_by_id.get(building_id)
+    building_name = building.name if building else building_id
     try:
-        logger.info(f"Пользователь {user_id} пытается купить здание: {building_name}")
-        # Получаем информацию о здании
-        cursor.execute("""
-            SELECT base_cost, income_multiplier, resource_cost FROM buildings WHERE name = ?
-        """, (building_name,))
-        building = cursor.fetchone()
+        logger.info(f"Пользователь {user_id} пытается купить здание: {building_name}", extra=HIGH_VOLUME)
         if not building:
             await query.answer("Такого здания не существует.", show_alert=True)
             logger.warning(f"Здание {building_name} не найдено в базе данных.")
             return
-        base_cost, income_multiplier, resource_cost = building
-
-        # Получаем баланс пользователя
-        cursor.execute("SELECT balance FROM players WHERE user_id = ?", (user_id,))
-        player = cursor.fetchone()
-        if not player:
+        status, payload = await hot_store.write(game_actions.buy_building, user_id, building, achievement_engine)
+        if status == game_actions.NOT_REGISTERED:
             await query.answer("Сначала начните игру командой /start.", show_alert=True)
             logger.warning(f"Пользователь {user_id} не зарегистрирован.")
             return
-        balance = player[0]
-
-        # Проверяем, достаточно ли монет
-        if balance < base_cost:
+        if status == game_actions.NO_COINS:
             await query.answer("Недостаточно монет для покупки этого здания.", show_alert=True)
-            logger.info(f"Пользователь {user_id} имеет баланс {balance}, недостаточно для покупки {building_name}")
+            logger.info(f"Пользователь {user_id} имеет баланс {payload}, недостаточно для покупки {building_name}")
+            return
+        if status == game_actions.NO_RESOURCE:
+            required_resource, quantity = payload
+            await query.answer(f"Недостаточно {required_resource} для покупки этого здания.", show_alert=True)
+            logger.info(f"Пользователь {user_id} имеет {quantity} {required_resource}, недостаточно для покупки {building_name}")
             return
 
-        # Определяем необходимый ресурс
-        if building_name == "Магазин":
-            required_resource = "Кофейные зерна"
-        elif building_name == "Склад":
-            required_resource = "Молоко"
-        elif building_name == "Офис":
-            required_resource = "Сахар"
-        else:
-            required_resource = None
-
-        if required_resource:
-            cursor.execute("SELECT quantity FROM user_resources WHERE user_id = ? AND resource_name = ?", (user_id, required_resource))
-            resource = cursor.fetchone()
-            if not resource or resource[0] < resource_cost:
-                await query.answer(f"Недостаточно {required_resource} для покупки этого здания.", show_alert=True)
-                logger.info(f"Пользователь {user_id} имеет {resource[0] if resource else 0} {required_resource}, недостаточно для покупки {building_name}")
-                return
-
-            # Списываем ресурсы
-            new_resource_quantity = resource[0] - resource_cost
-            cursor.execute("UPDATE user_resources SET quantity = ? WHERE user_id = ? AND resource_name = ?", (new_resource_quantity, user_id, required_resource))
-
-        # Проверяем, есть ли уже это здание у пользователя
-        cursor.execute("SELECT id, level FROM user_buildings WHERE user_id = ? AND building_name = ?", (user_id, building_name))
-        user_building = cursor.fetchone()
-        if user_building:
-            building_id, level = user_building
-            cursor.execute("UPDATE user_buildings SET level = level + 1 WHERE id = ?", (building_id,))
-            new_level = level + 1
-            logger.info(f"Пользователь {user_id} повысил уровень здания {building_name} до {new_level}")
+        new_level, new_balance, earned_achievements, remaining_resource = payload
+        leaderboards.update(user_id, balance=new_balance, buildings_delta=1 if new_level == 1 else 0)
+        changes = {f"buildings.{building.name}": new_level}
+        if remaining_resource is not None:
+            changes[f"resources.{building.required_resource}"] = remaining_resource
+        events.publish(cafe_channel(user_id), changes)
+        if new_level > 1:
+            logger.info(f"Пользователь {user_id} повысил уровень здания {building_name} до {new_level}", extra=HIGH_VOLUME)
         else:
-            cursor.execute("INSERT INTO user_buildings (user_id, building_name, level) VALUES (?, ?, ?)", (user_id, building_name, 1))
-            new_level = 1
-            logger.info(f"Пользователь {user_id} купил новое здание {building_name} на уровне {new_level}")
-
-        # Обновляем баланс пользователя
-        new_balance = balance - base_cost
-        cursor.execute("UPDATE players SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-
-        conn.commit()
+            logger.info(f"Пользователь {user_id} купил новое здание {building_name} на уровне {new_level}", extra=HIGH_VOLUME)
 
         await query.answer(f"Вы успешно купили {building_name}! Ваш баланс: {new_balance} монет.", show_alert=True)
-        logger.info(f"Пользователь {user_id} купил {building_name}. Остаток баланса: {new_balance}")
+        if earned_achievements:
+            await query.message.answer(f"🎉 Поздравляем! Вы достигли: {', '.join(earned_achievements)}")
+        logger.info(f"Пользователь {user_id} купил {building_name}. Остаток баланса: {new_balance}", extra=HIGH_VOLUME)
     except Exception as e:
         logger.error(f"Ошибка при покупке здания {building_name} пользователем {user_id}: {e}", exc_info=True)
         await query.answer("Произошла ошибка при покупке здания.", show_alert=True)
@@ -540,40 +414,24 @@ async def buy_building_callback(query: types.CallbackQuery):
 async def collect_handler(message: Message):
     try:
         # Пример: случайным образом начисляем ресурсы
-        resources = ["Кофейные зерна", "Молоко", "Сахар"]
-        collected_resource = random.choice(resources)
+        resource = random.choice(catalog.snapshot.resources)
+        collected_resource = resource.name
         collected_amount = random.randint(1, 5)  # Количество собранных ресурсов
 
-        # Проверяем, зарегистрирован ли пользователь
-        cursor.execute("""
-            SELECT balance FROM players WHERE user_id = ?
-        """, (message.from_user.id,))
-        player = cursor.fetchone()
-        if not player:
+        state = await hot_store.get(message.from_user.id)
+        if state is None:
             await message.answer("Сначала начните игру командой /start.")
             return
-
-        # Проверяем, есть ли уже у пользователя этот ресурс
-        cursor.execute("""
-            SELECT quantity FROM user_resources WHERE user_id = ? AND resource_name = ?
-        """, (message.from_user.id, collected_resource))
-        user_resource = cursor.fetchone()
-        if user_resource:
-            new_quantity = user_resource[0] + collected_amount
-            cursor.execute("""
-                UPDATE user_resources SET quantity = ? WHERE user_id = ? AND resource_name = ?
-            """, (new_quantity, message.from_user.id, collected_resource))
-        else:
-            cursor.execute("""
-                INSERT INTO user_resources (user_id, resource_name, quantity)
-                VALUES (?, ?, ?)
-            """, (message.from_user.id, collected_resource, collected_amount))
-
-        conn.commit()
+        # Начисление в памяти, в базу — фоновой записью горячего состояния
+        new_quantity, earned_achievements = hot_store.collect(
+            message.from_user.id, state, resource, collected_amount, achievement_engine
+        )
+        events.publish(cafe_channel(message.from_user.id), {f"resources.{collected_resource}": new_quantity})
 
         await message.answer(f"Вы собрали {collected_amount} x {collected_resource}!")
-        logger.info(f"Пользователь {message.from_user.id} собрал {collected_amount} x {collected_resource}.")
-        print(f"Пользователь {message.from_user.id} собрал {collected_amount} x {collected_resource}.")
+        if earned_achievements:
+            await message.answer(f"🎉 Поздравляем! Вы достигли: {', '.join(earned_achievements)}")
+        logger.info(f"Пользователь {message.from_user.id} собрал {collected_amount} x {collected_resource}.", extra=HIGH_VOLUME)
     except Exception as e:
         logger.error(f"Ошибка в команде /collect для пользователя {message.from_user.id}: {e}", exc_info=True)
         await message.answer("Произошла ошибка при сборе ресурсов.")
@@ -581,14 +439,13 @@ async def collect_handler(message: Message):
 @router.message(Command(commands=["inventory"]))
 async def inventory_handler(message: Message):
     try:
-        cursor.execute("""
-            SELECT resource_name, quantity FROM user_resources WHERE user_id = ?
-        """, (message.from_user.id,))
-        user_resources = cursor.fetchall()
-        if user_resources:
+        state = await hot_store.get(message.from_user.id)
+        if state and state.resources:
             response = "📦 **Ваши ресурсы:**\n"
-            for resource_name, quantity in user_resources:
-                response += f"- {resource_name}: {quantity}\n"
+            resources_by_id = catalog.snapshot.resources_by_id
+            for resource_id, quantity in state.resources.items():
+                if resource_id in resources_by_id:
+                    response += f"- {resources_by_id[resource_id].name}: {quantity}\n"
             await message.answer(response)
         else:
             await message.answer("У вас пока нет собранных ресурсов. Используйте команду /collect для сбора.")
@@ -599,12 +456,11 @@ async def inventory_handler(message: Message):
 @router.message(Command(commands=["achievements"]))
 async def achievements_handler(message: Message):
     try:
-        cursor.execute("""
+        achievements = await db.fetchall("""
             SELECT a.name, a.description FROM achievements a
             JOIN user_achievements ua ON a.achievement_id = ua.achievement_id
             WHERE ua.user_id = ?
         """, (message.from_user.id,))
-        achievements = cursor.fetchall()
         if achievements:
             response = "🎖️ **Ваши достижения:**\n"
             for name, description in achievements:
@@ -617,19 +473,13 @@ async def achievements_handler(message: Message):
         await message.answer("Произошла ошибка при получении ваших достижений.")
 
 @router.message(Command(commands=["leaderboard"]))
-async def leaderboard_handler(message: Message):
+async def leaderboard_handler(message: Message, command: Command):
     try:
-        cursor.execute("""
-            SELECT cafe_name, balance, level FROM players
-            ORDER BY balance DESC
-            LIMIT 10
-        """)
-        top_players = cursor.fetchall()
-        if top_players:
-            response = "🏆 **Топ 10 игроков:**\n"
-            for idx, (cafe_name, balance, level) in enumerate(top_players, start=1):
-                response += f"{idx}. {cafe_name} - Баланс: {balance} монет, Уровень: {level}\n"
-            await message.answer(response)
+        # Необязательный аргумент — рейтинг: balance (по умолчанию), level, buildings
+        board_name = (command.args or "balance").strip().lower()
+        text, keyboard = leaderboards.render(board_name, 0, message.from_user.id)
+        if text:
+            await message.answer(text, reply_markup=keyboard)
         else:
             await message.answer("На данный момент в игре нет игроков.")
     except Exception as e:
@@ -640,16 +490,50 @@ async def leaderboard_handler(message: Message):
 # 5. Административные команды
 # =======================
 
+# Действия над данными игроков своей базы. В режиме нескольких процессов у каждого воркера свой шард:
+# команда выполняет действие на всех шардах (или на шарде игрока) через shard_requests (см. supervisor.py)
+
+async def _backfill_achievements_action():
+    granted = await achievement_engine.backfill(db)
+    # Выданные в базе достижения должны попасть и в состояние игроков в памяти
+    hot_store.invalidate_all()
+    return granted
+
+async def _check_ledger_action(full):
+    return await db.read(ledger.check, full)
+
+async def _ledger_action(user_id):
+    return await db.read(ledger.balances, user_id), await db.read(ledger.history, user_id, 10)
+
+ADMIN_ACTIONS = {
+    "backfill_achievements": _backfill_achievements_action,
+    "check_ledger": _check_ledger_action,
+    "ledger": _ledger_action,
+}
+
+# supervisor.ShardRequests в воркере режима supervisor; None — один процесс, одна база
+shard_requests = None
+
+async def on_all_shards(action, *args):
+    """Результаты действия на всех шардах (в одном процессе — список из одного результата)."""
+    if shard_requests is None:
+        return [await ADMIN_ACTIONS[action](*args)]
+    return await shard_requests.call_all(action, *args)
+
+async def on_user_shard(user_id, action, *args):
+    """Результат действия на шарде игрока user_id."""
+    if shard_requests is None:
+        return await ADMIN_ACTIONS[action](*args)
+    return await shard_requests.call_shard(user_id, action, *args)
+
 @router.message(Command(commands=["add_coins"]))
 async def add_coins_handler(message: Message, command: Command):
     logger.info(f"Получена команда /add_coins от пользователя {message.from_user.id}")
-    print(f"Получена команда /add_coins от пользователя {message.from_user.id}")
 
     # Проверяем, является ли пользователь администратором
     if message.from_user.id != ADMIN_USER_ID:
         await message.answer("У вас нет прав для использования этой команды.")
         logger.warning(f"Пользователь {message.from_user.id} попытался использовать команду /add_coins без прав.")
-        print(f"Пользователь {message.from_user.id} попытался использовать команду /add_coins без прав.")
         return
 
     # Проверяем, предоставлены ли аргументы
@@ -657,7 +541,6 @@ async def add_coins_handler(message: Message, command: Command):
     if not args:
         await message.answer("Пожалуйста, укажите количество монет для добавления.\nПример: /add_coins 1000")
         logger.warning(f"Пользователь {message.from_user.id} отправил команду /add_coins без аргументов.")
-        print(f"Пользователь {message.from_user.id} отправил команду /add_coins без аргументов.")
         return
 
     try:
@@ -665,102 +548,190 @@ async def add_coins_handler(message: Message, command: Command):
         if coins_to_add <= 0:
             raise ValueError("Количество монет должно быть положительным числом.")
         logger.info(f"Количество монет для добавления: {coins_to_add}")
-        print(f"Количество монет для добавления: {coins_to_add}")
     except ValueError:
         await message.answer("Пожалуйста, введите корректное положительное число монет.")
         logger.warning(f"Пользователь {message.from_user.id} ввёл некорректное количество монет: {args}")
-        print(f"Пользователь {message.from_user.id} ввёл некорректное количество монет: {args}")
         return
 
     try:
-        cursor.execute("""
-            SELECT balance FROM players WHERE user_id = ?
-        """, (message.from_user.id,))
-        player = cursor.fetchone()
-        if player:
-            new_balance = player[0] + coins_to_add
-            cursor.execute("""
-                UPDATE players SET balance = ? WHERE user_id = ?
-            """, (new_balance, message.from_user.id))
-            conn.commit()
+        status, payload = await hot_store.write(game_actions.add_coins, message.from_user.id, coins_to_add, achievement_engine)
+        if status == game_actions.OK:
+            new_balance, earned_achievements = payload
+            leaderboards.update(message.from_user.id, balance=new_balance)
             await message.answer(f"Ваш баланс успешно пополнен на {coins_to_add} монет. Теперь ваш баланс: {new_balance} монет.")
+            if earned_achievements:
+                await message.answer(f"🎉 Поздравляем! Вы достигли: {', '.join(earned_achievements)}")
             logger.info(f"Администратор {message.from_user.id} пополнил свой баланс на {coins_to_add} монет.")
-            print(f"Администратор {message.from_user.id} пополнил свой баланс на {coins_to_add} монет.")
         else:
             await message.answer("Вы не зарегистрированы в системе. Пожалуйста, используйте команду /start.")
             logger.warning(f"Администратор {message.from_user.id} попытался пополнить баланс, но не зарегистрирован.")
-            print(f"Администратор {message.from_user.id} попытался пополнить баланс, но не зарегистрирован.")
     except Exception as e:
         logger.error(f"Ошибка при пополнении баланса администратора {message.from_user.id}: {e}", exc_info=True)
-        print(f"Ошибка при пополнении баланса администратора {message.from_user.id}: {e}")
         await message.answer("Произошла ошибка при пополнении баланса.")
 
+@router.message(Command(commands=["reload_catalog"]))
+async def reload_catalog_handler(message: Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("У вас нет прав для использования этой команды.")
+        logger.warning(f"Пользователь {message.from_user.id} попытался использовать команду /reload_catalog без прав.")
+        return
+
+    try:
+        snapshot = await catalog.reload(db)
+        await message.answer(
+            f"Справочники перезагружены: зданий {len(snapshot.buildings)}, "
+            f"ресурсов {len(snapshot.resources)}, достижений {len(snapshot.achievements)}."
+        )
+        logger.info(f"Администратор {message.from_user.id} перезагрузил справочники.")
+    except Exception as e:
+        logger.error(f"Ошибка при перезагрузке справочников: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при перезагрузке справочников.")
+
+@router.message(Command(commands=["throttle_stats"]))
+async def throttle_stats_handler(message: Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("У вас нет прав для использования этой команды.")
+        logger.warning(f"Пользователь {message.from_user.id} попытался использовать команду /throttle_stats без прав.")
+        return
+
+    metrics = throttling.metrics()
+    rejected = "\n".join(f"- {key}: {count}" for key, count in sorted(metrics["rejected"].items())) or "- нет"
+    text = (
+        f"Корзин в памяти: {metrics['buckets']}, удалено: {metrics['evicted']}\n"
+        f"Отклонено запросов: {metrics['rejected_total']}\n{rejected}"
+    )
+    if outbound is not None:
+        queue = outbound.stats()
+        text += (
+            f"\nОчередь отправки: в очереди {queue['pending']}, отправлено {queue['sent']}, "
+            f"объединено {queue['merged']}, повторов после 429: {queue['retried']}, ошибок: {queue['failed']}"
+        )
+    await message.answer(text)
+
+@router.message(Command(commands=["backfill_achievements"]))
+async def backfill_achievements_handler(message: Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("У вас нет прав для использования этой команды.")
+        logger.warning(f"Пользователь {message.from_user.id} попытался использовать команду /backfill_achievements без прав.")
+        return
+
+    try:
+        # Нужна после добавления нового правила: выдаёт его всем, кто уже выполнил условие
+        granted = sum(await on_all_shards("backfill_achievements"))
+        await message.answer(f"Перепроверка достижений завершена. Выдано достижений: {granted}.")
+        logger.info(f"Администратор {message.from_user.id} запустил перепроверку достижений, выдано: {granted}")
+    except Exception as e:
+        logger.error(f"Ошибка при перепроверке достижений: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при перепроверке достижений.")
+
+@router.message(Command(commands=["ledger"]))
+async def ledger_handler(message: Message, command: Command):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("У вас нет прав для использования этой команды.")
+        logger.warning(f"Пользователь {message.from_user.id} попытался использовать команду /ledger без прав.")
+        return
+
+    try:
+        user_id = int(command.args) if command.args else message.from_user.id
+    except ValueError:
+        await message.answer("Пример: /ledger 123456789")
+        return
+
+    try:
+        balances, entries = await on_user_shard(user_id, "ledger", user_id)
+        balances_text = "\n".join(f"- {asset}: {amount}" for asset, amount in sorted(balances.items())) or "- нет"
+        entries_text = "\n".join(
+            f"#{entry_id} {asset} {delta:+d} ({reason})" for entry_id, asset, delta, reason, _ in entries
+        ) or "нет записей"
+        await message.answer(f"Остатки по журналу игрока {user_id}:\n{balances_text}\n\nПоследние записи:\n{entries_text}")
+    except Exception as e:
+        logger.error(f"Ошибка при чтении журнала баланса игрока {user_id}: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при чтении журнала.")
+
+@router.message(Command(commands=["check_ledger"]))
+async def check_ledger_handler(message: Message, command: Command):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.answer("У вас нет прав для использования этой команды.")
+        logger.warning(f"Пользователь {message.from_user.id} попытался использовать команду /check_ledger без прав.")
+        return
+
+    try:
+        # /check_ledger full — пересчёт по всему журналу, иначе по последнему снимку и хвосту
+        full = (command.args or "").strip() == "full"
+        reports = await on_all_shards("check_ledger", full)
+        report = {
+            "checked": sum(shard_report["checked"] for shard_report in reports),
+            "mismatches": sum(shard_report["mismatches"] for shard_report in reports),
+            "details": [row for shard_report in reports for row in shard_report["details"]],
+        }
+        details = "\n".join(
+            f"- {user_id} {asset}: в базе {in_db}, по журналу {in_ledger}"
+            for user_id, asset, in_db, in_ledger in report["details"][:20]
+        )
+        await message.answer(
+            f"Проверено остатков: {report['checked']}, расхождений: {report['mismatches']}"
+            + (f"\n{details}" if details else "")
+        )
+        logger.info(f"Администратор {message.from_user.id} проверил журнал баланса: {report['mismatches']} расхождений")
+    except Exception as e:
+        logger.error(f"Ошибка при проверке журнала баланса: {e}", exc_info=True)
+        await message.answer("Произошла ошибка при проверке журнала.")
+
 # =======================
 # 6. Обработка Callback Queries
 # =======================
 
-@router.callback_query(lambda c: c.data and c.data.startswith('button'))
-async def button_handler_callback(query: types.CallbackQuery):
-    choice = query.data
-    if choice == 'button1':
+@router.callback_query()
+async def callback_query_handler(query: types.CallbackQuery):
+    # Один обработчик на все кнопки: действие выбирается по id из callback_data без перебора фильтров
+    if not await callback_router.dispatch(query):
+        await query.answer("Кнопка устарела. Откройте меню заново.", show_alert=True)
+        logger.warning(f"Пользователь {query.from_user.id} нажал неизвестную кнопку: {query.data!r}")
+
+@callback_router.handler(MENU_BUTTON, upgrades={0: lambda values: values})
+async def button_handler_callback(query: types.CallbackQuery, button: int):
+    if button == 1:
         await query.answer("Вы нажали Кнопку 1", show_alert=True)
-    elif choice == 'button2':
+    elif button == 2:
         await query.answer("Вы нажали Кнопку 2", show_alert=True)
     else:
         await query.answer("Неизвестная кнопка.", show_alert=True)
-    logger.info(f"Пользователь {query.from_user.id} нажал {choice}")
+    logger.info(f"Пользователь {query.from_user.id} нажал кнопку {button}", extra=HIGH_VOLUME)
+
+def _legacy_board_id(values):
+    # Кнопки до кодека: "lb:<рейтинг>:<страница>"
+    board_name, page = values
+    board = leaderboards.boards.get(board_name)
+    return (board.board_id if board else -1, page)
 
-@router.callback_query(lambda c: c.data and c.data == 'upgrade_cafe')
+@callback_router.handler(LEADERBOARD, upgrades={0: _legacy_board_id})
+async def leaderboard_callback(query: types.CallbackQuery, board_id: int, page: int):
+    try:
+        board = leaderboards.boards_by_id.get(board_id)
+        text, keyboard = leaderboards.render(board.name if board else "balance", page, query.from_user.id)
+        if text:
+            await query.message.edit_text(text, reply_markup=keyboard)
+        await query.answer()
+    except Exception as e:
+        logger.error(f"Ошибка при листании лидерборда пользователем {query.from_user.id}: {e}", exc_info=True)
+        await query.answer("Произошла ошибка при получении лидерборда.", show_alert=True)
+
+@callback_router.handler(UPGRADE_CAFE, upgrades={0: lambda values: values})
 async def upgrade_cafe_callback(query: types.CallbackQuery):
     user_id = query.from_user.id
     try:
-        cursor.execute("""
-            SELECT balance, level FROM players WHERE user_id = ?
-        """, (user_id,))
-        player = cursor.fetchone()
-        if player and player[0] >= 50:
-            new_balance = player[0] - 50
-            new_level = player[1] + 1
-            cursor.execute("""
-                UPDATE players SET balance = ?, level = ?
-                WHERE user_id = ?
-            """, (new_balance, new_level, user_id))
-
-            # Проверка достижений
-            cursor.execute("""
-                SELECT achievement_id, name, condition FROM achievements
-            """)
-            achievements = cursor.fetchall()
-            earned_achievements = []
-            for achievement in achievements:
-                achievement_id, name, condition = achievement
-                # Парсим условие (предполагается, что условие в формате "level >= X")
-                if "level >=" in condition:
-                    required_level = int(condition.split(">=")[1].strip())
-                    if new_level >= required_level:
-                        # Проверяем, было ли уже достигнуто
-                        cursor.execute("""
-                            SELECT id FROM user_achievements WHERE user_id = ? AND achievement_id = ?
-                        """, (user_id, achievement_id))
-                        if not cursor.fetchone():
-                            # Добавляем достижение
-                            cursor.execute("""
-                                INSERT INTO user_achievements (user_id, achievement_id)
-                                VALUES (?, ?)
-                            """, (user_id, achievement_id))
-                            earned_achievements.append(name)
-
-            conn.commit()
+        status, payload = await hot_store.write(game_actions.upgrade_cafe, user_id, achievement_engine)
+        if status == game_actions.OK:
+            new_level, new_balance, earned_achievements = payload
+            leaderboards.update(user_id, balance=new_balance, level=new_level)
             await query.answer(f"Кофейня улучшена до уровня {new_level}! Теперь вы зарабатываете больше.", show_alert=True)
             if earned_achievements:
                 achievements_text = ", ".join(earned_achievements)
                 await query.message.answer(f"🎉 Поздравляем! Вы достигли: {achievements_text}")
-            logger.info(f"Пользователь {user_id} улучшил кофейню до уровня {new_level}. Остаток баланса: {new_balance}")
-            print(f"Пользователь {user_id} улучшил кофейню до уровня {new_level}. Остаток баланса: {new_balance}")
+            logger.info(f"Пользователь {user_id} улучшил кофейню до уровня {new_level}. Остаток баланса: {new_balance}", extra=HIGH_VOLUME)
         else:
             await query.answer("Недостаточно монет для улучшения. Нужно 50 монет.", show_alert=True)
             logger.warning(f"Пользователь {user_id} попытался улучшить кофейню без достаточного баланса.")
-            print(f"Пользователь {user_id} недостаточно монет для улучшения.")
     except Exception as e:
         logger.error(f"Ошибка при улучшении кофейни пользователем {user_id}: {e}", exc_info=True)
         await query.answer("Произошла ошибка при улучшении кофейни.", show_alert=True)
@@ -769,27 +740,173 @@ async def upgrade_cafe_callback(query: types.CallbackQuery):
 # 7. Обработка других Callback Queries
 # =======================
 
-# Здесь можно добавить дополнительные обработчики для других callback_data, например, для покупки зданий.
+# Новая кнопка: действие с новым id в callbacks.py, callback_data=callbacks.encode(действие, ...)
+# и обработчик с @callback_router.handler(действие).
 
 # =======================
 # 8. Запуск Бота
 # =======================
 
+def _on_income_settled(user_id, balance):
+    leaderboards.update(user_id, balance=balance)
+    # Баланс и last_income изменены в обход горячего состояния
+    hot_store.invalidate(user_id)
+
+async def settle_income_job():
+    # Необязательный фоновый проход: балансы в лидерборде не отстают от накопленного дохода.
+    # Корректность баланса от него не зависит — доход зачисляется и при обращении игрока.
+    # Проход переписывает баланс почти каждого игрока и добавляет по записи в журнал на игрока,
+    # поэтому по умолчанию выключен (INCOME_SETTLE_INTERVAL=0)
+    await income.settle_all(db, on_settled=_on_income_settled)
+
+async def ledger_snapshot_job():
+    # Снимки остатков: проверка и остатки игрока читают только хвост журнала после снимка
+    ledger_id, entries = await db.write(ledger.take_snapshot)
+    logger.info(f"Снимок журнала баланса до записи {ledger_id}, обновлено остатков: {entries}")
+
+async def media_warmup_job():
+    # При запуске и затем по расписанию: новые и изменённые картинки подхватываются без перезапуска.
+    # Загрузки прогрева не должны задерживать ответы игрокам
+    warmup_chat_id = os.getenv("MEDIA_WARMUP_CHAT_ID")
+    with bulk_sends():
+        await media_cache.warm_up(bot, int(warmup_chat_id) if warmup_chat_id else None)
+
+def schedule_jobs():
+    """Регистрирует периодические задания. Интервал 0 или пустое cron-выражение отключает задание."""
+    # Случайная задержка старта до SCHEDULER_JITTER секунд (у интервальных — не больше 10% интервала)
+    jitter = float(os.getenv("SCHEDULER_JITTER", "30"))
+
+    def add_interval(name, env, default, fn, blocking=False):
+        interval = float(os.getenv(env, default))
+        if interval > 0:
+            scheduler.add(name, fn, Interval(interval), jitter=min(jitter, interval / 10), blocking=blocking)
+
+    def add_cron(name, env, default, fn, blocking=False):
+        expression = os.getenv(env, default).strip()
+        if expression:
+            scheduler.add(name, fn, Cron(expression), jitter=jitter, blocking=blocking)
+
+    busy_timeout_ms = db.busy_timeout_ms
+    add_interval("income_settle", "INCOME_SETTLE_INTERVAL", "0", settle_income_job)
+    add_interval("ledger_snapshot", "LEDGER_SNAPSHOT_INTERVAL", "3600", ledger_snapshot_job)
+    add_interval("media_warmup", "MEDIA_WARMUP_INTERVAL", "3600", media_warmup_job)
+    # Обслуживание базы — в потоке планировщика со своим соединением (см. maintenance.py)
+    add_interval(
+        "wal_checkpoint", "WAL_CHECKPOINT_INTERVAL", "300",
+        lambda: maintenance.checkpoint(db.path, busy_timeout_ms), blocking=True
+    )
+    add_cron(
+        "db_optimize", "DB_MAINTENANCE_CRON", "30 4 * * *",
+        lambda: maintenance.optimize(
+            db.path, busy_timeout_ms,
+            analysis_limit=int(os.getenv("DB_ANALYSIS_LIMIT", "1000")),
+            vacuum_pages=int(os.getenv("DB_INCREMENTAL_VACUUM_PAGES", "2000"))
+        ),
+        blocking=True
+    )
+    retention_days = float(os.getenv("LEDGER_SNAPSHOT_RETENTION_DAYS", "30"))
+    if retention_days > 0:
+        add_cron(
+            "prune_ledger_snapshots", "DB_MAINTENANCE_CRON", "30 4 * * *",
+            lambda: maintenance.prune_ledger_snapshots(db.path, retention_days, busy_timeout_ms), blocking=True
+        )
+
+async def start_services():
+    """Прогрев кэшей и запуск фоновых заданий перед приёмом обновлений."""
+    global metrics_runner
+    events.start()
+    hot_store.start()
+    if metrics_port:
+        # Отказы ограничителя частоты — по ключам лимитов (команды и "*")
+        collectors = [scheduler, throttling, hot_store]
+        if outbound is not None:
+            collectors.append(outbound)
+        if db.group_commit_stats is not None:
+            # Размеры пачек и длительность коммитов в режиме группового коммита
+            collectors.append(db.group_commit_stats)
+        try:
+            metrics_runner = await start_metrics_server(
+                handler_metrics, query_metrics, os.getenv("METRICS_HOST", "127.0.0.1"), metrics_port,
+                collectors=collectors
+            )
+        except OSError as e:
+            logger.error(f"Не удалось запустить эндпоинт метрик на порту {metrics_port}: {e}", exc_info=True)
+    # Прогрев кэша картинок; с MEDIA_WARMUP_CHAT_ID недостающие картинки сразу загружаются в этот чат
+    try:
+        await media_warmup_job()
+        logger.info(f"Кэш картинок прогрет: {media_cache.stats()}")
+    except Exception as e:
+        logger.error(f"Ошибка при прогреве кэша картинок: {e}", exc_info=True)
+
+    # Зачисление дохода, снимки журнала, обслуживание базы и прогрев кэшей — по расписанию
+    try:
+        schedule_jobs()
+    except ValueError as e:
+        logger.error(f"Ошибка в настройках расписания фоновых заданий: {e}", exc_info=True)
+    scheduler.start()
+
+async def stop_services():
+    # Выполняющееся обслуживание базы дорабатывает до закрытия соединений
+    await scheduler.stop()
+    await events.stop()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    if outbound is not None:
+        await outbound.close()
+    await bot.session.close()
+    # Отложенные изменения игроков записываются до закрытия базы
+    try:
+        await hot_store.close()
+    except Exception as e:
+        logger.error(f"Ошибка при записи горячего состояния игроков: {e}", exc_info=True)
+    db.close()
+    logger.info("Соединение с базой данных закрыто.")
+
 async def main():
+    # Режим получения обновлений: polling (по умолчанию) или webhook
+    bot_mode = os.getenv("BOT_MODE", "polling")
     try:
-        await dispatcher.start_polling(bot)
+        await start_services()
+        if bot_mode == "webhook":
+            await run_webhook(
+                dispatcher, bot,
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", "8080")),
+                path=os.getenv("WEBHOOK_PATH", "/webhook"),
+                secret_token=os.getenv("WEBHOOK_SECRET"),
+                webhook_url=os.getenv("WEBHOOK_URL"),  # Публичный адрес для setWebhook (необязательно)
+                workers=int(os.getenv("WEBHOOK_WORKERS", "8")),
+                queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+            )
+        else:
+            await dispatcher.start_polling(bot)
     except Exception as e:
         logger.critical(f"Критическая ошибка во время запуска бота: {e}", exc_info=True)
-        print(f"Критическая ошибка во время запуска бота: {e}")
     finally:
-        await bot.session.close()
-        conn.close()
-        logger.info("Соединение с базой данных закрыто.")
-        print("Соединение с базой данных закрыто.")
+        await stop_services()
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if os.getenv("BOT_MODE") == "supervisor":
+            # Несколько процессов-воркеров с шардированием по user_id (см. supervisor.py);
+            # BOT_TRANSPORT — как супервизор получает обновления: polling или webhook
+            from supervisor import run_supervisor
+            init_logging()
+            asyncio.run(run_supervisor(
+                create_bot(),
+                processes=int(os.getenv("BOT_PROCESSES", str(os.cpu_count() or 1))),
+                db_path=db_path,
+                transport=os.getenv("BOT_TRANSPORT", "polling"),
+                concurrency=int(os.getenv("WEBHOOK_WORKERS", "8")),
+                queue_size=int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000")),
+                host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                port=int(os.getenv("WEBHOOK_PORT", "8080")),
+                path=os.getenv("WEBHOOK_PATH", "/webhook"),
+                secret_token=os.getenv("WEBHOOK_SECRET"),
+                webhook_url=os.getenv("WEBHOOK_URL")
+            ))
+        else:
+            setup()
+            asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Бот остановлен вручную.")
-        print("Бот остановлен вручную.")
@@ -0,0 +1,46 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from callbacks import UPGRADE_CAFE, encode
+from game_actions import UPGRADE_COST
+
+# =======================
+# Вид кофейни (/my_cafe)
+# =======================
+#
+# Подпись /my_cafe строится из горячего состояния игрока (player_state.py):
+# баланс, уровень, здания и число достижений уже в памяти, на промахе
+# состояние читается из базы одним запросом. Готовая подпись хранится в самом
+# состоянии вместе с его версией и снимком справочника (названия зданий):
+# любое изменение в памяти увеличивает версию, запись через базу заменяет
+# состояние новым объектом. Повторный просмотр без изменений — поиск игрока в
+# словаре горячего состояния и сравнение версии. Клавиатура одна для всех.
+
+UPGRADE_KEYBOARD = InlineKeyboardMarkup(inline_keyboard=[[
+    InlineKeyboardButton(text=f"Улучшить кофейню ({UPGRADE_COST} монет)", callback_data=encode(UPGRADE_CAFE))
+]])
+
+
+def render_caption(state, snapshot):
+    response = (
+        f"🏠 **Кофейня:** {state.cafe_name}\n💰 **Баланс:** {state.balance} монет\n🔼 **Уровень:** {state.level}"
+        f"\n🎖️ **Достижений:** {len(state.achievements)}"
+    )
+    # В состоянии игрока — id зданий, названия берутся из справочника
+    buildings_by_id = snapshot.buildings_by_id
+    lines = [
+        f"\n- {buildings_by_id[building_id].name} (Уровень {level})"
+        for building_id, level in state.buildings.items() if building_id in buildings_by_id
+    ]
+    if lines:
+        return response + "\n\n🏢 **Здания:**" + "".join(lines)
+    return response + "\n\n🏢 **Зданий:** Нет"
+
+
+def render(state, snapshot):
+    """(подпись, клавиатура) для /my_cafe; подпись берётся из кэша, если состояние не менялось."""
+    cached = state.rendered
+    if cached is not None and cached[0] == state.version and cached[1] is snapshot:
+        return cached[2], UPGRADE_KEYBOARD
+    caption = render_caption(state, snapshot)
+    state.rendered = (state.version, snapshot, caption)
+    return caption, UPGRADE_KEYBOARD
@@ -0,0 +1,222 @@
+import base64
+import logging
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# callback_data инлайн-кнопок
+# =======================
+#
+# Кнопка хранит короткий токен: "~" + base64url(id действия, версия, целые
+# значения в varint). Вместо названий (кириллица в UTF-8 — по 2 байта на
+# букву) в токен кладутся id сущностей (building_id и т. п.), поэтому он
+# укладывается в лимит Telegram 64 байта с большим запасом и не зависит от
+# символов в названиях.
+#
+# Обработчик выбирается по id действия одним поиском в словаре
+# (CallbackRouter.dispatch), а не перебором фильтров.
+#
+# Кнопки живут в старых сообщениях сколько угодно, поэтому:
+# - id действий нельзя менять и переиспользовать;
+# - при изменении состава значений версия действия увеличивается, а для
+#   прежней версии регистрируется преобразование в новую (upgrades);
+# - строки формата до кодека ("buy_<название>", "lb:<рейтинг>:<страница>",
+#   "upgrade_cafe", "button1") разбираются как версия 0.
+
+TOKEN_PREFIX = "~"
+
+# Лимит Telegram на callback_data, байт
+MAX_CALLBACK_DATA = 64
+
+
+class Action:
+    __slots__ = ("action_id", "name", "fields", "version")
+
+    def __init__(self, action_id, name, fields, version):
+        self.action_id = action_id
+        self.name = name
+        # Число значений в текущей версии
+        self.fields = fields
+        self.version = version
+
+    def __repr__(self):
+        return f"Action({self.action_id}, {self.name!r}, v{self.version})"
+
+
+_actions_by_id = {}
+
+
+def _action(action_id, name, fields=0, version=1):
+    if action_id in _actions_by_id or not 0 < action_id < 256:
+        raise ValueError(f"Некорректный или повторный id действия: {action_id}")
+    action = _actions_by_id[action_id] = Action(action_id, name, fields, version)
+    return action
+
+
+# Имя действия — ключ ограничителя частоты и метка метрик (см. throttling.throttle_key)
+BUY_BUILDING = _action(1, "buy", fields=1)          # building_id
+UPGRADE_CAFE = _action(2, "upgrade_cafe")
+LEADERBOARD = _action(3, "lb", fields=2)            # board_id, страница
+MENU_BUTTON = _action(4, "button", fields=1)        # номер кнопки
+
+
+def action_names():
+    return {action.name for action in _actions_by_id.values()}
+
+
+def _parse_legacy_leaderboard(rest):
+    board_name, page = rest.split(":", 1)
+    return board_name, int(page)
+
+
+# Формат до кодека (версия 0): точные значения и префиксы -> (действие, разбор остатка строки)
+_LEGACY_EXACT = {
+    "upgrade_cafe": (UPGRADE_CAFE, ()),
+    "button1": (MENU_BUTTON, (1,)),
+    "button2": (MENU_BUTTON, (2,)),
+}
+_LEGACY_PREFIXES = {
+    "buy_": (BUY_BUILDING, lambda rest: (rest,)),
+    "lb:": (LEADERBOARD, _parse_legacy_leaderboard),
+}
+
+
+# -----------------------
+# Кодирование
+# -----------------------
+
+def _write_varint(out, value):
+    # zigzag: отрицательные числа тоже занимают мало байт
+    value = (value << 1) ^ (value >> 63) if value < 0 else value << 1
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varints(data, offset):
+    values = []
+    value = shift = 0
+    for byte in data[offset:]:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value = shift = 0
+    if shift:
+        raise ValueError("Оборванное значение")
+    return tuple(values)
+
+
+def encode(action, *values):
+    """Токен callback_data для действия с целыми значениями."""
+    if len(values) != action.fields:
+        raise ValueError(f"{action!r}: ожидается значений {action.fields}, передано {len(values)}")
+    out = bytearray((action.action_id, action.version))
+    for value in values:
+        _write_varint(out, int(value))
+    token = TOKEN_PREFIX + base64.urlsafe_b64encode(bytes(out)).rstrip(b"=").decode("ascii")
+    if len(token) > MAX_CALLBACK_DATA:
+        raise ValueError(f"callback_data длиннее {MAX_CALLBACK_DATA} байт: {action!r}")
+    return token
+
+
+def _legacy_prefix(data):
+    # Префикс до первого "_" или ":" включительно
+    separators = [index for index in (data.find("_"), data.find(":")) if index >= 0]
+    return data[:min(separators) + 1] if separators else None
+
+
+def _decode_legacy(data):
+    entry = _LEGACY_EXACT.get(data)
+    if entry is not None:
+        return entry[0], 0, entry[1]
+    prefix = _legacy_prefix(data)
+    entry = _LEGACY_PREFIXES.get(prefix)
+    if entry is None:
+        return None
+    action, parse = entry
+    return action, 0, parse(data[len(prefix):])
+
+
+def decode(data):
+    """(действие, версия, значения) или None, если данные не распознаны."""
+    if not data:
+        return None
+    try:
+        if not data.startswith(TOKEN_PREFIX):
+            return _decode_legacy(data)
+        raw = base64.urlsafe_b64decode(data[1:] + "=" * (-(len(data) - 1) % 4))
+        if len(raw) < 2:
+            return None
+        action = _actions_by_id.get(raw[0])
+        if action is None:
+            return None
+        return action, raw[1], _read_varints(raw, 2)
+    except ValueError:
+        return None
+
+
+def action_name(data):
+    """Имя действия без разбора значений (для ограничителя и метрик) или None."""
+    if data and data.startswith(TOKEN_PREFIX):
+        try:
+            action = _actions_by_id.get(base64.urlsafe_b64decode(data[1:4] + "=")[0])
+        except (ValueError, IndexError):
+            return None
+        return action.name if action else None
+    if not data:
+        return None
+    entry = _LEGACY_EXACT.get(data) or _LEGACY_PREFIXES.get(_legacy_prefix(data))
+    return entry[0].name if entry else None
+
+
+# -----------------------
+# Маршрутизация
+# -----------------------
+
+class CallbackRouter:
+    """Обработчики действий: handler(query, *значения текущей версии)."""
+
+    def __init__(self):
+        self._handlers = {}
+
+    def handler(self, action, upgrades=None):
+        """
+        Декоратор. upgrades — {версия: функция(значения) -> значения следующей версии}
+        для кнопок, созданных прежними версиями (0 — формат до кодека).
+        """
+        def register(handler):
+            self._handlers[action.action_id] = (handler, dict(upgrades or {}))
+            return handler
+        return register
+
+    def resolve(self, data):
+        """(обработчик, значения текущей версии) или None для неизвестной/устаревшей кнопки."""
+        decoded = decode(data)
+        if decoded is None:
+            return None
+        action, version, values = decoded
+        entry = self._handlers.get(action.action_id)
+        if entry is None or version > action.version:
+            return None
+        handler, upgrades = entry
+        try:
+            while version < action.version:
+                values = upgrades[version](values)
+                version += 1
+        except (LookupError, ValueError, TypeError):
+            return None
+        if len(values) != action.fields:
+            return None
+        return handler, values
+
+    async def dispatch(self, query):
+        """Вызывает обработчик кнопки. Возвращает False, если кнопка не распознана."""
+        resolved = self.resolve(query.data)
+        if resolved is None:
+            return False
+        handler, values = resolved
+        await handler(query, *values)
+        return True
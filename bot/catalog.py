@@ -0,0 +1,144 @@
+import logging
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Optional
+
+from aiogram.types import InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from callbacks import BUY_BUILDING, encode
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Кэш справочников: здания, ресурсы, достижения
+# =======================
+#
+# Справочные таблицы маленькие и меняются только администратором, поэтому
+# читаем их один раз и держим в памяти неизменяемым снимком. Горячие команды
+# (/shop, покупка, улучшение) обращаются только к снимку, без запросов к базе.
+# После ручной правки таблиц нужно вызвать reload().
+
+
+@dataclass(frozen=True)
+class Building:
+    building_id: int
+    name: str
+    base_cost: int
+    income_multiplier: int
+    resource_cost: int
+    required_resource: Optional[str]
+    required_resource_id: Optional[int]
+
+
+@dataclass(frozen=True)
+class Resource:
+    resource_id: int
+    name: str
+
+
+@dataclass(frozen=True)
+class Achievement:
+    achievement_id: int
+    name: str
+    description: str
+    condition: str
+
+
+def shop_callback_data(building):
+    return encode(BUY_BUILDING, building.building_id)
+
+
+class CatalogSnapshot:
+    """Неизменяемый снимок справочников с готовыми индексами и разметкой /shop."""
+
+    def __init__(self, buildings, resources, achievements):
+        self.buildings = tuple(buildings)
+        self.resources = tuple(resources)
+        self.achievements = tuple(achievements)
+        self.buildings_by_name = MappingProxyType({b.name: b for b in self.buildings})
+        self.buildings_by_id = MappingProxyType({b.building_id: b for b in self.buildings})
+        self.resources_by_name = MappingProxyType({r.name: r for r in self.resources})
+        self.resources_by_id = MappingProxyType({r.resource_id: r for r in self.resources})
+        self.achievements_by_id = MappingProxyType({a.achievement_id: a for a in self.achievements})
+        self.resource_names = tuple(r.name for r in self.resources)
+        # Требования по ресурсам: имя здания -> (ресурс, количество)
+        self.resource_requirements = MappingProxyType({
+            b.name: (b.required_resource, b.resource_cost)
+            for b in self.buildings if b.required_resource
+        })
+        self.shop_text, self.shop_keyboard = self._render_shop()
+
+    def _render_shop(self):
+        if not self.buildings:
+            return None, None
+        response = "🏪 **Доступные здания для покупки:**\n"
+        for building in self.buildings:
+            response += f"- *{building.name}*: Стоимость - {building.base_cost} монет\n"
+
+        builder = InlineKeyboardBuilder()
+        for building in self.buildings:
+            builder.add(InlineKeyboardButton(
+                text=f"Купить {building.name} ({building.base_cost} монет)",
+                callback_data=shop_callback_data(building)
+            ))
+        return response, builder.as_markup()
+
+
+def load_snapshot(conn):
+    buildings = [
+        Building(*row) for row in conn.execute("""
+            SELECT b.building_id, b.name, b.base_cost, b.income_multiplier, b.resource_cost,
+                   b.required_resource, r.resource_id
+            FROM buildings b LEFT JOIN resources r ON r.name = b.required_resource
+            ORDER BY b.building_id
+        """)
+    ]
+    resources = [
+        Resource(*row) for row in conn.execute("""
+            SELECT resource_id, name FROM resources ORDER BY resource_id
+        """)
+    ]
+    achievements = [
+        Achievement(*row) for row in conn.execute("""
+            SELECT achievement_id, name, description, condition
+            FROM achievements ORDER BY achievement_id
+        """)
+    ]
+    return CatalogSnapshot(buildings, resources, achievements)
+
+
+class Catalog:
+    """Держит текущий снимок справочников; замена снимка атомарна для читателей."""
+
+    def __init__(self):
+        self._snapshot = CatalogSnapshot((), (), ())
+        self._listeners = []
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    def load(self, conn):
+        """Синхронная загрузка (при старте, до запуска event loop)."""
+        self._set(load_snapshot(conn))
+        return self._snapshot
+
+    async def reload(self, db):
+        """Перечитывает справочники через пул соединений, например после правки администратором."""
+        self._set(await db.read(load_snapshot))
+        return self._snapshot
+
+    def on_reload(self, callback):
+        """Регистрирует callback(snapshot), вызываемый после каждой загрузки снимка."""
+        self._listeners.append(callback)
+        return callback
+
+    def _set(self, snapshot):
+        self._snapshot = snapshot
+        logger.info(
+            f"Справочники загружены: зданий {len(snapshot.buildings)}, "
+            f"ресурсов {len(snapshot.resources)}, достижений {len(snapshot.achievements)}."
+        )
+        for callback in self._listeners:
+            callback(snapshot)
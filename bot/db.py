@@ -0,0 +1,136 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from group_commit import GroupCommitWriter
+from metrics import InstrumentedConnection
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Асинхронный слой доступа к базе данных
+# =======================
+#
+# sqlite3 блокирует поток, поэтому все запросы выполняются вне event loop:
+# - записи идут через один выделенный поток-писатель (SQLite всё равно
+#   допускает только одного писателя, так мы избегаем SQLITE_BUSY между своими же потоками);
+# - чтения идут через ограниченный пул потоков, у каждого потока своё соединение.
+# В режиме WAL читатели не блокируют писателя и наоборот.
+# При group_commit=True записи вместо потока-писателя идут через GroupCommitWriter
+# (см. group_commit.py): много операций — одна транзакция и один fsync.
+# С query_metrics (metrics.QueryMetrics) каждый запрос замеряется (см. metrics.py).
+
+
+class Database:
+    def __init__(self, path, pool_size=4, busy_timeout_ms=5000,
+                 group_commit=False, group_commit_interval_ms=2, group_commit_max_batch=64, query_metrics=None):
+        self.path = path
+        self.pool_size = max(1, int(pool_size))
+        self.busy_timeout_ms = int(busy_timeout_ms)
+        self.query_metrics = query_metrics
+        self._local = threading.local()
+        self._connections = []
+        self._connections_lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        self._readers = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix="db-reader")
+        self._closed = False
+        self._group_writer = None
+        if group_commit:
+            self._group_writer = GroupCommitWriter(
+                self._connect,
+                flush_interval_ms=group_commit_interval_ms,
+                max_batch_size=group_commit_max_batch
+            )
+
+    # -----------------------
+    # Соединения
+    # -----------------------
+
+    def _connect(self):
+        if self.query_metrics is not None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False,
+                                   factory=InstrumentedConnection)
+            conn.metrics = self.query_metrics
+        else:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {self.busy_timeout_ms}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        # В режиме WAL synchronous=NORMAL безопасен и не делает fsync на каждый commit
+        conn.execute("PRAGMA synchronous = NORMAL")
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+
+    def _connection(self):
+        # Одно соединение на поток: курсоры создаются на каждую операцию
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _run_read(self, fn, args):
+        return fn(self._connection(), *args)
+
+    def _run_write(self, fn, args):
+        conn = self._connection()
+        # Контекстный менеджер соединения делает commit или rollback при ошибке
+        with conn:
+            return fn(conn, *args)
+
+    async def _submit(self, executor, runner, fn, args):
+        if self._closed:
+            raise RuntimeError("База данных уже закрыта.")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, runner, fn, args)
+
+    # -----------------------
+    # Публичный API
+    # -----------------------
+
+    async def read(self, fn, *args):
+        """Выполняет fn(conn, *args) в пуле читателей."""
+        return await self._submit(self._readers, self._run_read, fn, args)
+
+    async def write(self, fn, *args):
+        """Выполняет fn(conn, *args) в потоке-писателе одной транзакцией."""
+        if self._group_writer is not None:
+            if self._closed:
+                raise RuntimeError("База данных уже закрыта.")
+            return await self._group_writer.submit(fn, args)
+        return await self._submit(self._writer, self._run_write, fn, args)
+
+    async def fetchone(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.read(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        """Выполняет одиночный изменяющий запрос и возвращает rowcount."""
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def executemany(self, sql, seq_of_params):
+        return await self.write(lambda conn: conn.executemany(sql, seq_of_params).rowcount)
+
+    @property
+    def group_commit_stats(self):
+        return self._group_writer.stats if self._group_writer is not None else None
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        if self._group_writer is not None:
+            self._group_writer.close()
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.error(f"Ошибка при закрытии соединения с базой данных: {e}", exc_info=True)
+            self._connections.clear()
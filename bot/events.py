@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# События изменения состояния для веб-клиента
+# =======================
+#
+# Бот публикует изменения игроков в локальную шину — unix-сокет, который
+# слушает web/ws_server.py (EVENTS_SOCKET). Событие — строка JSON:
+#   {"channel": "cafe:<user_id>", "changes": {"balance": 150, "buildings.Склад": 2}}
+#   {"channel": "leaderboard", "changes": {"1": {...}, "2": {...}}}
+# Значения полей абсолютные, поэтому повторное применение события ничего не
+# ломает. Номера версий (seq) присваивает ws_server для каждого канала.
+#
+# Публикация никогда не блокирует хендлер: события копятся в ограниченной
+# очереди и отправляются фоновой задачей; если сервер недоступен или очередь
+# переполнена, события отбрасываются (веб-клиент восстановится по снимку).
+
+CAFE_CHANNEL_PREFIX = "cafe:"
+LEADERBOARD_CHANNEL = "leaderboard"
+
+
+def cafe_channel(user_id):
+    return f"{CAFE_CHANNEL_PREFIX}{user_id}"
+
+
+class EventPublisher:
+    def __init__(self, socket_path=None, queue_size=10000, reconnect_delay=1.0):
+        self.socket_path = socket_path
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self.published = 0
+        self.dropped = 0
+        self._queue = None
+        self._task = None
+
+    @property
+    def enabled(self):
+        return self._task is not None
+
+    def publish(self, channel, changes):
+        if self._task is None or not changes:
+            return
+        try:
+            self._queue.put_nowait((channel, changes))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def start(self):
+        if self.socket_path and self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run(), name="events-publisher")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                _, writer = await asyncio.open_unix_connection(self.socket_path)
+            except OSError as e:
+                logger.debug(f"Шина событий недоступна ({self.socket_path}): {e}")
+                await asyncio.sleep(self.reconnect_delay)
+                continue
+            logger.info(f"Подключено к шине событий: {self.socket_path}")
+            try:
+                while True:
+                    channel, changes = await self._queue.get()
+                    line = json.dumps({"channel": channel, "changes": changes}, ensure_ascii=False)
+                    writer.write(line.encode() + b"\n")
+                    # Если пишем быстрее, чем сервер читает, ждём освобождения буфера
+                    await writer.drain()
+                    self.published += 1
+            except (ConnectionError, OSError) as e:
+                logger.warning(f"Соединение с шиной событий потеряно: {e}")
+            finally:
+                writer.close()
+
+
+class LeaderboardEvents:
+    """
+    Подписчик Leaderboards.on_update: публикует баланс/уровень/название в канал
+    кофейни и текущий топ в канал лидерборда.
+    """
+
+    def __init__(self, leaderboards, publisher, board="balance", size=10):
+        self.leaderboards = leaderboards
+        self.publisher = publisher
+        self.board = board
+        self.size = size
+        self._members = set()
+
+    def top(self):
+        """Места топа {"1": {...}, ...}; незанятые места — None."""
+        board = self.leaderboards.boards[self.board]
+        players = self.leaderboards.players
+        top = {str(position): None for position in range(1, self.size + 1)}
+        for position, (_, user_id) in enumerate(board.entries.slice(0, self.size), start=1):
+            entry = players[user_id]
+            top[str(position)] = {
+                "user_id": user_id, "cafe_name": entry.cafe_name,
+                "balance": entry.balance, "level": entry.level, "buildings": entry.buildings,
+            }
+        return top
+
+    def __call__(self, user_id, cafe_name=None, balance=None, level=None, buildings=None, buildings_delta=0):
+        if not self.publisher.enabled:
+            return
+        changes = {}
+        if cafe_name is not None:
+            changes["cafe_name"] = cafe_name
+        if balance is not None:
+            changes["balance"] = balance
+        if level is not None:
+            changes["level"] = level
+        self.publisher.publish(cafe_channel(user_id), changes)
+        # Публикуем топ целиком: в режиме супервизора рейтинг меняют несколько
+        # процессов, а ws_server сам сравнивает места и рассылает только изменившиеся
+        top = self.top()
+        members = {row["user_id"] for row in top.values() if row is not None}
+        # Топ публикуется, только если игрок в нём есть или только что из него выпал
+        if user_id in members or user_id in self._members:
+            self.publisher.publish(LEADERBOARD_CHANNEL, top)
+        self._members = members
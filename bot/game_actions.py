@@ -0,0 +1,167 @@
+import logging
+
+import income
+import ledger
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Игровые действия
+# =======================
+#
+# Единственная реализация изменяющих операций, общая для команд и callback-кнопок.
+# Каждая функция принимает соединение и выполняется целиком внутри одной
+# транзакции (через db.write). Проверка условий и списание делаются одним
+# условным UPDATE ... WHERE balance >= ? RETURNING, поэтому параллельные нажатия
+# не могут списать монеты дважды: второй UPDATE просто не найдёт строку.
+#
+# Перед изменением уровня или зданий накопленный доход зачисляется по старой
+# ставке (см. income.py). Каждое изменение монет и ресурсов дописывается в
+# журнал в той же транзакции (см. ledger.py).
+#
+# Зачисление дохода при просмотре и /collect для игроков в памяти выполняет
+# player_state.HotStore (settle_income, collect) с отложенной записью в базу;
+# collect здесь — та же операция сразу в базе (bench/bench_game_actions.py).
+#
+# Таблицы игрока ссылаются на справочники по id (resource_id, building_id);
+# функции получают объекты справочников из catalog.py. Названия остаются в
+# журнале и ключах достижений.
+#
+# Функции возвращают (статус, данные). Статусы перечислены ниже.
+
+UPGRADE_COST = 50
+START_BALANCE = 100
+START_CAFE_NAME = "Street Cafe"
+
+OK = "ok"
+NOT_REGISTERED = "not_registered"
+NO_COINS = "no_coins"
+NO_RESOURCE = "no_resource"
+
+
+def register_player(conn, user_id):
+    """Регистрирует игрока. Данные — True, если игрок создан впервые."""
+    inserted = conn.execute("""
+        INSERT OR IGNORE INTO players (user_id, cafe_name, balance, last_income, level)
+        VALUES (?, ?, ?, ?, ?)
+    """, (user_id, START_CAFE_NAME, START_BALANCE, income.now(), 1)).rowcount
+    if inserted:
+        ledger.record(conn, [(user_id, ledger.COINS, START_BALANCE, "register")])
+    return OK, inserted > 0
+
+
+def upgrade_cafe(conn, user_id, engine):
+    """Улучшает кофейню за UPGRADE_COST монет. Данные — (новый уровень, новый баланс, достижения)."""
+    income.settle(conn, user_id)
+    row = conn.execute("""
+        UPDATE players SET balance = balance - ?, level = level + 1
+        WHERE user_id = ? AND balance >= ?
+        RETURNING level, balance
+    """, (UPGRADE_COST, user_id, UPGRADE_COST)).fetchone()
+    if not row:
+        # Прежнее поведение: незарегистрированный игрок получает тот же ответ, что и при нехватке монет
+        return NO_COINS, None
+    new_level, new_balance = row
+    ledger.record(conn, [(user_id, ledger.COINS, -UPGRADE_COST, "upgrade")])
+    earned_achievements = engine.grant(conn, user_id, [("level", None, new_level - 1, new_level)])
+    return OK, (new_level, new_balance, earned_achievements)
+
+
+def _diagnose_purchase(conn, user_id, building):
+    # Вызывается только при отказе: выясняем причину для сообщения пользователю
+    row = conn.execute("""
+        SELECT p.balance,
+               (SELECT quantity FROM user_resources WHERE user_id = p.user_id AND resource_id = ?)
+        FROM players p WHERE p.user_id = ?
+    """, (building.required_resource_id, user_id)).fetchone()
+    if not row:
+        return NOT_REGISTERED, None
+    balance, quantity = row
+    if balance < building.base_cost:
+        return NO_COINS, balance
+    return NO_RESOURCE, (building.required_resource, quantity or 0)
+
+
+def buy_building(conn, user_id, building, engine):
+    """
+    Покупает здание (или повышает его уровень).
+    Данные — (уровень здания, новый баланс, достижения, остаток требуемого ресурса или None).
+    """
+    income.settle(conn, user_id)
+    required_resource = building.required_resource
+    # Ресурс без записи в справочнике (resource_id None) купить не позволит: EXISTS не найдёт строку
+    # Списываем монеты только если хватает и монет, и ресурса
+    row = conn.execute("""
+        UPDATE players SET balance = balance - ?
+        WHERE user_id = ? AND balance >= ?
+          AND (? IS NULL OR EXISTS (
+              SELECT 1 FROM user_resources
+              WHERE user_id = players.user_id AND resource_id = ? AND quantity >= ?
+          ))
+        RETURNING balance
+    """, (
+        building.base_cost, user_id, building.base_cost,
+        required_resource, building.required_resource_id, building.resource_cost
+    )).fetchone()
+    if not row:
+        return _diagnose_purchase(conn, user_id, building)
+    new_balance = row[0]
+    reason = f"buy:{building.name}"
+    entries = [(user_id, ledger.COINS, -building.base_cost, reason)]
+
+    remaining_resource = None
+    if required_resource and building.resource_cost:
+        # Достаточность ресурса уже проверена в той же транзакции
+        remaining_resource = conn.execute("""
+            UPDATE user_resources SET quantity = quantity - ?
+            WHERE user_id = ? AND resource_id = ?
+            RETURNING quantity
+        """, (building.resource_cost, user_id, building.required_resource_id)).fetchone()[0]
+        entries.append((user_id, required_resource, -building.resource_cost, reason))
+    ledger.record(conn, entries)
+
+    new_level = conn.execute("""
+        INSERT INTO user_buildings (user_id, building_id, level)
+        VALUES (?, ?, 1)
+        ON CONFLICT(user_id, building_id) DO UPDATE SET level = level + 1
+        RETURNING level
+    """, (user_id, building.building_id)).fetchone()[0]
+
+    changes = [("building", building.name, new_level - 1, new_level)]
+    if new_level == 1 and engine.tracks("buildings"):
+        buildings_count = conn.execute(
+            "SELECT COUNT(*) FROM user_buildings WHERE user_id = ?", (user_id,)
+        ).fetchone()[0]
+        changes.append(("buildings", None, buildings_count - 1, buildings_count))
+    earned_achievements = engine.grant(conn, user_id, changes)
+    return OK, (new_level, new_balance, earned_achievements, remaining_resource)
+
+
+def collect(conn, user_id, resource, amount, engine):
+    """Начисляет ресурс (catalog.Resource). Данные — (новое количество, достижения)."""
+    row = conn.execute("""
+        INSERT INTO user_resources (user_id, resource_id, quantity)
+        SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM players WHERE user_id = ?)
+        ON CONFLICT(user_id, resource_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        RETURNING quantity
+    """, (user_id, resource.resource_id, amount, user_id)).fetchone()
+    if not row:
+        return NOT_REGISTERED, None
+    new_quantity = row[0]
+    ledger.record(conn, [(user_id, resource.name, amount, "collect")])
+    earned_achievements = engine.grant(conn, user_id, [("resource", resource.name, new_quantity - amount, new_quantity)])
+    return OK, (new_quantity, earned_achievements)
+
+
+def add_coins(conn, user_id, coins, engine):
+    """Начисляет монеты. Данные — (новый баланс, достижения)."""
+    row = conn.execute("""
+        UPDATE players SET balance = balance + ? WHERE user_id = ?
+        RETURNING balance
+    """, (coins, user_id)).fetchone()
+    if not row:
+        return NOT_REGISTERED, None
+    new_balance = row[0]
+    ledger.record(conn, [(user_id, ledger.COINS, coins, "admin")])
+    earned_achievements = engine.grant(conn, user_id, [("balance", None, new_balance - coins, new_balance)])
+    return OK, (new_balance, earned_achievements)
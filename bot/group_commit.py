@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+
+from metrics import Histogram, render_histograms, render_values
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Групповой коммит
+# =======================
+#
+# При частых /collect и покупках пропускная способность упирается в fsync на
+# каждый commit. В режиме группового коммита записи от разных хендлеров
+# складываются в очередь, поток-писатель применяет их пачкой в одной транзакции
+# (каждую операцию — в своём SAVEPOINT, чтобы ошибка одной не откатывала
+# остальные) и делает один commit. Хендлер получает результат только после
+# того, как его пачка записана на диск.
+
+_STOP = object()
+
+# Границы корзин гистограммы размера пачки, операций
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+
+class GroupCommitStats:
+    """Счётчики для метрик: размеры пачек и длительность коммитов. Пишет только поток-писатель."""
+
+    def __init__(self):
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.commit_durations = Histogram()
+        self.batches = 0
+        self.operations = 0
+        self.failed_operations = 0
+        self.max_batch_size = 0
+        self.last_batch_size = 0
+        self.commit_seconds_total = 0.0
+        self.commit_seconds_max = 0.0
+        self.last_commit_seconds = 0.0
+
+    def record(self, batch_size, failed, commit_seconds):
+        self.batches += 1
+        self.operations += batch_size
+        self.failed_operations += failed
+        self.last_batch_size = batch_size
+        self.max_batch_size = max(self.max_batch_size, batch_size)
+        self.last_commit_seconds = commit_seconds
+        self.commit_seconds_total += commit_seconds
+        self.commit_seconds_max = max(self.commit_seconds_max, commit_seconds)
+        self.batch_sizes.observe(batch_size)
+        self.commit_durations.observe(commit_seconds)
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "operations": self.operations,
+            "failed_operations": self.failed_operations,
+            "avg_batch_size": self.operations / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "last_batch_size": self.last_batch_size,
+            "avg_commit_seconds": self.commit_seconds_total / self.batches if self.batches else 0.0,
+            "max_commit_seconds": self.commit_seconds_max,
+            "last_commit_seconds": self.last_commit_seconds,
+        }
+
+    def render(self):
+        """Метрики для /metrics (metrics.start_metrics_server, collectors)."""
+        return (
+            render_histograms("bot_db_group_commit_batch_size", "Операций записи в одной пачке группового коммита",
+                              None, self.batch_sizes)
+            + render_histograms("bot_db_group_commit_duration_seconds", "Длительность COMMIT пачки",
+                                None, self.commit_durations)
+            + render_values("bot_db_group_commit_failed_operations_total", "counter",
+                            "Операции пачки, откатившиеся с ошибкой", None, self.failed_operations)
+        )
+
+
+def _resolve(future, ok, value):
+    if future.cancelled():
+        return
+    if ok:
+        future.set_result(value)
+    else:
+        future.set_exception(value)
+
+
+class GroupCommitWriter:
+    def __init__(self, connect, flush_interval_ms=2, max_batch_size=64):
+        """
+        connect — функция, создающая соединение для потока-писателя.
+        flush_interval_ms — сколько ждать новых операций, прежде чем коммитить неполную пачку.
+        max_batch_size — максимум операций в одной транзакции.
+        """
+        self._connect = connect
+        self.flush_interval = max(0.0, flush_interval_ms / 1000)
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.stats = GroupCommitStats()
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name="db-group-commit", daemon=True)
+        self._thread.start()
+
+    async def submit(self, fn, args):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._queue.put((fn, args, loop, future))
+        return await future
+
+    def close(self):
+        self._queue.put(_STOP)
+        self._thread.join()
+
+    def _collect_batch(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self._queue.get_nowait() if timeout <= 0 else self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Дописываем текущую пачку и останавливаемся
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _apply_batch(self, conn, batch):
+        results = []
+        failed = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for fn, args, _, _ in batch:
+                conn.execute("SAVEPOINT op")
+                try:
+                    results.append((True, fn(conn, *args)))
+                    conn.execute("RELEASE op")
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    results.append((False, e))
+                    failed += 1
+            started = time.perf_counter()
+            conn.execute("COMMIT")
+            commit_seconds = time.perf_counter() - started
+        except Exception as e:
+            # Не удалось закоммитить пачку: ни одна операция не применена
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            logger.error(f"Ошибка группового коммита ({len(batch)} операций): {e}", exc_info=True)
+            return [(False, e)] * len(batch)
+        self.stats.record(len(batch), failed, commit_seconds)
+        return results
+
+    def _run(self):
+        conn = self._connect()
+        # Транзакциями управляем сами; commit пачки должен быть надёжным,
+        # а fsync делится на все операции пачки
+        conn.isolation_level = None
+        conn.execute("PRAGMA synchronous = FULL")
+        while True:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch = self._collect_batch(first)
+            results = self._apply_batch(conn, batch)
+            for (_, _, loop, future), (ok, value) in zip(batch, results):
+                loop.call_soon_threadsafe(_resolve, future, ok, value)
@@ -0,0 +1,116 @@
+import logging
+import time
+
+import ledger
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Пассивный доход
+# =======================
+#
+# Доход не начисляется периодической задачей по всем игрокам: он считается
+# по формуле в момент, когда игрок смотрит баланс или тратит монеты.
+#
+#   доход в час = INCOME_PER_HOUR * (уровень кофейни + Σ income_multiplier здания * уровень здания)
+#   начислено   = floor(прошло секунд * доход в час / 3600)
+#
+# players.last_income хранит unix-время, до которого доход уже зачислен в balance.
+# При зачислении last_income сдвигается ровно на время, «оплаченное» целыми
+# монетами, поэтому дробная часть не теряется при частых зачислениях.
+# Зачисление обязательно перед любым изменением уровня или зданий, иначе
+# новая ставка применилась бы к прошедшему времени.
+
+INCOME_PER_HOUR = 10
+
+# Начисление для диапазона игроков (user_id > :lower AND user_id <= :upper):
+# ставка считается по зданиям игрока
+_ACCRUAL_SQL = """
+    SELECT user_id, rate, (:now - last_income) * rate / 3600 AS coins
+    FROM (
+        SELECT p.user_id, p.last_income,
+               :per_hour * (p.level + COALESCE(SUM(b.income_multiplier * ub.level), 0)) AS rate
+        FROM players p
+        LEFT JOIN user_buildings ub ON ub.user_id = p.user_id
+        LEFT JOIN buildings b ON b.building_id = ub.building_id
+        WHERE p.user_id > :lower AND p.user_id <= :upper AND p.last_income < :now
+        GROUP BY p.user_id
+    )
+"""
+
+# Запись в журнал — тем же начислением до UPDATE и в той же транзакции
+# (RETURNING в UPDATE ... FROM не видит столбцы подзапроса)
+_LEDGER_SQL = f"""
+    INSERT INTO ledger (user_id, asset, delta, reason, created_at)
+    SELECT user_id, '{ledger.COINS}', coins, 'income', :now FROM ({_ACCRUAL_SQL}) WHERE coins > 0
+"""
+
+# balance и last_income обновляются вместе одним запросом
+_SETTLE_SQL = f"""
+    UPDATE players
+    SET balance = players.balance + accrual.coins,
+        last_income = players.last_income + (accrual.coins * 3600 + accrual.rate - 1) / accrual.rate
+    FROM ({_ACCRUAL_SQL}) AS accrual
+    WHERE players.user_id = accrual.user_id AND accrual.coins > 0
+    RETURNING players.user_id, players.balance
+"""
+
+
+def income_rate(level, buildings):
+    """Доход в час. buildings — пары (income_multiplier, уровень здания)."""
+    return INCOME_PER_HOUR * (level + sum(multiplier * building_level for multiplier, building_level in buildings))
+
+
+def accrued(elapsed_seconds, rate):
+    """(монеты, зачтённые секунды) за elapsed_seconds при доходе rate в час."""
+    if elapsed_seconds <= 0 or rate <= 0:
+        return 0, 0
+    coins = elapsed_seconds * rate // 3600
+    return coins, -(-coins * 3600 // rate)
+
+
+def now():
+    return int(time.time())
+
+
+def _settle_range(conn, lower, upper, at=None):
+    """Зачисляет доход игрокам диапазона и пишет его в журнал. Возвращает [(user_id, новый баланс)]."""
+    params = {"now": now() if at is None else at, "per_hour": INCOME_PER_HOUR, "lower": lower, "upper": upper}
+    conn.execute(_LEDGER_SQL, params)
+    return conn.execute(_SETTLE_SQL, params).fetchall()
+
+
+def settle(conn, user_id, at=None):
+    """
+    Зачисляет накопленный доход игрока в balance. Выполняется внутри транзакции
+    вызывающего. Возвращает новый баланс или None, если зачислять нечего.
+    """
+    rows = _settle_range(conn, user_id - 1, user_id, at)
+    return rows[0][1] if rows else None
+
+
+async def settle_all(db, chunk_size=1000, on_settled=None):
+    """
+    Зачисляет доход всем игрокам порциями по chunk_size, каждая порция — отдельная
+    короткая транзакция. on_settled(user_id, balance) вызывается для каждого
+    изменённого баланса (например, для обновления лидерборда). Возвращает число игроков.
+    """
+    total = 0
+    lower = -1 << 63
+    while True:
+        row = await db.fetchone("""
+            SELECT MAX(user_id) FROM (
+                SELECT user_id FROM players WHERE user_id > ? ORDER BY user_id LIMIT ?
+            )
+        """, (lower, chunk_size))
+        upper = row[0] if row else None
+        if upper is None:
+            break
+        settled = await db.write(_settle_range, lower, upper)
+        if on_settled is not None:
+            for user_id, balance in settled:
+                on_settled(user_id, balance)
+        total += len(settled)
+        lower = upper
+    logger.info(f"Доход зачислен игрокам: {total}")
+    return total
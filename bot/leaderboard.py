@@ -0,0 +1,309 @@
+import logging
+import math
+import random
+
+from aiogram.types import InlineKeyboardButton
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from callbacks import LEADERBOARD, encode
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Инкрементальный лидерборд
+# =======================
+#
+# Рейтинги хранятся в памяти в индексируемом skip list: вставка, удаление,
+# поиск места игрока и доступ по позиции — O(log n). Структура обновляется
+# при каждом изменении баланса/уровня/зданий, поэтому /leaderboard больше не
+# сортирует таблицу players. Первая страница каждого рейтинга кэшируется и
+# пересобирается только если изменение затронуло топ.
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, levels):
+        self.key = key
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+
+class IndexableSkipList:
+    """Отсортированный набор уникальных ключей с поиском ранга и доступом по индексу за O(log n)."""
+
+    def __init__(self, expected_size=1 << 20):
+        self.max_levels = max(1, int(math.log2(max(2, expected_size))) + 1)
+        self.head = _Node(None, self.max_levels)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def _random_level(self):
+        # Геометрическое распределение с p = 1/2; 1.0 - random() лежит в (0, 1]
+        return min(self.max_levels, 1 - int(math.log2(1.0 - random.random())))
+
+    def _find_chain(self, key):
+        chain = [None] * self.max_levels
+        steps = [0] * self.max_levels
+        node = self.head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        chain, steps_at_level = self._find_chain(key)
+        levels = self._random_level()
+        new_node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self.max_levels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, key):
+        chain, _ = self._find_chain(key)
+        target = chain[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self.max_levels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def rank(self, key):
+        """Позиция ключа (с нуля). KeyError, если ключа нет."""
+        node = self.head
+        position = 0
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        candidate = node.next[0]
+        if candidate is None or candidate.key != key:
+            raise KeyError(key)
+        return position
+
+    def slice(self, start, stop):
+        """Ключи с позициями [start, stop)."""
+        if start >= self.size or start >= stop:
+            return []
+        # Спускаемся к позиции start за O(log n), дальше идём по нижнему уровню
+        remaining = start + 1
+        node = self.head
+        for level in reversed(range(self.max_levels)):
+            while node.next[level] is not None and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not None and len(keys) < stop - start:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+
+class PlayerEntry:
+    __slots__ = ("cafe_name", "balance", "level", "buildings")
+
+    def __init__(self, cafe_name, balance, level, buildings):
+        self.cafe_name = cafe_name
+        self.balance = balance
+        self.level = level
+        self.buildings = buildings
+
+
+class Board:
+    def __init__(self, board_id, name, title, field, button_text):
+        # board_id хранится в кнопках (callback_data): менять и переиспользовать нельзя
+        self.board_id = board_id
+        self.name = name
+        self.title = title
+        self.field = field
+        self.button_text = button_text
+        self.entries = IndexableSkipList()
+
+    def key(self, user_id, entry):
+        # Больше значение — выше место; при равенстве раньше зарегистрированный игрок
+        return -(getattr(entry, self.field) or 0), user_id
+
+    def format_line(self, position, entry):
+        line = f"{position}. {entry.cafe_name} - Баланс: {entry.balance} монет, Уровень: {entry.level}"
+        if self.field == "buildings":
+            line += f", Зданий: {entry.buildings}"
+        return line
+
+
+class Leaderboards:
+    def __init__(self, page_size=10):
+        self.page_size = page_size
+        self.players = {}
+        self.boards = {
+            "balance": Board(0, "balance", "Топ игроков по балансу", "balance", "💰 Баланс"),
+            "level": Board(1, "level", "Топ игроков по уровню", "level", "🔼 Уровень"),
+            "buildings": Board(2, "buildings", "Топ игроков по зданиям", "buildings", "🏢 Здания"),
+        }
+        self.boards_by_id = {board.board_id: board for board in self.boards.values()}
+        self._top_cache = {}
+        self._listeners = []
+
+    def on_update(self, callback):
+        """Регистрирует callback(user_id, **изменения), вызываемый после каждого update()."""
+        self._listeners.append(callback)
+        return callback
+
+    # -----------------------
+    # Загрузка и обновление
+    # -----------------------
+
+    def load(self, conn, reset=True):
+        """Строит рейтинги по данным базы (при старте). reset=False добавляет игроков к уже загруженным."""
+        if reset:
+            self.players.clear()
+            for board in self.boards.values():
+                board.entries = IndexableSkipList()
+        self._top_cache.clear()
+        rows = conn.execute("""
+            SELECT p.user_id, p.cafe_name, p.balance, p.level,
+                   (SELECT COUNT(*) FROM user_buildings ub WHERE ub.user_id = p.user_id)
+            FROM players p
+        """)
+        for user_id, cafe_name, balance, level, buildings in rows:
+            entry = PlayerEntry(cafe_name, balance or 0, level or 1, buildings)
+            self.players[user_id] = entry
+            for board in self.boards.values():
+                board.entries.insert(board.key(user_id, entry))
+        logger.info(f"Лидерборд загружен: игроков {len(self.players)}")
+
+    def update(self, user_id, cafe_name=None, balance=None, level=None, buildings=None, buildings_delta=0,
+               notify=True):
+        """
+        Применяет изменение игрока ко всем рейтингам. Неизвестный игрок добавляется.
+        notify=False — не уведомлять подписчиков (изменение пришло от них же).
+        """
+        self._apply(user_id, cafe_name, balance, level, buildings, buildings_delta)
+        if notify:
+            for callback in self._listeners:
+                callback(user_id, cafe_name=cafe_name, balance=balance, level=level,
+                         buildings=buildings, buildings_delta=buildings_delta)
+
+    def _apply(self, user_id, cafe_name, balance, level, buildings, buildings_delta):
+        entry = self.players.get(user_id)
+        if entry is None:
+            entry = PlayerEntry(cafe_name, balance or 0, level or 1, buildings or 0)
+            self.players[user_id] = entry
+            for board in self.boards.values():
+                key = board.key(user_id, entry)
+                board.entries.insert(key)
+                self._invalidate_if_top(board, board.entries.rank(key))
+            return
+
+        old_keys = {name: board.key(user_id, entry) for name, board in self.boards.items()}
+        if cafe_name is not None and cafe_name != entry.cafe_name:
+            entry.cafe_name = cafe_name
+            # Имя отображается во всех рейтингах
+            for board in self.boards.values():
+                self._invalidate_if_top(board, board.entries.rank(old_keys[board.name]))
+        if balance is not None:
+            entry.balance = balance
+        if level is not None:
+            entry.level = level
+        if buildings is not None:
+            entry.buildings = buildings
+        entry.buildings += buildings_delta
+
+        for name, board in self.boards.items():
+            old_key = old_keys[name]
+            new_key = board.key(user_id, entry)
+            old_rank = board.entries.rank(old_key)
+            if new_key != old_key:
+                board.entries.remove(old_key)
+                board.entries.insert(new_key)
+                new_rank = board.entries.rank(new_key)
+            else:
+                new_rank = old_rank
+            # Строки топа показывают баланс и уровень, поэтому любое изменение игрока из топа его сбрасывает
+            self._invalidate_if_top(board, min(old_rank, new_rank))
+
+    def _invalidate_if_top(self, board, rank):
+        if rank < self.page_size:
+            self._top_cache.pop(board.name, None)
+
+    # -----------------------
+    # Чтение
+    # -----------------------
+
+    def rank(self, board_name, user_id):
+        """Место игрока (с единицы) и общее число игроков, либо None."""
+        entry = self.players.get(user_id)
+        if entry is None:
+            return None
+        board = self.boards[board_name]
+        return board.entries.rank(board.key(user_id, entry)) + 1, len(board.entries)
+
+    def pages(self, board_name):
+        return max(1, math.ceil(len(self.boards[board_name].entries) / self.page_size))
+
+    def page_lines(self, board_name, page):
+        board = self.boards[board_name]
+        start = page * self.page_size
+        keys = board.entries.slice(start, start + self.page_size)
+        return [
+            board.format_line(start + offset + 1, self.players[user_id])
+            for offset, (_, user_id) in enumerate(keys)
+        ]
+
+    def _page_text(self, board_name, page):
+        if page == 0 and board_name in self._top_cache:
+            return self._top_cache[board_name]
+        board = self.boards[board_name]
+        lines = self.page_lines(board_name, page)
+        if not lines:
+            return None
+        text = f"🏆 **{board.title}** (стр. {page + 1}):\n" + "\n".join(lines) + "\n"
+        if page == 0:
+            self._top_cache[board_name] = text
+        return text
+
+    def render(self, board_name, page, user_id):
+        """Текст страницы рейтинга с местом запросившего игрока и клавиатура навигации."""
+        if board_name not in self.boards:
+            board_name = "balance"
+        page = max(0, min(page, self.pages(board_name) - 1))
+        text = self._page_text(board_name, page)
+        if text is None:
+            return None, None
+        rank = self.rank(board_name, user_id)
+        if rank:
+            text += f"\nВаше место: {rank[0]} из {rank[1]}"
+        return text, self._keyboard(board_name, page)
+
+    def _keyboard(self, board_name, page):
+        builder = InlineKeyboardBuilder()
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(
+                text="◀️", callback_data=encode(LEADERBOARD, self.boards[board_name].board_id, page - 1)
+            ))
+        if page + 1 < self.pages(board_name):
+            navigation.append(InlineKeyboardButton(
+                text="▶️", callback_data=encode(LEADERBOARD, self.boards[board_name].board_id, page + 1)
+            ))
+        if navigation:
+            builder.row(*navigation)
+        builder.row(*[
+            InlineKeyboardButton(text=board.button_text, callback_data=encode(LEADERBOARD, board.board_id, 0))
+            for name, board in self.boards.items() if name != board_name
+        ])
+        return builder.as_markup()
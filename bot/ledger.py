@@ -0,0 +1,150 @@
+import logging
+import time
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Журнал изменений монет и ресурсов
+# =======================
+#
+# Каждое изменение баланса или количества ресурса дописывается в таблицу
+# ledger (только INSERT, строки не меняются и не удаляются): игрок, актив
+# ("coins" или название ресурса), изменение и причина. Записи одного действия
+# добавляются одним executemany в той же транзакции, что и само изменение.
+#
+# players.balance и user_resources.quantity остаются материализованными
+# значениями: по ним условный UPDATE проверяет, хватает ли монет, не читая
+# журнал. Журнал — источник истины для проверки и разбора инцидентов:
+# - take_snapshot() периодически сворачивает новые записи в ledger_balances
+#   и запоминает, до какой записи снимок актуален (ledger_snapshots);
+# - balances() — остатки игрока по снимку плюс хвост журнала после него;
+# - check() за один проход сверяет остатки, восстановленные из журнала,
+#   с players/user_resources.
+
+COINS = "coins"
+
+# Сколько расхождений check() возвращает подробно
+MAX_REPORTED_MISMATCHES = 100
+
+
+def record(conn, entries, at=None):
+    """Дописывает записи (user_id, актив, изменение, причина) одним executemany."""
+    created_at = int(time.time()) if at is None else at
+    conn.executemany(
+        "INSERT INTO ledger (user_id, asset, delta, reason, created_at) VALUES (?, ?, ?, ?, ?)",
+        [(user_id, asset, delta, reason, created_at) for user_id, asset, delta, reason in entries if delta]
+    )
+
+
+def last_snapshot(conn):
+    """id последней записи журнала, учтённой в ledger_balances (0 — снимков ещё не было)."""
+    return conn.execute("SELECT COALESCE(MAX(ledger_id), 0) FROM ledger_snapshots").fetchone()[0]
+
+
+def take_snapshot(conn, at=None):
+    """
+    Сворачивает записи журнала после последнего снимка в ledger_balances.
+    Выполняется внутри транзакции вызывающего (db.write). Возвращает (id последней записи, число записей).
+    """
+    lower = last_snapshot(conn)
+    upper = conn.execute("SELECT COALESCE(MAX(id), 0) FROM ledger").fetchone()[0]
+    if upper <= lower:
+        return lower, 0
+    entries = conn.execute("""
+        INSERT INTO ledger_balances (user_id, asset, balance)
+        SELECT user_id, asset, SUM(delta) FROM ledger WHERE id > ? AND id <= ? GROUP BY user_id, asset
+        ON CONFLICT(user_id, asset) DO UPDATE SET balance = balance + excluded.balance
+    """, (lower, upper)).rowcount
+    conn.execute(
+        "INSERT INTO ledger_snapshots (ledger_id, created_at) VALUES (?, ?)",
+        (upper, int(time.time()) if at is None else at)
+    )
+    return upper, entries
+
+
+def balances(conn, user_id):
+    """Остатки игрока по журналу: снимок плюс записи после него. {актив: количество}."""
+    rows = conn.execute("""
+        SELECT asset, SUM(delta) FROM (
+            SELECT asset, balance AS delta FROM ledger_balances WHERE user_id = :user_id
+            UNION ALL
+            SELECT asset, delta FROM ledger WHERE user_id = :user_id AND id > :snapshot
+        )
+        GROUP BY asset
+    """, {"user_id": user_id, "snapshot": last_snapshot(conn)})
+    return dict(rows)
+
+
+def history(conn, user_id, limit=20):
+    """Последние записи журнала игрока: (id, актив, изменение, причина, unix-время)."""
+    return conn.execute("""
+        SELECT id, asset, delta, reason, created_at FROM ledger
+        WHERE user_id = ? ORDER BY id DESC LIMIT ?
+    """, (user_id, limit)).fetchall()
+
+
+def _expected_rows(conn, full):
+    # Остатки по журналу, отсортированные по (user_id, актив)
+    if full:
+        return conn.execute("""
+            SELECT user_id, asset, SUM(delta) FROM ledger
+            GROUP BY user_id, asset ORDER BY user_id, asset
+        """)
+    return conn.execute("""
+        SELECT user_id, asset, SUM(delta) FROM (
+            SELECT user_id, asset, balance AS delta FROM ledger_balances
+            UNION ALL
+            SELECT user_id, asset, delta FROM ledger WHERE id > ?
+        )
+        GROUP BY user_id, asset ORDER BY user_id, asset
+    """, (last_snapshot(conn),))
+
+
+def _actual_rows(conn):
+    return conn.execute("""
+        SELECT user_id, asset, amount FROM (
+            SELECT user_id, ? AS asset, COALESCE(balance, 0) AS amount FROM players
+            UNION ALL
+            SELECT ur.user_id, r.name, COALESCE(ur.quantity, 0)
+            FROM user_resources ur JOIN resources r ON r.resource_id = ur.resource_id
+        )
+        ORDER BY user_id, asset
+    """, (COINS,))
+
+
+def check(conn, full=True):
+    """
+    Сверяет остатки из журнала с players.balance и user_resources.quantity.
+    full=True восстанавливает остатки из всего журнала, иначе — снимок плюс хвост.
+    Обе выборки отсортированы по (user_id, актив) и сливаются за один проход,
+    без загрузки в память. Нулевой остаток и отсутствие записи равнозначны.
+    Возвращает {"checked", "mismatches", "details": [(user_id, актив, в базе, по журналу)]}.
+    """
+    # Обе выборки читаются из одного снимка базы
+    conn.execute("BEGIN")
+    try:
+        expected = _expected_rows(conn, full)
+        actual = _actual_rows(conn)
+        checked = mismatches = 0
+        details = []
+        expected_row, actual_row = next(expected, None), next(actual, None)
+        while expected_row is not None or actual_row is not None:
+            if actual_row is None or (expected_row is not None and expected_row[:2] < actual_row[:2]):
+                key, in_db, in_ledger = expected_row[:2], 0, expected_row[2]
+                expected_row = next(expected, None)
+            elif expected_row is None or actual_row[:2] < expected_row[:2]:
+                key, in_db, in_ledger = actual_row[:2], actual_row[2], 0
+                actual_row = next(actual, None)
+            else:
+                key, in_db, in_ledger = actual_row[:2], actual_row[2], expected_row[2]
+                expected_row, actual_row = next(expected, None), next(actual, None)
+            checked += 1
+            if in_db != in_ledger:
+                mismatches += 1
+                if len(details) < MAX_REPORTED_MISMATCHES:
+                    details.append((key[0], key[1], in_db, in_ledger))
+    finally:
+        conn.execute("ROLLBACK")
+    if mismatches:
+        logger.warning(f"Журнал баланса расходится с базой: {mismatches} из {checked}")
+    return {"checked": checked, "mismatches": mismatches, "details": details}
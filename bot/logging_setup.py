@@ -0,0 +1,182 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import os
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# =======================
+# Асинхронное логирование
+# =======================
+#
+# Хендлеры бота только кладут запись в очередь (QueueHandler), а запись в файл
+# и консоль выполняет фоновый поток QueueListener — дисковый и консольный I/O
+# больше не идёт в потоке event loop. Каждая запись получает поля user_id и
+# command из контекста текущего обновления (см. LogContextMiddleware).
+#
+# Настройки через переменные окружения:
+#   LOG_FORMAT       — text (по умолчанию) или json
+#   LOG_CONSOLE      — 1/0, дублировать ли логи в stdout (в продакшене можно выключить)
+#   LOG_LEVEL        — уровень корневого логгера (INFO)
+#   LOG_LEVELS       — уровни отдельных логгеров: "aiogram=WARNING,bot_logger=DEBUG"
+#   LOG_SAMPLE_RATE  — доля сохраняемых «массовых» INFO-записей (1.0 — все)
+
+log_user_id = contextvars.ContextVar("log_user_id", default=None)
+log_command = contextvars.ContextVar("log_command", default=None)
+
+# Отметка для частых INFO-событий, которые можно сэмплировать:
+#   logger.info("...", extra=HIGH_VOLUME)
+HIGH_VOLUME = {"high_volume": True}
+
+DEFAULT_LOGGER_LEVELS = "aiogram=WARNING"
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись user_id и command текущего обновления."""
+
+    def filter(self, record):
+        if not hasattr(record, "user_id"):
+            record.user_id = log_user_id.get()
+        if not hasattr(record, "command"):
+            record.command = log_command.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю rate INFO-записей, помеченных HIGH_VOLUME."""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1.0 or record.levelno != logging.INFO or not getattr(record, "high_volume", False):
+            return True
+        return random.random() < self.rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "user_id": getattr(record, "user_id", None),
+            "command": getattr(record, "command", None),
+        }
+        if record.exc_text:
+            payload["exc"] = record.exc_text
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class _PreparingQueueHandler(QueueHandler):
+    # Сообщение и traceback форматируем в вызывающем потоке (аргументы могут
+    # измениться позже), а оформление в text/json делают обработчики слушателя
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def parse_logger_levels(spec):
+    levels = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        name, level = item.split("=", 1)
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def resolve_log_folder():
+    """Папка логов: ~/Desktop/logs, а если её нельзя создать — ./logs. None, если не удалось нигде."""
+    for folder in (os.path.join(os.path.expanduser("~"), "Desktop", "logs"), os.path.join(os.getcwd(), "logs")):
+        try:
+            os.makedirs(folder, exist_ok=True)
+            return folder
+        except OSError:
+            continue
+    return None
+
+
+def setup_logging(log_file, level=None, console=None, json_format=None, logger_levels=None, sample_rate=None):
+    """
+    Настраивает корневой логгер на очередь и запускает фоновый QueueListener.
+    Параметры по умолчанию берутся из переменных окружения. Возвращает слушатель.
+    """
+    level = level or os.getenv("LOG_LEVEL", "INFO")
+    console = os.getenv("LOG_CONSOLE", "1") == "1" if console is None else console
+    json_format = os.getenv("LOG_FORMAT", "text") == "json" if json_format is None else json_format
+    logger_levels = parse_logger_levels(DEFAULT_LOGGER_LEVELS + "," + os.getenv("LOG_LEVELS", "")) \
+        if logger_levels is None else logger_levels
+    sample_rate = float(os.getenv("LOG_SAMPLE_RATE", "1.0")) if sample_rate is None else sample_rate
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = []
+    file_handler = RotatingFileHandler(log_file, maxBytes=5 * 1024 * 1024, backupCount=5, encoding="utf-8")
+    file_handler.setFormatter(formatter)
+    handlers.append(file_handler)
+    if console:
+        console_handler = logging.StreamHandler(sys.stdout)
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = _PreparingQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, logger_level in logger_levels.items():
+        logging.getLogger(name).setLevel(logger_level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Останавливаем слушатель при выходе, чтобы дописать очередь
+    atexit.register(listener.stop)
+    return listener
+
+
+def update_context(update):
+    """user_id и command для логов из aiogram Update."""
+    event = update.message or update.callback_query or update.edited_message
+    if event is None:
+        return None, None
+    user = getattr(event, "from_user", None)
+    user_id = user.id if user else None
+    if update.callback_query is not None:
+        return user_id, f"callback:{(update.callback_query.data or '')[:32]}"
+    text = getattr(event, "text", None) or ""
+    command = text.split(maxsplit=1)[0].split("@", 1)[0] if text.startswith("/") else None
+    return user_id, command
+
+
+class LogContextMiddleware:
+    """Внешний middleware для dispatcher.update: заполняет контекст логов на время обработки."""
+
+    async def __call__(self, handler, event, data):
+        user_id, command = update_context(event)
+        user_token = log_user_id.set(user_id)
+        command_token = log_command.set(command)
+        try:
+            return await handler(event, data)
+        finally:
+            log_user_id.reset(user_token)
+            log_command.reset(command_token)
@@ -0,0 +1,96 @@
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Обслуживание базы данных
+# =======================
+#
+# Синхронные задания для планировщика (scheduler.py, blocking=True): каждое
+# открывает своё соединение в потоке планировщика, поэтому не занимает
+# поток-писатель и пул читателей (db.py). Писатель ждёт только короткие
+# записи обслуживания (busy_timeout), читатели в режиме WAL не ждут вовсе.
+#
+# - optimize(): ANALYZE с ограничением analysis_limit (статистика по выборке
+#   строк — быстро и на большой базе), планы запросов обновляются у всех
+#   соединений; затем incremental_vacuum, если база создана с
+#   auto_vacuum = INCREMENTAL (см. bootstrap.py), и сокращение лога WAL;
+# - checkpoint(): пассивный checkpoint WAL, не ждёт читателей и писателя;
+# - prune_ledger_snapshots(): удаляет старые отметки снимков журнала.
+#   Сам журнал (ledger) не чистится: полная сверка (ledger.check) читает его
+#   целиком.
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+def _connect(path, busy_timeout_ms):
+    conn = sqlite3.connect(path, timeout=busy_timeout_ms / 1000, isolation_level=None)
+    conn.execute(f"PRAGMA busy_timeout = {int(busy_timeout_ms)}")
+    return conn
+
+
+def checkpoint(path, busy_timeout_ms=5000, mode="PASSIVE"):
+    """Checkpoint WAL. Возвращает (busy, страниц в логе, перенесено страниц)."""
+    conn = _connect(path, busy_timeout_ms)
+    try:
+        busy, log_pages, checkpointed = conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+    finally:
+        conn.close()
+    if log_pages > 0 and checkpointed < log_pages:
+        logger.info(f"Checkpoint WAL ({mode}): перенесено {checkpointed} из {log_pages} страниц")
+    return busy, log_pages, checkpointed
+
+
+def optimize(path, busy_timeout_ms=5000, analysis_limit=1000, vacuum_pages=2000):
+    """ANALYZE, incremental_vacuum и сокращение WAL. Возвращает словарь с результатами шагов."""
+    conn = _connect(path, busy_timeout_ms)
+    try:
+        started = time.perf_counter()
+        conn.execute(f"PRAGMA analysis_limit = {int(analysis_limit)}")
+        conn.execute("ANALYZE")
+        analyzed_at = time.perf_counter()
+
+        freelist_before = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        vacuumed = 0
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == AUTO_VACUUM_INCREMENTAL and freelist_before:
+            # Не больше vacuum_pages страниц за запуск: транзакция записи остаётся короткой
+            conn.execute(f"PRAGMA incremental_vacuum({int(vacuum_pages)})").fetchall()
+            vacuumed = freelist_before - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        elif freelist_before:
+            logger.info(
+                f"В базе {freelist_before} свободных страниц; incremental_vacuum недоступен "
+                f"(auto_vacuum выключен, включается только полным VACUUM)"
+            )
+        vacuumed_at = time.perf_counter()
+
+        # TRUNCATE ждёт читателей не дольше busy_timeout; не удалось — лог сократится в следующий раз
+        busy, log_pages, checkpointed = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    finally:
+        conn.close()
+    result = {
+        "analyze_seconds": round(analyzed_at - started, 3),
+        "vacuum_seconds": round(vacuumed_at - analyzed_at, 3),
+        "vacuumed_pages": vacuumed,
+        "freelist_pages": freelist_before - vacuumed,
+        "wal_truncated": not busy,
+    }
+    logger.info(f"Обслуживание базы данных: {result}")
+    return result
+
+
+def prune_ledger_snapshots(path, keep_days, busy_timeout_ms=5000, now=None):
+    """Удаляет отметки снимков журнала старше keep_days дней (последняя остаётся). Возвращает число строк."""
+    conn = _connect(path, busy_timeout_ms)
+    try:
+        cutoff = int(time.time() if now is None else now) - int(keep_days * 86400)
+        deleted = conn.execute("""
+            DELETE FROM ledger_snapshots
+            WHERE created_at < ? AND id < (SELECT MAX(id) FROM ledger_snapshots)
+        """, (cutoff,)).rowcount
+    finally:
+        conn.close()
+    if deleted:
+        logger.info(f"Удалено старых отметок снимков журнала: {deleted}")
+    return deleted
@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Кэш file_id для картинок кофейни
+# =======================
+#
+# Telegram возвращает file_id для каждого загруженного файла; отправка по
+# file_id не передаёт байты повторно. Кэш запоминает file_id после первой
+# загрузки картинки уровня, хранит его в таблице media_cache и дальше
+# отправляет /my_cafe без чтения файла с диска.
+#
+# Состояние папки с картинками (mtime, размер, sha256) держится в памяти и
+# перепроверяется не чаще раза в check_interval секунд. Если файл изменился,
+# считаем sha256: при другом содержимом file_id сбрасывается и картинка
+# загружается заново, при том же — обновляется только mtime.
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+DEFAULT_IMAGE = "default_cafe.jpg"
+
+
+class MediaEntry:
+    __slots__ = ("path", "mtime_ns", "size", "sha256", "file_id")
+
+    def __init__(self, path, mtime_ns, size, sha256, file_id=None):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.sha256 = sha256
+        self.file_id = file_id
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class MediaCache:
+    def __init__(self, db, images_dir="images", check_interval=60.0):
+        self.db = db
+        self.images_dir = images_dir
+        self.check_interval = check_interval
+        self.hits = 0
+        self.uploads = 0
+        self.invalidations = 0
+        self._files = {}
+        self._checked_at = None
+        self._refresh_lock = asyncio.Lock()
+        self._upload_locks = {}
+
+    def level_image(self, level):
+        return os.path.join(self.images_dir, f"cafe_level_{level}.jpg")
+
+    def stats(self):
+        return {
+            "files": len(self._files),
+            "cached_file_ids": sum(1 for entry in self._files.values() if entry.file_id),
+            "hits": self.hits,
+            "uploads": self.uploads,
+            "invalidations": self.invalidations,
+        }
+
+    # -----------------------
+    # Состояние файлов
+    # -----------------------
+
+    async def load(self):
+        """Загружает сохранённые file_id из базы."""
+        rows = await self.db.fetchall("SELECT path, file_id, mtime_ns, size, sha256 FROM media_cache")
+        self._files = {
+            path: MediaEntry(path, mtime_ns, size, sha256, file_id)
+            for path, file_id, mtime_ns, size, sha256 in rows
+        }
+
+    def _scan(self, known):
+        # Выполняется в отдельном потоке: stat всех картинок и sha256 только изменившихся
+        found = {}
+        try:
+            names = os.listdir(self.images_dir)
+        except FileNotFoundError:
+            return found
+        for name in names:
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(self.images_dir, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entry = known.get(path)
+            if entry is not None and entry.mtime_ns == stat.st_mtime_ns and entry.size == stat.st_size:
+                found[path] = entry
+                continue
+            sha256 = file_sha256(path)
+            file_id = entry.file_id if entry is not None and entry.sha256 == sha256 else None
+            found[path] = MediaEntry(path, stat.st_mtime_ns, stat.st_size, sha256, file_id)
+        return found
+
+    async def refresh(self):
+        """Перечитывает папку с картинками и сбрасывает file_id изменившихся файлов."""
+        async with self._refresh_lock:
+            known = self._files
+            found = await asyncio.to_thread(self._scan, known)
+            stale = []
+            changed = []
+            for path, entry in known.items():
+                current = found.get(path)
+                if current is None or (entry.file_id and not current.file_id):
+                    if entry.file_id:
+                        stale.append((path,))
+                        self.invalidations += 1
+                        logger.info(f"Картинка {path} изменилась или удалена, file_id сброшен.")
+                elif current is not entry and current.file_id:
+                    # Содержимое то же, изменился только mtime
+                    changed.append((current.mtime_ns, current.size, path))
+            if stale:
+                await self.db.executemany("DELETE FROM media_cache WHERE path = ?", stale)
+            if changed:
+                await self.db.executemany("UPDATE media_cache SET mtime_ns = ?, size = ? WHERE path = ?", changed)
+            self._files = found
+            self._checked_at = time.monotonic()
+
+    async def _maybe_refresh(self):
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.check_interval:
+            await self.refresh()
+
+    async def _remember(self, entry, file_id):
+        entry.file_id = file_id
+        await self.db.execute("""
+            INSERT INTO media_cache (path, file_id, mtime_ns, size, sha256)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                file_id = excluded.file_id, mtime_ns = excluded.mtime_ns,
+                size = excluded.size, sha256 = excluded.sha256
+        """, (entry.path, file_id, entry.mtime_ns, entry.size, entry.sha256))
+
+    async def _forget(self, entry):
+        entry.file_id = None
+        self.invalidations += 1
+        await self.db.execute("DELETE FROM media_cache WHERE path = ?", (entry.path,))
+
+    # -----------------------
+    # Отправка
+    # -----------------------
+
+    async def _upload(self, entry, send):
+        # Одна загрузка на файл: параллельные запросы дожидаются её и шлют по file_id
+        lock = self._upload_locks.setdefault(entry.path, asyncio.Lock())
+        async with lock:
+            if entry.file_id:
+                self.hits += 1
+                return await send(entry.file_id)
+            sent = await send(FSInputFile(entry.path))
+            self.uploads += 1
+            await self._remember(entry, sent.photo[-1].file_id)
+            return sent
+
+    async def _send(self, entry, send):
+        if entry.file_id:
+            try:
+                sent = await send(entry.file_id)
+                self.hits += 1
+                return sent
+            except TelegramBadRequest as e:
+                logger.warning(f"file_id для {entry.path} отклонён Telegram, загружаем заново: {e}")
+                await self._forget(entry)
+        return await self._upload(entry, send)
+
+    async def answer_photo(self, message, level, **kwargs):
+        """
+        Отправляет картинку уровня кофейни (или картинку по умолчанию) ответом на message.
+        Возвращает False, если подходящей картинки нет.
+        """
+        await self._maybe_refresh()
+        entry = self._files.get(self.level_image(level)) or self._files.get(
+            os.path.join(self.images_dir, DEFAULT_IMAGE))
+        if entry is None:
+            return False
+        await self._send(entry, lambda photo: message.answer_photo(photo, **kwargs))
+        return True
+
+    async def warm_up(self, bot=None, chat_id=None):
+        """
+        Прогрев при запуске: загружает file_id из базы и проверяет файлы.
+        Если задан chat_id, картинки без file_id сразу загружаются в этот чат.
+        """
+        await self.load()
+        await self.refresh()
+        if bot is None or chat_id is None:
+            return
+        for entry in list(self._files.values()):
+            if entry.file_id:
+                continue
+            try:
+                await self._upload(entry, lambda photo: bot.send_photo(chat_id, photo, disable_notification=True))
+            except Exception as e:
+                logger.error(f"Не удалось загрузить картинку {entry.path} при прогреве: {e}", exc_info=True)
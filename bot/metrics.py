@@ -0,0 +1,347 @@
+import logging
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from aiohttp import web
+from aiogram.filters import Command
+
+from throttling import throttle_key
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Метрики хендлеров и запросов к базе
+# =======================
+#
+# Две части:
+# - MetricsMiddleware (внешний middleware dispatcher.update) — гистограмма
+#   длительности обработки, ошибки и число обновлений в обработке по командам;
+# - InstrumentedConnection (factory для sqlite3.connect) — длительность и
+#   число строк по каждому SQL-запросу, медленные запросы пишутся в лог.
+# Всё отдаётся в текстовом формате Prometheus на локальном HTTP-эндпоинте
+# (METRICS_PORT). Запись метрики — несколько операций со словарём и список
+# счётчиков корзин гистограммы, без форматирования строк: форматирование
+# происходит только при запросе /metrics.
+
+# Границы корзин гистограмм, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Незарегистрированные команды и кнопки (произвольный текст пользователей после "/",
+# подделанный callback_data) сливаются в одну метку: число меток не зависит от пользователей
+OTHER_LABEL = "other"
+
+# Команда текущего обновления — для подсчёта ошибок, залогированных хендлерами
+_current_command = ContextVar("metrics_command", default=None)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Последняя корзина — +Inf
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_float(value):
+    return "+Inf" if value == float("inf") else repr(float(value))
+
+
+def render_histograms(name, help_text, label, histograms):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    # label=None — одна гистограмма без меток
+    items = [(None, histograms)] if label is None else sorted(histograms.items())
+    for key, histogram in items:
+        label_text = "" if label is None else f'{label}="{_escape(key)}"'
+        bucket_prefix = f"{label_text}," if label_text else ""
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + (float("inf"),), histogram.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{bucket_prefix}le="{_format_float(bound)}"}} {cumulative}')
+        suffix = f"{{{label_text}}}" if label_text else ""
+        lines.append(f"{name}_sum{suffix} {histogram.sum!r}")
+        lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+def render_values(name, kind, help_text, label, values):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+    if label is None:
+        lines.append(f"{name} {values}")
+    else:
+        lines.extend(f'{name}{{{label}="{_escape(key)}"}} {value}' for key, value in sorted(values.items()))
+    return lines
+
+
+# -----------------------
+# Хендлеры
+# -----------------------
+
+def router_commands(router):
+    """Команды ("/start", ...) из фильтров Command обработчиков сообщений роутера и вложенных роутеров."""
+    commands = set()
+    for handler in router.message.handlers:
+        for handler_filter in handler.filters or ():
+            if isinstance(handler_filter.callback, Command):
+                commands.update(f"/{command}" for command in handler_filter.callback.commands
+                                if isinstance(command, str))
+    for sub_router in router.sub_routers:
+        commands |= router_commands(sub_router)
+    return commands
+
+
+class HandlerMetrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        # Ключи (команды и действия кнопок), для которых заводятся отдельные метки
+        self.known = set()
+        self.durations = {}
+        self.errors = Counter()
+        self.in_flight = Counter()
+
+    def register(self, keys):
+        self.known.update(keys)
+
+    def label(self, key):
+        return key if key in self.known else OTHER_LABEL
+
+    def observe(self, label, seconds):
+        histogram = self.durations.get(label)
+        if histogram is None:
+            histogram = self.durations[label] = Histogram(self.buckets)
+        histogram.observe(seconds)
+
+    def render(self):
+        return (
+            render_histograms("bot_update_duration_seconds", "Длительность обработки обновления",
+                              "command", self.durations)
+            + render_values("bot_update_errors_total", "counter", "Ошибки при обработке обновлений",
+                            "command", self.errors)
+            + render_values("bot_updates_in_flight", "gauge", "Обновления в обработке",
+                            "command", self.in_flight)
+        )
+
+
+class MetricsMiddleware:
+    """Внешний middleware для dispatcher.update: время, ошибки и число обновлений в обработке по командам."""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, handler, event, data):
+        metrics = self.metrics
+        label = metrics.label(throttle_key(event)[1])
+        metrics.in_flight[label] += 1
+        token = _current_command.set(label)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            metrics.errors[label] += 1
+            raise
+        finally:
+            metrics.observe(label, time.perf_counter() - started)
+            metrics.in_flight[label] -= 1
+            _current_command.reset(token)
+
+
+class ErrorLogFilter(logging.Filter):
+    """
+    Фильтр логгера бота: хендлеры перехватывают исключения сами и пишут их в лог,
+    поэтому ошибки считаются по записям уровня ERROR и выше внутри обработки обновления.
+    """
+
+    def __init__(self, metrics):
+        super().__init__()
+        self.metrics = metrics
+
+    def filter(self, record):
+        if record.levelno >= logging.ERROR:
+            label = _current_command.get()
+            if label is not None:
+                self.metrics.errors[label] += 1
+        return True
+
+
+# -----------------------
+# Запросы к базе
+# -----------------------
+
+class QueryStats:
+    __slots__ = ("histogram", "rows")
+
+    def __init__(self, buckets):
+        self.histogram = Histogram(buckets)
+        self.rows = 0
+
+
+class QueryMetrics:
+    """Статистика по SQL-запросам. Запросы выполняются в потоках пула, поэтому запись под блокировкой."""
+
+    def __init__(self, slow_query_ms=100.0, max_statement_length=160, max_statements=256, buckets=DEFAULT_BUCKETS):
+        self.slow_query_seconds = slow_query_ms / 1000 if slow_query_ms else None
+        self.max_statement_length = max_statement_length
+        self.max_statements = max_statements
+        self.buckets = buckets
+        self.statements = {}
+        self.slow_queries = 0
+        self._labels = {}
+        self._lock = threading.Lock()
+
+    def statement(self, sql):
+        # Запросы в коде — константные строки, нормализация выполняется один раз на текст.
+        # Текст, собранный динамически (число плейсхолдеров), даёт новые метки — их число ограничено
+        label = self._labels.get(sql)
+        if label is None:
+            if len(self._labels) >= self.max_statements:
+                return OTHER_LABEL
+            label = self._labels[sql] = " ".join(sql.split())[:self.max_statement_length]
+        return label
+
+    def record(self, sql, parameters_count, seconds, rows=0):
+        label = self.statement(sql)
+        with self._lock:
+            stats = self.statements.get(label)
+            if stats is None:
+                stats = self.statements[label] = QueryStats(self.buckets)
+            stats.histogram.observe(seconds)
+            stats.rows += rows
+            slow = self.slow_query_seconds is not None and seconds >= self.slow_query_seconds
+            if slow:
+                self.slow_queries += 1
+        if slow:
+            logger.warning(f"Медленный запрос: {seconds * 1000:.1f} мс, параметров: {parameters_count}, "
+                           f"SQL: {' '.join(sql.split())}")
+        return label
+
+    def add_rows(self, label, rows):
+        with self._lock:
+            self.statements[label].rows += rows
+
+    def render(self):
+        with self._lock:
+            histograms = {label: stats.histogram for label, stats in self.statements.items()}
+            rows = {label: stats.rows for label, stats in self.statements.items()}
+            return (
+                render_histograms("bot_db_query_duration_seconds", "Длительность выполнения SQL-запроса",
+                                  "statement", histograms)
+                + render_values("bot_db_query_rows_total", "counter",
+                                "Строки, изменённые или прочитанные запросом", "statement", rows)
+                + render_values("bot_db_slow_queries_total", "counter", "Медленные запросы",
+                                None, self.slow_queries)
+            )
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """
+    Курсор, который замеряет execute/executemany. Для запросов, возвращающих
+    строки, считаются фактически прочитанные строки, для остальных — rowcount.
+    """
+
+    _label = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._record(sql, len(parameters), time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Для генераторов число наборов параметров заранее неизвестно
+        count = len(seq_of_parameters) if hasattr(seq_of_parameters, "__len__") else None
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self._record(sql, count, time.perf_counter() - started)
+
+    def _record(self, sql, parameters_count, seconds):
+        returns_rows = self.description is not None
+        rows = 0 if returns_rows or self.rowcount < 0 else self.rowcount
+        label = self.connection.metrics.record(sql, parameters_count, seconds, rows)
+        self._label = label if returns_rows else None
+
+    def _count(self, rows):
+        if self._label is not None and rows:
+            self.connection.metrics.add_rows(self._label, rows)
+
+    def fetchone(self):
+        row = super().fetchone()
+        self._count(row is not None)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._count(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._count(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        self._count(1)
+        return row
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """factory для sqlite3.connect; после создания соединению назначается metrics (QueryMetrics)."""
+
+    metrics = None
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# -----------------------
+# HTTP-эндпоинт
+# -----------------------
+
+async def start_metrics_server(handler_metrics, query_metrics, host="127.0.0.1", port=9100, collectors=()):
+    """
+    Поднимает GET /metrics в формате Prometheus. collectors — дополнительные источники с render()
+    (например, scheduler.Scheduler). Возвращает runner для остановки (runner.cleanup()).
+    """
+
+    async def metrics_view(request):
+        lines = handler_metrics.render()
+        if query_metrics is not None:
+            lines += query_metrics.render()
+        for collector in collectors:
+            lines += collector.render()
+        body = ("\n".join(lines) + "\n").encode()
+        return web.Response(body=body, headers={"Content-Type": PROMETHEUS_CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_view)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,241 @@
+import logging
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Версионированные миграции схемы
+# =======================
+#
+# Текущая версия схемы хранится в PRAGMA user_version. Каждая миграция
+# выполняется в своей транзакции вместе с записью нового номера версии,
+# поэтому прерванная миграция не оставляет базу в промежуточном состоянии.
+
+
+def _migration_1_unique_user_rows(conn):
+    # Схлопываем дубликаты ресурсов: оставляем самую раннюю строку с суммарным количеством
+    conn.execute("""
+        UPDATE user_resources
+        SET quantity = (
+            SELECT SUM(ur.quantity) FROM user_resources ur
+            WHERE ur.user_id = user_resources.user_id AND ur.resource_name = user_resources.resource_name
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM user_resources
+            GROUP BY user_id, resource_name HAVING COUNT(*) > 1
+        )
+    """)
+    conn.execute("""
+        DELETE FROM user_resources
+        WHERE id NOT IN (SELECT MIN(id) FROM user_resources GROUP BY user_id, resource_name)
+    """)
+
+    # Для зданий сохраняем максимальный уровень
+    conn.execute("""
+        UPDATE user_buildings
+        SET level = (
+            SELECT MAX(ub.level) FROM user_buildings ub
+            WHERE ub.user_id = user_buildings.user_id AND ub.building_name = user_buildings.building_name
+        )
+        WHERE id IN (
+            SELECT MIN(id) FROM user_buildings
+            GROUP BY user_id, building_name HAVING COUNT(*) > 1
+        )
+    """)
+    conn.execute("""
+        DELETE FROM user_buildings
+        WHERE id NOT IN (SELECT MIN(id) FROM user_buildings GROUP BY user_id, building_name)
+    """)
+
+    conn.execute("""
+        DELETE FROM user_achievements
+        WHERE id NOT IN (SELECT MIN(id) FROM user_achievements GROUP BY user_id, achievement_id)
+    """)
+
+    # Составные уникальные индексы: user_id в префиксе обслуживает и выборки по пользователю
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_user_resources_user_resource
+        ON user_resources (user_id, resource_name)
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_user_buildings_user_building
+        ON user_buildings (user_id, building_name)
+    """)
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS ux_user_achievements_user_achievement
+        ON user_achievements (user_id, achievement_id)
+    """)
+
+
+def _migration_2_building_required_resource(conn):
+    # Требуемый для покупки ресурс хранится в справочнике, а не в коде хендлера
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(buildings)")}
+    if "required_resource" not in columns:
+        conn.execute("ALTER TABLE buildings ADD COLUMN required_resource TEXT")
+    conn.executemany("""
+        UPDATE buildings SET required_resource = ? WHERE name = ? AND required_resource IS NULL
+    """, [
+        ("Кофейные зерна", "Магазин"),
+        ("Молоко", "Склад"),
+        ("Сахар", "Офис"),
+    ])
+
+
+def _migration_3_media_cache(conn):
+    # file_id загруженных в Telegram картинок: повторно отправляем по file_id, без загрузки файла
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS media_cache (
+            path TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            sha256 TEXT NOT NULL
+        )
+    """)
+
+
+def _migration_4_last_income_timestamp(conn):
+    # last_income хранит unix-время последнего зачисления дохода (см. income.py);
+    # доход существующих игроков начинает копиться с момента миграции
+    conn.execute("""
+        UPDATE players SET last_income = CAST(strftime('%s', 'now') AS INTEGER)
+        WHERE last_income IS NULL OR typeof(last_income) != 'integer'
+    """)
+
+
+def _migration_5_ledger(conn):
+    # Журнал изменений монет и ресурсов и его снимки (см. ledger.py)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            asset TEXT NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+    """)
+    # Сверка и остатки игрока группируют по (user_id, asset)
+    conn.execute("CREATE INDEX IF NOT EXISTS ix_ledger_user_asset ON ledger (user_id, asset)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_balances (
+            user_id INTEGER NOT NULL,
+            asset TEXT NOT NULL,
+            balance INTEGER NOT NULL,
+            PRIMARY KEY (user_id, asset)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS ledger_snapshots (
+            id INTEGER PRIMARY KEY,
+            ledger_id INTEGER NOT NULL,
+            created_at INTEGER NOT NULL
+        )
+    """)
+    # История существующих игроков начинается с входящих остатков
+    conn.execute("""
+        INSERT INTO ledger (user_id, asset, delta, reason, created_at)
+        SELECT user_id, 'coins', balance, 'opening', CAST(strftime('%s', 'now') AS INTEGER)
+        FROM players WHERE COALESCE(balance, 0) != 0
+    """)
+    conn.execute("""
+        INSERT INTO ledger (user_id, asset, delta, reason, created_at)
+        SELECT user_id, resource_name, quantity, 'opening', CAST(strftime('%s', 'now') AS INTEGER)
+        FROM user_resources WHERE COALESCE(quantity, 0) != 0
+    """)
+
+
+def _migration_6_integer_user_keys(conn):
+    # user_resources и user_buildings ссылались на справочники по названию (TEXT в каждой строке).
+    # Теперь — по resource_id/building_id, ключ таблицы (user_id, id) без отдельного rowid и индекса
+    conn.execute("""
+        INSERT INTO resources (name)
+        SELECT DISTINCT resource_name FROM user_resources WHERE resource_name IS NOT NULL
+        ON CONFLICT(name) DO NOTHING
+    """)
+    conn.execute("""
+        CREATE TABLE user_resources_v6 (
+            user_id INTEGER NOT NULL,
+            resource_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, resource_id),
+            FOREIGN KEY(user_id) REFERENCES players(user_id),
+            FOREIGN KEY(resource_id) REFERENCES resources(resource_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO user_resources_v6 (user_id, resource_id, quantity)
+        SELECT ur.user_id, r.resource_id, COALESCE(ur.quantity, 0)
+        FROM user_resources ur JOIN resources r ON r.name = ur.resource_name
+        WHERE ur.user_id IS NOT NULL
+    """)
+    conn.execute("DROP TABLE user_resources")
+    conn.execute("ALTER TABLE user_resources_v6 RENAME TO user_resources")
+
+    # Здание без записи в справочнике не давало дохода и не продаётся — такие строки не переносятся
+    orphaned = conn.execute("""
+        SELECT COUNT(*) FROM user_buildings ub
+        WHERE NOT EXISTS (SELECT 1 FROM buildings b WHERE b.name = ub.building_name)
+    """).fetchone()[0]
+    if orphaned:
+        logger.warning(f"Миграция 6: пропущены здания игроков без записи в справочнике: {orphaned}")
+    conn.execute("""
+        CREATE TABLE user_buildings_v6 (
+            user_id INTEGER NOT NULL,
+            building_id INTEGER NOT NULL,
+            level INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (user_id, building_id),
+            FOREIGN KEY(user_id) REFERENCES players(user_id),
+            FOREIGN KEY(building_id) REFERENCES buildings(building_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT INTO user_buildings_v6 (user_id, building_id, level)
+        SELECT ub.user_id, b.building_id, COALESCE(ub.level, 1)
+        FROM user_buildings ub JOIN buildings b ON b.name = ub.building_name
+        WHERE ub.user_id IS NOT NULL
+    """)
+    conn.execute("DROP TABLE user_buildings")
+    conn.execute("ALTER TABLE user_buildings_v6 RENAME TO user_buildings")
+
+
+# Список миграций: (версия, функция). Версии только растут, старые миграции не меняются.
+MIGRATIONS = [
+    (1, _migration_1_unique_user_rows),
+    (2, _migration_2_building_required_resource),
+    (3, _migration_3_media_cache),
+    (4, _migration_4_last_income_timestamp),
+    (5, _migration_5_ledger),
+    (6, _migration_6_integer_user_keys),
+]
+
+
+def get_schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def apply_migrations(conn, migrations=MIGRATIONS):
+    """
+    Применяет к conn все миграции новее текущей версии схемы. Возвращает итоговую версию.
+    Без открытой транзакции каждая миграция выполняется в своей; внутри транзакции
+    вызывающего (bootstrap.py) — в ней же, и откат вызывающего отменяет все миграции.
+    """
+    version = get_schema_version(conn)
+    own_transaction = not conn.in_transaction
+    for target_version, migration in migrations:
+        if target_version <= version:
+            continue
+        if own_transaction:
+            conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn)
+            conn.execute(f"PRAGMA user_version = {int(target_version)}")
+            if own_transaction:
+                conn.execute("COMMIT")
+        except Exception:
+            if own_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        if own_transaction:
+            logger.info(f"Схема базы данных обновлена до версии {target_version}.")
+        version = target_version
+    return version
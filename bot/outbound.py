@@ -0,0 +1,357 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendMessage
+
+from metrics import render_values
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Очередь исходящих сообщений
+# =======================
+#
+# Middleware сессии aiogram (bot.session.middleware): все вызовы Bot API,
+# отправляющие или меняющие сообщения в чате (send*, edit*, copy*, forward*),
+# проходят через очередь, а хендлеры по-прежнему просто вызывают
+# message.answer(...) и ждут результат.
+#
+# - Лимиты Telegram: общий token bucket бота (не больше 30 сообщений за любую
+#   секунду: запас + скорость восполнения <= 30) и корзина каждого чата
+#   (1 сообщение в секунду в личке с небольшим запасом, 20 в минуту в
+#   группах). Сообщения одного чата уходят по порядку и по одному.
+# - Приоритет: ответы на действия пользователя (по умолчанию) идут раньше
+#   фоновых рассылок и загрузок (with bulk_sends(): ...).
+# - Объединение: если в очереди чата уже ждёт текстовое сообщение без
+#   клавиатуры, следующее текстовое сообщение того же приоритета и с теми же
+#   параметрами дописывается к нему — чату уходит одно сообщение вместо двух.
+#   Так объединяются ответы, отправленные в чат одновременно (параллельные
+#   обновления одного пользователя); пока лимит чата не исчерпан, сообщения
+#   уходят сразу и не объединяются.
+# - 429: сообщение возвращается в начало очереди чата и повторяется через
+#   retry_after с экспоненциальной добавкой и случайным разбросом; общая
+#   корзина при этом обнуляется. Остальные методы (answerCallbackQuery и т. п.)
+#   идут без очереди, но 429 для них тоже повторяется.
+
+INTERACTIVE = 0
+BULK = 1
+
+# Приоритет отправок текущего контекста
+_priority = ContextVar("send_priority", default=INTERACTIVE)
+
+MAX_MESSAGE_LENGTH = 4096
+MERGE_SEPARATOR = "\n\n"
+
+# Методы, на которые распространяются лимиты отправки в чат
+QUEUED_PREFIXES = ("send", "edit", "copy", "forward")
+
+# Поля SendMessage, которые могут различаться у объединяемых сообщений
+_MERGE_IGNORED_FIELDS = {"text", "reply_markup"}
+
+
+@contextmanager
+def bulk_sends():
+    """Отправки внутри блока получают низкий приоритет (рассылки, прогрев кэшей)."""
+    token = _priority.set(BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def _can_merge(first, second):
+    if type(first) is not SendMessage or type(second) is not SendMessage:
+        return False
+    # Клавиатура первого сообщения оказалась бы под чужим текстом
+    if first.reply_markup is not None or first.entities or second.entities:
+        return False
+    if len(first.text) + len(MERGE_SEPARATOR) + len(second.text) > MAX_MESSAGE_LENGTH:
+        return False
+    return all(
+        getattr(first, name) == getattr(second, name)
+        for name in SendMessage.model_fields if name not in _MERGE_IGNORED_FIELDS
+    )
+
+
+class _Outgoing:
+    __slots__ = ("make_request", "bot", "method", "priority", "futures", "attempts")
+
+    def __init__(self, make_request, bot, method, priority, future):
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.priority = priority
+        self.futures = [future]
+        self.attempts = 0
+
+
+class _Chat:
+    __slots__ = ("queue", "tokens", "updated_at", "blocked_until", "busy", "scheduled")
+
+    def __init__(self, tokens, now):
+        self.queue = deque()
+        self.tokens = tokens
+        self.updated_at = now
+        self.blocked_until = 0.0
+        self.busy = False
+        self.scheduled = False
+
+
+class OutboundQueue:
+    def __init__(self, global_rate=25.0, global_burst=5, chat_rate=1.0, chat_burst=2, group_rate=20 / 60, group_burst=3,
+                 max_retries=5, retry_base=0.5, retry_jitter=0.2, merge=True, max_chats=100_000,
+                 clock=time.monotonic, rng=None):
+        self.global_rate = float(global_rate)
+        self.global_burst = max(1, int(global_burst))
+        self.chat_rate = float(chat_rate)
+        self.chat_burst = max(1, int(chat_burst))
+        self.group_rate = float(group_rate)
+        self.group_burst = max(1, int(group_burst))
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.retry_jitter = retry_jitter
+        self.merge = merge
+        self.max_chats = max(1, int(max_chats))
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._global_tokens = self.global_burst
+        self._global_updated_at = clock()
+        # Чаты в порядке последнего обращения; простаивающие с полной корзиной удаляются
+        self._chats = OrderedDict()
+        # Чаты, готовые к отправке, по приоритету первого сообщения; ждущие токена или retry_after — в куче
+        self._ready = (deque(), deque())
+        self._timers = []
+        self._timer_ids = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._sending = set()
+        self.pending = 0
+        self.sent = 0
+        self.merged = 0
+        self.retried = 0
+        self.failed = 0
+
+    def stats(self):
+        return {
+            "pending": self.pending,
+            "chats": len(self._chats),
+            "sent": self.sent,
+            "merged": self.merged,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+    def render(self):
+        """Метрики для /metrics (metrics.start_metrics_server, collectors)."""
+        return (
+            render_values("bot_outbound_pending", "gauge", "Сообщения в очереди исходящих", None, self.pending)
+            + render_values("bot_outbound_chats", "gauge", "Чаты с корзиной лимита в памяти", None, len(self._chats))
+            + render_values("bot_outbound_sent_total", "counter", "Успешные вызовы Bot API из очереди",
+                            None, self.sent)
+            + render_values("bot_outbound_merged_total", "counter",
+                            "Сообщения, дописанные к предыдущему в очереди того же чата", None, self.merged)
+            + render_values("bot_outbound_retried_total", "counter", "Повторы после ответа 429 (retry_after)",
+                            None, self.retried)
+            + render_values("bot_outbound_failed_total", "counter", "Вызовы Bot API из очереди, завершившиеся ошибкой",
+                            None, self.failed)
+        )
+
+    # -----------------------
+    # Middleware сессии
+    # -----------------------
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not method.__api_method__.startswith(QUEUED_PREFIXES):
+            return await self._call_with_retry(make_request, bot, method)
+        future = asyncio.get_running_loop().create_future()
+        self._enqueue(chat_id, _Outgoing(make_request, bot, method, _priority.get(), future))
+        return await future
+
+    async def _call_with_retry(self, make_request, bot, method):
+        attempts = 0
+        while True:
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                attempts += 1
+                if attempts > self.max_retries:
+                    raise
+                self.retried += 1
+                await asyncio.sleep(self._backoff(e.retry_after, attempts))
+
+    def _backoff(self, retry_after, attempts):
+        delay = max(retry_after, self.retry_base * 2 ** (attempts - 1))
+        return delay * (1 + self.rng.uniform(0, self.retry_jitter))
+
+    # -----------------------
+    # Очередь
+    # -----------------------
+
+    def _rate(self, chat_id):
+        # В личных чатах chat_id положительный; группы и каналы — отрицательный id или @username
+        if isinstance(chat_id, int) and chat_id > 0:
+            return self.chat_rate, self.chat_burst
+        return self.group_rate, self.group_burst
+
+    def _chat(self, chat_id, now):
+        chat = self._chats.get(chat_id)
+        if chat is None:
+            chat = self._chats[chat_id] = _Chat(self._rate(chat_id)[1], now)
+            self._evict(now)
+        else:
+            self._chats.move_to_end(chat_id)
+        return chat
+
+    def _evict(self, now):
+        # Удаляем только простаивающие чаты с восполненной корзиной: новый чат от них не отличается
+        for chat_id in list(itertools.islice(self._chats, max(0, len(self._chats) - self.max_chats) + 16)):
+            chat = self._chats[chat_id]
+            if chat.queue or chat.busy or chat.scheduled:
+                continue
+            rate, burst = self._rate(chat_id)
+            if now - chat.updated_at >= burst / rate and now >= chat.blocked_until:
+                del self._chats[chat_id]
+
+    def _enqueue(self, chat_id, item):
+        now = self.clock()
+        chat = self._chat(chat_id, now)
+        self.pending += 1
+        if self.merge and chat.queue and item.priority == chat.queue[-1].priority:
+            last = chat.queue[-1]
+            if item.bot is last.bot and _can_merge(last.method, item.method):
+                last.method = last.method.model_copy(update={
+                    "text": last.method.text + MERGE_SEPARATOR + item.method.text,
+                    "reply_markup": item.method.reply_markup,
+                })
+                last.futures.extend(item.futures)
+                self.merged += 1
+                return
+        chat.queue.append(item)
+        self._schedule(chat_id, chat, now)
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="outbound-queue")
+
+    def _schedule(self, chat_id, chat, now):
+        if chat.busy or chat.scheduled or not chat.queue:
+            return
+        rate, burst = self._rate(chat_id)
+        chat.tokens = min(burst, chat.tokens + (now - chat.updated_at) * rate)
+        chat.updated_at = now
+        ready_at = max(chat.blocked_until, now + (1 - chat.tokens) / rate if chat.tokens < 1 else now)
+        chat.scheduled = True
+        if ready_at <= now:
+            self._ready[chat.queue[0].priority].append(chat_id)
+            self._wakeup.set()
+        else:
+            heapq.heappush(self._timers, (ready_at, next(self._timer_ids), chat_id))
+            self._wakeup.set()
+
+    def _release_due(self, now):
+        while self._timers and self._timers[0][0] <= now:
+            _, _, chat_id = heapq.heappop(self._timers)
+            chat = self._chats.get(chat_id)
+            if chat is not None and chat.queue:
+                self._ready[chat.queue[0].priority].append(chat_id)
+            elif chat is not None:
+                chat.scheduled = False
+
+    def _next_ready(self):
+        for ready in self._ready:
+            if ready:
+                return ready.popleft()
+        return None
+
+    async def _run(self):
+        while True:
+            now = self.clock()
+            self._release_due(now)
+            if not (self._ready[INTERACTIVE] or self._ready[BULK]):
+                delay = self._timers[0][0] - now if self._timers else None
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._global_tokens = min(
+                self.global_burst, self._global_tokens + (now - self._global_updated_at) * self.global_rate
+            )
+            self._global_updated_at = now
+            if self._global_tokens < 1:
+                await asyncio.sleep((1 - self._global_tokens) / self.global_rate)
+                continue
+            chat_id = self._next_ready()
+            chat = self._chats[chat_id]
+            rate, burst = self._rate(chat_id)
+            chat.tokens = min(burst, chat.tokens + (now - chat.updated_at) * rate) - 1
+            chat.updated_at = now
+            self._global_tokens -= 1
+            chat.scheduled = False
+            chat.busy = True
+            task = asyncio.create_task(self._send(chat_id, chat, chat.queue.popleft()))
+            self._sending.add(task)
+            task.add_done_callback(self._sending.discard)
+
+    async def _send(self, chat_id, chat, item):
+        try:
+            result = await item.make_request(item.bot, item.method)
+        except TelegramRetryAfter as e:
+            item.attempts += 1
+            if item.attempts > self.max_retries:
+                self._finish(item, exception=e)
+            else:
+                self.retried += 1
+                delay = self._backoff(e.retry_after, item.attempts)
+                logger.warning(f"Telegram ограничил отправку в чат {chat_id}: повтор через {delay:.1f} с")
+                chat.queue.appendleft(item)
+                chat.blocked_until = self.clock() + delay
+                # Ограничение могло быть общим для бота — замедляем и остальные отправки
+                self._global_tokens = min(self._global_tokens, 0)
+        except Exception as e:
+            self._finish(item, exception=e)
+        else:
+            self._finish(item, result=result)
+        finally:
+            chat.busy = False
+            self._schedule(chat_id, chat, self.clock())
+
+    def _finish(self, item, result=None, exception=None):
+        self.pending -= len(item.futures)
+        if exception is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+        for future in item.futures:
+            if future.done():
+                continue
+            if exception is None:
+                future.set_result(result)
+            else:
+                future.set_exception(exception)
+
+    async def close(self, timeout=5.0):
+        """Ждёт отправки очереди (не дольше timeout секунд), затем останавливает её."""
+        deadline = time.monotonic() + timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self.pending:
+            logger.warning(f"Очередь отправки остановлена, не отправлено сообщений: {self.pending}")
+        for chat in self._chats.values():
+            for item in chat.queue:
+                for future in item.futures:
+                    future.cancel()
+            chat.queue.clear()
+        self.pending = 0
@@ -0,0 +1,465 @@
+import asyncio
+import logging
+from collections import OrderedDict
+
+import income
+import ledger
+from metrics import render_values
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Горячее состояние игроков
+# =======================
+#
+# Недавно активные игроки держатся в памяти (LRU на max_players записей):
+# баланс, уровень, ресурсы, здания и полученные достижения. /my_cafe и
+# /inventory для них не обращаются к базе.
+#
+# Изменения делятся на два вида:
+# - /collect и зачисление пассивного дохода при просмотре кофейни применяются
+#   в памяти и копятся как отложенные (pending); фоновая задача раз в
+#   flush_interval секунд пишет их в базу одной транзакцией (write-behind);
+# - траты (улучшение, покупка) и прочие изменения идут через write(): сначала
+#   в той же транзакции дописываются отложенные изменения игрока, затем
+#   выполняется действие (условный UPDATE из game_actions), после чего
+#   состояние перечитывается. Поэтому проверка «хватает ли монет/ресурсов»
+#   всегда делается в базе по актуальным данным.
+#
+# Гарантии при аварийном завершении: теряются только отложенные изменения
+# последних flush_interval секунд. Траты никогда не откладываются, поэтому
+# списание не может потеряться или повториться. Незаписанное зачисление дохода
+# не теряется: доход считается от players.last_income и будет зачислен при
+# следующем обращении. Могут пропасть ресурсы из /collect за последние
+# flush_interval секунд и выданные за них достижения (их вернёт
+# /backfill_achievements). При штатной остановке close() записывает всё.
+#
+# Изменения в базе в обход хранилища (массовое зачисление дохода, перепроверка
+# достижений) должны сопровождаться invalidate(): запись перечитается при
+# следующем обращении, отложенные изменения сохраняются.
+#
+# Каждое изменение состояния в памяти увеличивает его version (touch()):
+# по версии кэшируется отрисовка (см. cafe_view.py). Перечитанное из базы
+# состояние — новый объект без кэша.
+
+
+class PlayerState:
+    __slots__ = (
+        "cafe_name", "balance", "level", "last_income", "resources", "buildings", "achievements",
+        "pending_resources", "pending_achievements", "pending_settle_at", "version", "rendered",
+    )
+
+    def __init__(self, cafe_name, balance, level, last_income, resources, buildings, achievements):
+        self.cafe_name = cafe_name
+        self.balance = balance
+        self.level = level
+        self.last_income = last_income
+        # resource_id -> количество, building_id -> уровень; порядок как в справочнике
+        self.resources = resources
+        self.buildings = buildings
+        self.achievements = achievements
+        # catalog.Resource -> прирост: название ресурса нужно для записи в журнал
+        self.pending_resources = None
+        self.pending_achievements = None
+        self.pending_settle_at = None
+        self.version = 0
+        # Кэш отрисовки для текущей версии (cafe_view.render)
+        self.rendered = None
+
+    def touch(self):
+        """Отмечает изменение состояния: кэш отрисовки прежней версии больше не подходит."""
+        self.version += 1
+
+    @property
+    def dirty(self):
+        return bool(self.pending_resources or self.pending_achievements or self.pending_settle_at)
+
+    def take_pending(self):
+        pending = (self.pending_resources, self.pending_achievements, self.pending_settle_at)
+        self.pending_resources = self.pending_achievements = self.pending_settle_at = None
+        return pending
+
+    def restore_pending(self, pending):
+        """Возвращает отложенные изменения после неудачной записи (с учётом появившихся за это время)."""
+        resources, achievements, settle_at = pending
+        if resources:
+            merged = dict(resources)
+            for resource, delta in (self.pending_resources or {}).items():
+                merged[resource] = merged.get(resource, 0) + delta
+            self.pending_resources = merged
+        if achievements:
+            self.pending_achievements = list(achievements) + (self.pending_achievements or [])
+        if settle_at is not None:
+            self.pending_settle_at = max(settle_at, self.pending_settle_at or settle_at)
+
+
+# Состояние игрока одним запросом. JOIN таблиц «один ко многим» дал бы произведение
+# строк (ресурсы x здания x достижения), поэтому части объединяются UNION ALL,
+# а первая колонка указывает, из какой таблицы строка
+_STATE_PLAYER, _STATE_RESOURCE, _STATE_BUILDING, _STATE_ACHIEVEMENT = range(4)
+
+_LOAD_STATE_SQL = f"""
+    SELECT {_STATE_PLAYER}, cafe_name, balance, level, last_income FROM players WHERE user_id = :user_id
+    UNION ALL
+    SELECT {_STATE_RESOURCE}, resource_id, quantity, NULL, NULL FROM user_resources WHERE user_id = :user_id
+    UNION ALL
+    SELECT {_STATE_BUILDING}, building_id, level, NULL, NULL FROM user_buildings WHERE user_id = :user_id
+    UNION ALL
+    SELECT {_STATE_ACHIEVEMENT}, achievement_id, NULL, NULL, NULL FROM user_achievements WHERE user_id = :user_id
+"""
+
+
+def load_state(conn, user_id):
+    """Читает состояние игрока из базы или возвращает None, если он не зарегистрирован."""
+    player = None
+    resources = {}
+    buildings = {}
+    achievements = set()
+    for kind, key, value, level, last_income in conn.execute(_LOAD_STATE_SQL, {"user_id": user_id}):
+        if kind == _STATE_RESOURCE:
+            resources[key] = value
+        elif kind == _STATE_BUILDING:
+            buildings[key] = value
+        elif kind == _STATE_ACHIEVEMENT:
+            achievements.add(key)
+        else:
+            player = (key, value, level, last_income)
+    if player is None:
+        return None
+    cafe_name, balance, level, last_income = player
+    return PlayerState(cafe_name, balance or 0, level or 1, last_income or 0, resources, buildings, achievements)
+
+
+def _flush_pending(conn, batch):
+    """Пишет отложенные изменения [(user_id, pending)] в базу внутри транзакции вызывающего."""
+    resource_rows = []
+    ledger_entries = []
+    achievement_rows = []
+    settles = []
+    for user_id, (resources, achievements, settle_at) in batch:
+        for resource, delta in (resources or {}).items():
+            resource_rows.append((user_id, resource.resource_id, delta))
+            ledger_entries.append((user_id, resource.name, delta, "collect"))
+        achievement_rows.extend((user_id, achievement_id) for achievement_id in achievements or ())
+        if settle_at is not None:
+            settles.append((user_id, settle_at))
+    if resource_rows:
+        conn.executemany("""
+            INSERT INTO user_resources (user_id, resource_id, quantity) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, resource_id) DO UPDATE SET quantity = quantity + excluded.quantity
+        """, resource_rows)
+        ledger.record(conn, ledger_entries)
+    if achievement_rows:
+        conn.executemany("""
+            INSERT INTO user_achievements (user_id, achievement_id) VALUES (?, ?)
+            ON CONFLICT(user_id, achievement_id) DO NOTHING
+        """, achievement_rows)
+    # Доход зачисляется на тот же момент, что и в памяти, поэтому результат совпадает
+    for user_id, settle_at in settles:
+        income.settle(conn, user_id, at=settle_at)
+
+
+class HotStore:
+    def __init__(self, db, catalog, max_players=20000, flush_interval=1.0):
+        self.db = db
+        self.catalog = catalog
+        self.max_players = max(1, int(max_players))
+        self.flush_interval = flush_interval
+        self._states = OrderedDict()
+        self._dirty = set()
+        # Записи, изменённые в базе в обход хранилища: перечитываются при следующем get()
+        self._stale = set()
+        # Игроки, для которых сейчас выполняется write(), и их блокировки (write() одного игрока — по очереди)
+        self._writing = set()
+        self._locks = {}
+        # Игрок -> future записи в базу, в которую попали его отложенные изменения
+        self._flushing = {}
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+        self.flushed_players = 0
+
+    def stats(self):
+        return {
+            "players": len(self._states),
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+            "flushes": self.flushes,
+            "flushed_players": self.flushed_players,
+        }
+
+    def render(self):
+        """Метрики для /metrics (metrics.start_metrics_server, collectors)."""
+        return (
+            render_values("bot_hot_store_players", "gauge", "Игроки в горячем хранилище", None, len(self._states))
+            + render_values("bot_hot_store_dirty_players", "gauge", "Игроки с незаписанными изменениями",
+                            None, len(self._dirty))
+            + render_values("bot_hot_store_lookups_total", "counter", "Обращения к горячему хранилищу",
+                            "result", {"hit": self.hits, "miss": self.misses})
+            + render_values("bot_hot_store_flushes_total", "counter", "Фоновые записи отложенных изменений",
+                            None, self.flushes)
+            + render_values("bot_hot_store_flushed_players_total", "counter",
+                            "Игроки, чьи изменения записаны фоновой записью", None, self.flushed_players)
+        )
+
+    # -----------------------
+    # Кэш
+    # -----------------------
+
+    def _put(self, user_id, state):
+        self._states[user_id] = state
+        self._states.move_to_end(user_id)
+        if len(self._states) > self.max_players:
+            self._evict()
+
+    def _evict(self):
+        # Вытесняем самые давние чистые записи; записи с отложенными изменениями ждут записи в базу
+        excess = len(self._states) - self.max_players
+        for user_id in list(self._states)[:excess + len(self._dirty)]:
+            if excess <= 0:
+                break
+            if user_id not in self._dirty:
+                del self._states[user_id]
+                self._stale.discard(user_id)
+                excess -= 1
+
+    async def get(self, user_id):
+        """Состояние игрока (из памяти или из базы) или None для незарегистрированного."""
+        state = self._states.get(user_id)
+        if state is not None and user_id not in self._stale:
+            self.hits += 1
+            self._states.move_to_end(user_id)
+            return state
+        self.misses += 1
+        flushing = self._flushing.get(user_id)
+        if flushing is not None:
+            await asyncio.gather(asyncio.shield(flushing), return_exceptions=True)
+        loaded = await self.db.read(load_state, user_id)
+        state = self._states.get(user_id)
+        if user_id in self._writing or user_id in self._flushing:
+            # Во время write() или новой фоновой записи прочитанное может уже устареть, но кэшируется:
+            # изменения в памяти (collect, доход) возможны только в кэшированном состоянии, иначе
+            # flush() их не увидит. Запись помечается устаревшей и перечитывается после write()
+            # (_write_locked) или при следующем get()
+            if state is None and loaded is not None:
+                self._put(user_id, loaded)
+                self._stale.add(user_id)
+                state = loaded
+            return state
+        if state is None:
+            if loaded is not None:
+                self._put(user_id, loaded)
+            return loaded
+        if user_id in self._stale:
+            self._refresh(user_id, loaded)
+            return self._states.get(user_id)
+        # Пока читали базу, состояние появилось (параллельное обновление того же игрока)
+        return state
+
+    def invalidate(self, user_id):
+        """Отмечает, что данные игрока изменены в базе в обход хранилища (массовое зачисление и т. п.)."""
+        if user_id not in self._states:
+            return
+        if user_id in self._dirty or user_id in self._writing:
+            self._stale.add(user_id)
+        else:
+            del self._states[user_id]
+
+    def invalidate_all(self):
+        for user_id in list(self._states):
+            self.invalidate(user_id)
+
+    def _refresh(self, user_id, fresh):
+        # Свежие данные из базы + отложенные изменения, появившиеся во время записи
+        self._stale.discard(user_id)
+        state = self._states.get(user_id)
+        if state is None:
+            return
+        if fresh is None:
+            del self._states[user_id]
+            self._dirty.discard(user_id)
+            return
+        for resource, delta in (state.pending_resources or {}).items():
+            fresh.resources[resource.resource_id] = fresh.resources.get(resource.resource_id, 0) + delta
+        fresh.achievements.update(state.achievements)
+        fresh.pending_resources = state.pending_resources
+        fresh.pending_achievements = state.pending_achievements
+        fresh.pending_settle_at = state.pending_settle_at
+        self._states[user_id] = fresh
+
+    # -----------------------
+    # Изменения в памяти (write-behind)
+    # -----------------------
+
+    def _check_cached(self, user_id, state):
+        # Отложенные изменения записывает только flush() по кэшу: изменение копии потерялось бы
+        if self._states.get(user_id) is not state:
+            raise RuntimeError(f"Состояние игрока {user_id} не из кэша горячего хранилища.")
+
+    def _earned(self, state, engine, changes):
+        earned = []
+        for metric, key, old_value, new_value in changes:
+            for rule in engine.crossed(metric, key, old_value, new_value):
+                if rule.achievement_id not in state.achievements:
+                    state.achievements.add(rule.achievement_id)
+                    earned.append(rule)
+        if earned:
+            state.pending_achievements = (state.pending_achievements or []) + [rule.achievement_id for rule in earned]
+        return [rule.name for rule in earned]
+
+    def collect(self, user_id, state, resource, amount, engine):
+        """Начисляет ресурс (catalog.Resource) в памяти. Возвращает (новое количество, достижения)."""
+        self._check_cached(user_id, state)
+        old_quantity = state.resources.get(resource.resource_id, 0)
+        new_quantity = old_quantity + amount
+        state.resources[resource.resource_id] = new_quantity
+        pending = state.pending_resources
+        if pending is None:
+            pending = state.pending_resources = {}
+        pending[resource] = pending.get(resource, 0) + amount
+        state.touch()
+        earned = self._earned(state, engine, [("resource", resource.name, old_quantity, new_quantity)])
+        self._dirty.add(user_id)
+        return new_quantity, earned
+
+    def income_rate(self, state):
+        buildings_by_id = self.catalog.snapshot.buildings_by_id
+        return income.income_rate(state.level, [
+            (buildings_by_id[building_id].income_multiplier, level)
+            for building_id, level in state.buildings.items() if building_id in buildings_by_id
+        ])
+
+    def settle_income(self, user_id, state, engine, at=None):
+        """
+        Зачисляет накопленный доход в памяти по тем же формулам, что и income.settle.
+        Возвращает (новый баланс или None, если зачислять нечего, достижения).
+        """
+        self._check_cached(user_id, state)
+        at = income.now() if at is None else at
+        coins, seconds = income.accrued(at - state.last_income, self.income_rate(state))
+        if coins <= 0:
+            return None, []
+        old_balance = state.balance
+        state.balance += coins
+        state.last_income += seconds
+        state.pending_settle_at = at
+        state.touch()
+        earned = self._earned(state, engine, [("balance", None, old_balance, state.balance)])
+        self._dirty.add(user_id)
+        return state.balance, earned
+
+    # -----------------------
+    # Изменения через базу
+    # -----------------------
+
+    def _write_transaction(self, conn, fn, user_id, pending, args):
+        if pending is not None:
+            _flush_pending(conn, [(user_id, pending)])
+        result = fn(conn, user_id, *args)
+        # Перечитываем всегда: игрок мог попасть в кэш (get()) уже во время записи
+        return result, load_state(conn, user_id)
+
+    async def write(self, fn, user_id, *args):
+        """
+        Выполняет игровое действие fn(conn, user_id, *args) через db.write, предварительно
+        записав отложенные изменения игрока в той же транзакции. Возвращает результат fn.
+        """
+        lock = self._locks.get(user_id)
+        if lock is None:
+            lock = self._locks[user_id] = asyncio.Lock()
+        try:
+            async with lock:
+                # Отложенные изменения игрока уже пишутся фоновой записью — дожидаемся её,
+                # иначе прочитанное после действия состояние разошлось бы с памятью
+                flushing = self._flushing.get(user_id)
+                if flushing is not None:
+                    await asyncio.gather(asyncio.shield(flushing), return_exceptions=True)
+                return await self._write_locked(fn, user_id, args)
+        finally:
+            if not lock.locked() and user_id in self._locks:
+                del self._locks[user_id]
+
+    async def _write_locked(self, fn, user_id, args):
+        state = self._states.get(user_id)
+        pending = None
+        if state is not None and state.dirty:
+            pending = state.take_pending()
+            self._dirty.discard(user_id)
+        self._writing.add(user_id)
+        try:
+            result, fresh = await self.db.write(self._write_transaction, fn, user_id, pending, args)
+        except Exception:
+            if pending is not None and user_id in self._states:
+                self._states[user_id].restore_pending(pending)
+                self._dirty.add(user_id)
+            raise
+        finally:
+            self._writing.discard(user_id)
+        if fresh is not None:
+            self._refresh(user_id, fresh)
+        if user_id in self._states and self._states[user_id].dirty:
+            self._dirty.add(user_id)
+        return result
+
+    # -----------------------
+    # Запись в базу
+    # -----------------------
+
+    async def flush(self):
+        """Записывает все отложенные изменения одной транзакцией. Возвращает число игроков."""
+        if not self._dirty:
+            return 0
+        batch = []
+        for user_id in list(self._dirty):
+            # Изменения игрока, для которого идёт write(), запишет сам write() или следующая запись
+            if user_id in self._writing:
+                continue
+            self._dirty.discard(user_id)
+            state = self._states.get(user_id)
+            if state is not None and state.dirty:
+                batch.append((user_id, state.take_pending()))
+        if not batch:
+            return 0
+        done = asyncio.get_running_loop().create_future()
+        for user_id, _ in batch:
+            self._flushing[user_id] = done
+        try:
+            await self.db.write(_flush_pending, batch)
+        except Exception:
+            for user_id, pending in batch:
+                state = self._states.get(user_id)
+                if state is not None:
+                    state.restore_pending(pending)
+                    self._dirty.add(user_id)
+            raise
+        finally:
+            for user_id, _ in batch:
+                if self._flushing.get(user_id) is done:
+                    del self._flushing[user_id]
+            done.set_result(None)
+        self.flushes += 1
+        self.flushed_players += len(batch)
+        return len(batch)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при записи горячего состояния игроков: {e}", exc_info=True)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop(), name="hot-store-flush")
+
+    async def close(self):
+        """Останавливает фоновую запись и записывает оставшиеся изменения."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        flushed = await self.flush()
+        logger.info(f"Горячее состояние игроков записано при остановке: игроков {flushed}")
@@ -0,0 +1,275 @@
+import asyncio
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from metrics import Histogram, render_histograms, render_values
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Планировщик фоновых задач
+# =======================
+#
+# Периодическая работа процесса (обслуживание базы, снимки журнала, прогрев
+# кэшей) регистрируется как задания одного планировщика, а не отдельными
+# циклами с asyncio.sleep:
+# - расписание — интервал (Interval) или cron-выражение из пяти полей (Cron,
+#   местное время); к каждому ожиданию добавляется случайная задержка до
+#   jitter секунд, чтобы процессы и задания не стартовали одновременно;
+# - у каждого задания одна задача asyncio, следующий запуск планируется после
+#   окончания текущего, поэтому запуски одного задания не пересекаются.
+#   Пропущенные из-за долгого выполнения моменты cron не догоняются, а
+#   считаются (missed);
+# - blocking=True — синхронная функция выполняется в пуле потоков
+#   планировщика и не блокирует event loop с обработкой обновлений.
+#   По умолчанию поток один: тяжёлые задания выполняются по очереди;
+# - длительность запусков, ошибки и пропуски отдаются в метриках (render()).
+
+# Границы корзин гистограммы длительности заданий, секунды
+JOB_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0)
+
+
+# -----------------------
+# Расписания
+# -----------------------
+
+class Interval:
+    """Интервал в секундах между окончанием запуска и следующим запуском."""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError(f"Интервал должен быть положительным: {seconds}")
+        self.seconds = float(seconds)
+
+    def delay(self, now):
+        return self.seconds
+
+    def __repr__(self):
+        return f"Interval({self.seconds:g})"
+
+
+# (минимум, максимум) полей cron: минута, час, день месяца, месяц, день недели (0 и 7 — воскресенье)
+_CRON_FIELDS = ((0, 59), (0, 23), (1, 31), (1, 12), (0, 7))
+
+
+def _parse_cron_field(text, low, high):
+    values = set()
+    for part in text.split(","):
+        value_range, _, step = part.partition("/")
+        if value_range == "*":
+            start, end = low, high
+        elif "-" in value_range:
+            start, end = (int(value) for value in value_range.split("-", 1))
+        else:
+            start = end = int(value_range)
+        step = int(step) if step else 1
+        if not low <= start <= end <= high or step < 1:
+            raise ValueError(f"Некорректное поле cron: {text!r}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+class Cron:
+    """Cron-выражение "минута час день месяц день_недели" (*, списки, диапазоны, шаг)."""
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron-выражение должно состоять из пяти полей: {expression!r}")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            _parse_cron_field(text, low, high) for text, (low, high) in zip(fields, _CRON_FIELDS)
+        )
+        self.weekdays = {day % 7 for day in weekdays}
+        # Как в cron: если ограничены и день месяца, и день недели, достаточно совпадения одного из них
+        self._any_day = fields[2] != "*" and fields[4] != "*"
+        self._sorted_hours = sorted(self.hours)
+        self._sorted_minutes = sorted(self.minutes)
+
+    def _day_matches(self, moment):
+        day = moment.day in self.days
+        weekday = (moment.weekday() + 1) % 7 in self.weekdays
+        return day or weekday if self._any_day else day and weekday
+
+    def next_after(self, moment):
+        """Ближайший момент расписания строго после moment."""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Перебор по дням: несуществующая дата (например, 31 февраля) не зацикливает поиск
+        for _ in range(366 * 8):
+            if moment.month in self.months and self._day_matches(moment):
+                for hour in self._sorted_hours:
+                    if hour < moment.hour:
+                        continue
+                    first_minute = moment.minute if hour == moment.hour else 0
+                    for minute in self._sorted_minutes:
+                        if minute >= first_minute:
+                            return moment.replace(hour=hour, minute=minute)
+            moment = (moment + timedelta(days=1)).replace(hour=0, minute=0)
+        raise ValueError(f"Cron-выражение никогда не срабатывает: {self.expression!r}")
+
+    def delay(self, now):
+        return (self.next_after(now) - now).total_seconds()
+
+    def __repr__(self):
+        return f"Cron({self.expression!r})"
+
+
+# -----------------------
+# Задания
+# -----------------------
+
+class Job:
+    __slots__ = ("name", "fn", "schedule", "jitter", "blocking", "task", "running", "next_run",
+                 "runs", "failures", "missed", "last_success", "durations")
+
+    def __init__(self, name, fn, schedule, jitter, blocking):
+        self.name = name
+        self.fn = fn
+        self.schedule = schedule
+        self.jitter = jitter
+        self.blocking = blocking
+        self.task = None
+        self.running = False
+        self.next_run = None
+        self.runs = 0
+        self.failures = 0
+        self.missed = 0
+        self.last_success = None
+        self.durations = Histogram(JOB_BUCKETS)
+
+
+class Scheduler:
+    def __init__(self, workers=1, clock=datetime.now, rng=None):
+        self.workers = max(1, int(workers))
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self._jobs = {}
+        self._executor = None
+        self._started = False
+
+    def add(self, name, fn, schedule, jitter=0.0, blocking=False):
+        """
+        Регистрирует задание. fn — корутинная функция без аргументов или, при blocking=True,
+        синхронная функция, выполняемая в пуле потоков. schedule — Interval(...) или Cron(...).
+        """
+        if name in self._jobs:
+            raise ValueError(f"Задание {name} уже зарегистрировано")
+        # Расписание без срабатываний (например, 31 февраля) — ошибка настройки, а не падение задачи позже
+        schedule.delay(self.clock())
+        job = self._jobs[name] = Job(name, fn, schedule, max(0.0, float(jitter)), blocking)
+        if self._started:
+            job.task = asyncio.create_task(self._loop(job), name=f"job-{name}")
+        return job
+
+    @property
+    def jobs(self):
+        return dict(self._jobs)
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="scheduler")
+        for job in self._jobs.values():
+            job.task = asyncio.create_task(self._loop(job), name=f"job-{job.name}")
+        logger.info(
+            "Планировщик запущен: " + ", ".join(f"{job.name} {job.schedule!r}" for job in self._jobs.values())
+        )
+
+    async def stop(self):
+        """Останавливает задания; выполняющиеся в пуле потоков запуски дорабатывают до конца."""
+        if not self._started:
+            return
+        self._started = False
+        tasks = [job.task for job in self._jobs.values() if job.task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for job in self._jobs.values():
+            job.task = None
+        executor, self._executor = self._executor, None
+        await asyncio.to_thread(executor.shutdown, True)
+
+    async def run(self, name):
+        """Запускает задание вне расписания. Возвращает False, если оно уже выполняется."""
+        job = self._jobs[name]
+        if job.running:
+            job.missed += 1
+            return False
+        await self._run(job)
+        return True
+
+    async def _loop(self, job):
+        while True:
+            now = self.clock()
+            delay = job.schedule.delay(now) + self.rng.uniform(0, job.jitter)
+            job.next_run = now + timedelta(seconds=delay)
+            await asyncio.sleep(delay)
+            if job.running:
+                # Запуск вне расписания ещё идёт
+                job.missed += 1
+                continue
+            await self._run(job)
+            if isinstance(job.schedule, Cron):
+                # Моменты расписания, прошедшие за время выполнения, пропускаются
+                moment = job.next_run
+                while (moment := job.schedule.next_after(moment)) <= self.clock():
+                    job.missed += 1
+
+    async def _run(self, job):
+        job.running = True
+        started = time.perf_counter()
+        try:
+            if job.blocking:
+                await asyncio.get_running_loop().run_in_executor(self._executor, job.fn)
+            else:
+                await job.fn()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.failures += 1
+            logger.error(f"Ошибка в фоновом задании {job.name}: {e}", exc_info=True)
+        else:
+            job.last_success = time.time()
+        finally:
+            duration = time.perf_counter() - started
+            job.running = False
+            job.runs += 1
+            job.durations.observe(duration)
+        logger.debug(f"Фоновое задание {job.name} выполнено за {duration:.3f} с")
+
+    # -----------------------
+    # Метрики
+    # -----------------------
+
+    def stats(self):
+        return {
+            name: {
+                "runs": job.runs,
+                "failures": job.failures,
+                "missed": job.missed,
+                "running": job.running,
+                "next_run": job.next_run.isoformat(timespec="seconds") if job.next_run else None,
+            }
+            for name, job in self._jobs.items()
+        }
+
+    def render(self):
+        jobs = self._jobs.values()
+        return (
+            render_histograms("bot_job_duration_seconds", "Длительность запусков фоновых заданий",
+                              "job", {job.name: job.durations for job in jobs})
+            + render_values("bot_job_failures_total", "counter", "Запуски фоновых заданий с ошибкой",
+                            "job", {job.name: job.failures for job in jobs})
+            + render_values("bot_job_missed_total", "counter",
+                            "Пропущенные запуски фоновых заданий (предыдущий ещё выполнялся)",
+                            "job", {job.name: job.missed for job in jobs})
+            + render_values("bot_job_running", "gauge", "Фоновые задания, выполняющиеся сейчас",
+                            "job", {job.name: int(job.running) for job in jobs})
+            + render_values("bot_job_last_success_timestamp_seconds", "gauge",
+                            "Время последнего успешного запуска фонового задания",
+                            "job", {job.name: job.last_success for job in jobs if job.last_success})
+        )
@@ -0,0 +1,341 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from bootstrap import bootstrap_database
+from webhook import KeyedWorkerPool, make_webhook_handler, routing_key
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Несколько процессов-воркеров
+# =======================
+#
+# Один процесс Python использует одно ядро. В режиме BOT_MODE=supervisor
+# главный процесс только принимает обновления (webhook или polling) и
+# раскладывает их по N процессам-воркерам по hash(user_id) % N, поэтому
+# обновления одного пользователя по-прежнему обрабатываются по порядку.
+#
+# Данные игроков шардированы: воркер i работает со своим файлом
+# game.shard{i}.db, и игрок всегда попадает в один и тот же шард. Справочники
+# одинаково заполняются в каждом шарде, /reload_catalog рассылается всем
+# воркерам. Лидерборд общий: каждый воркер при старте собирает его из всех
+# шардов, а изменения рейтинга пересылаются остальным воркерам через супервизор.
+# Административные запросы по данным игроков (/check_ledger, /backfill_achievements,
+# /ledger <user_id>) воркер, получивший команду, отправляет через супервизор
+# воркерам нужных шардов (ShardRequests) и собирает их ответы.
+#
+# Важно: число процессов определяет раскладку игроков по шардам. Менять
+# BOT_PROCESSES для существующих данных без их перераспределения нельзя.
+
+# Сообщения воркеру: ("update", raw) | ("leaderboard", user_id, changes) | ("catalog_reload",)
+#   | ("admin", source, request_id, action, args) | ("admin_reply", request_id, ok, result) | None — стоп
+# Сообщения супервизору: ("ready", index) | ("leaderboard", index, user_id, changes) | ("catalog_reload", index)
+#   | ("admin", source, target, request_id, action, args) | ("admin_reply", source, request_id, ok, result)
+
+# Сколько ждать ответа шарда на административный запрос, секунд
+ADMIN_REQUEST_TIMEOUT = 600
+
+
+def shard_index(key, shards):
+    return hash(key) % shards
+
+
+def shard_path(path, index, shards):
+    if shards == 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.shard{index}{ext}"
+
+
+# -----------------------
+# Административные запросы к шардам
+# -----------------------
+
+class ShardRequests:
+    """
+    Выполнение административных действий (bot_main.ADMIN_ACTIONS) на шардах из воркера index.
+    Свой шард обслуживается на месте, остальные — через супервизор; ответ приходит в inbox воркера.
+    """
+
+    def __init__(self, index, shards, outbox, actions, timeout=ADMIN_REQUEST_TIMEOUT):
+        self.index = index
+        self.shards = shards
+        self.actions = actions
+        self.timeout = timeout
+        self._outbox = outbox
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+    async def call_all(self, action, *args):
+        """Результаты action(*args) на всех шардах, по порядку шардов."""
+        return await self._call(range(self.shards), action, args)
+
+    async def call_shard(self, key, action, *args):
+        """Результат action(*args) на шарде игрока key."""
+        (result,) = await self._call([shard_index(key, self.shards)], action, args)
+        return result
+
+    async def _call(self, targets, action, args):
+        loop = asyncio.get_running_loop()
+        calls = []
+        request_ids = []
+        for target in targets:
+            if target == self.index:
+                calls.append(self.actions[action](*args))
+                continue
+            request_id = next(self._ids)
+            future = self._pending[request_id] = loop.create_future()
+            request_ids.append(request_id)
+            self._outbox.put(("admin", self.index, target, request_id, action, args))
+            calls.append(future)
+        try:
+            return await asyncio.wait_for(asyncio.gather(*calls), self.timeout)
+        finally:
+            for request_id in request_ids:
+                self._pending.pop(request_id, None)
+
+    def resolve(self, request_id, ok, result):
+        future = self._pending.get(request_id)
+        if future is None or future.done():
+            # Запрос уже отменён по таймауту
+            return
+        if ok:
+            future.set_result(result)
+        else:
+            future.set_exception(RuntimeError(result))
+
+    async def serve(self, source, request_id, action, args):
+        """Выполняет запрос воркера source на своём шарде и отправляет ответ."""
+        try:
+            reply = (True, await self.actions[action](*args))
+        except Exception as e:
+            logger.error(f"Ошибка административного запроса {action} от воркера {source}: {e}", exc_info=True)
+            reply = (False, f"шард {self.index}: {e}")
+        self._outbox.put(("admin_reply", source, request_id) + reply)
+
+
+# -----------------------
+# Процесс-воркер
+# -----------------------
+
+def _worker_process(index, shards, db_path, inbox, outbox, concurrency):
+    # Импорт внутри процесса: при spawn модуль бота загружается заново в каждом воркере
+    import bot_main
+
+    bot_main.init_logging(f"bot.worker{index}.log")
+    bot_main.db_path = shard_path(db_path, index, shards)
+    bot_main.init_storage(leaderboard_paths=[shard_path(db_path, i, shards) for i in range(shards)])
+    bot_main.init_bot(processes=shards)
+    if bot_main.metrics_port:
+        # У каждого воркера свой эндпоинт метрик: METRICS_PORT + номер воркера
+        bot_main.metrics_port += index
+    try:
+        asyncio.run(_run_worker(bot_main, index, shards, inbox, outbox, concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _run_worker(bot_main, index, shards, inbox, outbox, concurrency):
+    loop = asyncio.get_running_loop()
+    remote_reload = False
+
+    @bot_main.leaderboards.on_update
+    def _publish_leaderboard(user_id, **changes):
+        outbox.put(("leaderboard", index, user_id, changes))
+
+    @bot_main.catalog.on_reload
+    def _publish_catalog_reload(snapshot):
+        if not remote_reload:
+            outbox.put(("catalog_reload", index))
+
+    async def feed(raw_update):
+        await bot_main.dispatcher.feed_raw_update(bot_main.bot, raw_update)
+
+    pool = KeyedWorkerPool(feed, workers=concurrency)
+    pool.start()
+    # Административные команды работают с данными всех шардов, а не только своего
+    bot_main.shard_requests = requests = ShardRequests(index, shards, outbox, bot_main.ADMIN_ACTIONS)
+    admin_tasks = set()
+    await bot_main.start_services()
+    outbox.put(("ready", index))
+    logger.info(f"Воркер {index} запущен, база: {bot_main.db_path}")
+
+    # Отдельный поток читает межпроцессную очередь, сохраняя порядок сообщений
+    reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"worker-{index}-inbox")
+    try:
+        while True:
+            message = await loop.run_in_executor(reader, inbox.get)
+            if message is None:
+                break
+            kind = message[0]
+            if kind == "update":
+                await pool.submit(routing_key(message[1]), message[1])
+            elif kind == "leaderboard":
+                _, user_id, changes = message
+                bot_main.leaderboards.update(user_id, notify=False, **changes)
+            elif kind == "catalog_reload":
+                remote_reload = True
+                try:
+                    await bot_main.catalog.reload(bot_main.db)
+                finally:
+                    remote_reload = False
+            elif kind == "admin":
+                # Долгие запросы (перепроверка достижений) не задерживают обновления
+                task = asyncio.create_task(requests.serve(*message[1:]))
+                admin_tasks.add(task)
+                task.add_done_callback(admin_tasks.discard)
+            elif kind == "admin_reply":
+                requests.resolve(*message[1:])
+    finally:
+        await pool.stop(drain=True)
+        await asyncio.gather(*admin_tasks, return_exceptions=True)
+        await bot_main.stop_services()
+        reader.shutdown(wait=False)
+        logger.info(f"Воркер {index} остановлен.")
+
+
+# -----------------------
+# Супервизор
+# -----------------------
+
+class Supervisor:
+    def __init__(self, processes, db_path="game.db", concurrency=8, queue_size=1000):
+        self.shards = max(1, int(processes))
+        self.db_path = db_path
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self._context = multiprocessing.get_context("spawn")
+        self._inboxes = []
+        self._outbox = None
+        self._processes = []
+        self._forwarder = None
+        self._ready = None
+
+    def _prepare_shards(self):
+        # Схема всех шардов готова до старта воркеров: каждый читает все шарды для лидерборда
+        for index in range(self.shards):
+            conn = sqlite3.connect(shard_path(self.db_path, index, self.shards))
+            try:
+                bootstrap_database(conn)
+            finally:
+                conn.close()
+
+    def _forward(self, loop):
+        # Поток супервизора: рассылает изменения общих данных остальным воркерам
+        ready = 0
+        while True:
+            message = self._outbox.get()
+            if message is None:
+                return
+            kind = message[0]
+            if kind == "ready":
+                ready += 1
+                if ready == self.shards:
+                    loop.call_soon_threadsafe(self._ready.set)
+            elif kind == "leaderboard":
+                _, source, user_id, changes = message
+                for index, inbox in enumerate(self._inboxes):
+                    if index != source:
+                        inbox.put(("leaderboard", user_id, changes))
+            elif kind == "catalog_reload":
+                for index, inbox in enumerate(self._inboxes):
+                    if index != message[1]:
+                        inbox.put(("catalog_reload",))
+            elif kind == "admin":
+                _, source, target, request_id, action, args = message
+                self._inboxes[target].put(("admin", source, request_id, action, args))
+            elif kind == "admin_reply":
+                _, source, request_id, ok, result = message
+                self._inboxes[source].put(("admin_reply", request_id, ok, result))
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        self._ready = asyncio.Event()
+        self._prepare_shards()
+        self._inboxes = [self._context.Queue(maxsize=self.queue_size) for _ in range(self.shards)]
+        self._outbox = self._context.Queue()
+        self._forwarder = threading.Thread(target=self._forward, args=(loop,), name="supervisor-forward", daemon=True)
+        self._forwarder.start()
+        for index in range(self.shards):
+            process = self._context.Process(
+                target=_worker_process,
+                args=(index, self.shards, self.db_path, self._inboxes[index], self._outbox, self.concurrency),
+                name=f"bot-worker-{index}"
+            )
+            process.start()
+            self._processes.append(process)
+        await self._ready.wait()
+        logger.info(f"Супервизор: запущено воркеров {self.shards}")
+
+    async def submit(self, key, raw_update):
+        inbox = self._inboxes[shard_index(key, self.shards)]
+        try:
+            inbox.put_nowait(("update", raw_update))
+        except queue.Full:
+            # Воркер не успевает: ждём места, не блокируя event loop
+            await asyncio.get_running_loop().run_in_executor(None, inbox.put, ("update", raw_update))
+
+    async def stop(self):
+        loop = asyncio.get_running_loop()
+        for inbox in self._inboxes:
+            await loop.run_in_executor(None, inbox.put, None)
+        for process in self._processes:
+            await loop.run_in_executor(None, process.join)
+        if self._outbox is not None:
+            self._outbox.put(None)
+            await loop.run_in_executor(None, self._forwarder.join)
+        logger.info("Супервизор: все воркеры остановлены.")
+
+
+async def _poll_updates(bot, submit):
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=30)
+        except Exception as e:
+            logger.error(f"Ошибка при получении обновлений: {e}", exc_info=True)
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            raw_update = update.model_dump(mode="json", exclude_none=True, by_alias=True)
+            await submit(routing_key(raw_update), raw_update)
+
+
+async def run_supervisor(bot, processes, db_path="game.db", transport="polling", concurrency=8, queue_size=1000,
+                         host="0.0.0.0", port=8080, path="/webhook", secret_token=None, webhook_url=None):
+    """
+    Запускает воркеров и принимает обновления до отмены.
+    bot используется только для получения обновлений (polling) и setWebhook.
+    """
+    supervisor = Supervisor(processes, db_path=db_path, concurrency=concurrency, queue_size=queue_size)
+    await supervisor.start()
+    runner = None
+    try:
+        if transport == "webhook":
+            app = web.Application()
+            app.router.add_post(path, make_webhook_handler(supervisor.submit, secret_token))
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            logger.info(f"Webhook-сервер супервизора запущен на {host}:{port}{path}")
+            if webhook_url:
+                await bot.set_webhook(webhook_url, secret_token=secret_token, drop_pending_updates=False)
+            await asyncio.Event().wait()
+        else:
+            await bot.delete_webhook(drop_pending_updates=False)
+            await _poll_updates(bot, supervisor.submit)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await supervisor.stop()
+        await bot.session.close()
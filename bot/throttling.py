@@ -0,0 +1,172 @@
+import logging
+import time
+from collections import Counter, OrderedDict
+
+from callbacks import action_name
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Ограничение частоты запросов
+# =======================
+#
+# Внешний middleware для dispatcher.update: до хендлеров и базы проверяет
+# token bucket пользователя — общий ("*") и для конкретной команды. Если
+# токенов нет, обновление отбрасывается; пользователь получает одно
+# предупреждение на эпизод ограничения, а не ответ на каждое нажатие.
+#
+# Корзины хранятся в OrderedDict в порядке последнего обращения (LRU):
+# их число ограничено max_buckets, а давно не использованные удаляются по TTL.
+# TTL не меньше времени полного восполнения корзины, поэтому удалённая
+# корзина ничем не отличается от новой (полной) и удаление не ослабляет лимит.
+
+GLOBAL_KEY = "*"
+
+# Ключ -> (ёмкость, период в секундах): не больше «ёмкости» запросов подряд,
+# восполнение — ёмкость за период
+DEFAULT_RATES = {
+    GLOBAL_KEY: (20, 10.0),
+    "/collect": (5, 10.0),
+    "/upgrade": (3, 10.0),
+    "upgrade_cafe": (3, 10.0),
+    "buy": (3, 10.0),
+}
+
+THROTTLED_TEXT = "Слишком много запросов. Подождите несколько секунд."
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated_at", "warned")
+
+    def __init__(self, tokens, now):
+        self.tokens = tokens
+        self.updated_at = now
+        self.warned = False
+
+
+def parse_rates(spec):
+    """Разбирает строку вида "/collect=5/10,buy=3/10,*=20/10" в словарь ключ -> (ёмкость, период)."""
+    rates = {}
+    for item in (spec or "").split(","):
+        if "=" not in item:
+            continue
+        key, value = item.split("=", 1)
+        capacity, _, period = value.partition("/")
+        rates[key.strip()] = (int(capacity), float(period or 1))
+    return rates
+
+
+def throttle_key(update):
+    """(user_id, ключ команды) для обновления или (None, None), если ограничивать нечего."""
+    if update.message is not None:
+        user = update.message.from_user
+        text = update.message.text or ""
+        key = text.split(maxsplit=1)[0].split("@", 1)[0] if text.startswith("/") else None
+    elif update.callback_query is not None:
+        user = update.callback_query.from_user
+        data = update.callback_query.data or ""
+        key = action_name(data) or data.split(":", 1)[0]
+    else:
+        return None, None
+    return (user.id if user else None), key
+
+
+class ThrottlingMiddleware:
+    def __init__(self, rates=None, max_buckets=100_000, idle_ttl=600.0, clock=time.monotonic):
+        self.rates = dict(DEFAULT_RATES if rates is None else rates)
+        self.max_buckets = max(1, int(max_buckets))
+        longest_refill = max((period for _, period in self.rates.values()), default=0.0)
+        self.idle_ttl = max(float(idle_ttl), longest_refill)
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self.rejected = Counter()
+        self.evicted = 0
+
+    def metrics(self):
+        return {
+            "buckets": len(self._buckets),
+            "evicted": self.evicted,
+            "rejected_total": sum(self.rejected.values()),
+            "rejected": dict(self.rejected),
+        }
+
+    def render(self):
+        """Метрики для /metrics (metrics.start_metrics_server, collectors)."""
+        # Импорт здесь: metrics сам импортирует throttle_key для меток команд
+        from metrics import render_values
+
+        return (
+            render_values("bot_throttle_rejected_total", "counter", "Обновления, отброшенные ограничителем частоты",
+                          "key", {key: self.rejected.get(key, 0) for key in self.rates.keys() | self.rejected.keys()})
+            + render_values("bot_throttle_buckets", "gauge", "Корзины ограничителя частоты в памяти",
+                            None, len(self._buckets))
+            + render_values("bot_throttle_evicted_total", "counter",
+                            "Корзины, удалённые по TTL или лимиту max_buckets", None, self.evicted)
+        )
+
+    def _evict(self, now):
+        buckets = self._buckets
+        while len(buckets) > self.max_buckets:
+            buckets.popitem(last=False)
+            self.evicted += 1
+        # Самые старые корзины — в начале; проверяем только их
+        while buckets:
+            _, oldest = next(iter(buckets.items()))
+            if now - oldest.updated_at < self.idle_ttl:
+                break
+            buckets.popitem(last=False)
+            self.evicted += 1
+
+    def _bucket(self, bucket_key, capacity, now):
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            bucket = self._buckets[bucket_key] = TokenBucket(capacity, now)
+            self._evict(now)
+        else:
+            self._buckets.move_to_end(bucket_key)
+        return bucket
+
+    def allow(self, user_id, key):
+        """
+        Проверяет общую корзину пользователя и корзину команды и списывает по токену из обеих.
+        Возвращает None, если запрос разрешён, иначе отказавшую корзину (токены тогда не списываются).
+        """
+        now = self.clock()
+        checked = []
+        for rate_key in (GLOBAL_KEY, key):
+            rate = self.rates.get(rate_key)
+            if rate is None:
+                continue
+            capacity, period = rate
+            bucket = self._bucket((user_id, rate_key), capacity, now)
+            bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated_at) * capacity / period)
+            bucket.updated_at = now
+            if bucket.tokens < 1:
+                self.rejected[rate_key] += 1
+                return bucket
+            checked.append(bucket)
+        for bucket in checked:
+            bucket.tokens -= 1
+            bucket.warned = False
+        return None
+
+    async def __call__(self, handler, event, data):
+        user_id, key = throttle_key(event)
+        if user_id is None:
+            return await handler(event, data)
+        bucket = self.allow(user_id, key)
+        if bucket is None:
+            return await handler(event, data)
+
+        # Отказ: хендлер и база не вызываются; предупреждаем один раз за эпизод
+        if not bucket.warned:
+            bucket.warned = True
+            logger.warning(f"Пользователь {user_id} ограничен по частоте запросов ({key}).")
+            try:
+                if event.callback_query is not None:
+                    await event.callback_query.answer(THROTTLED_TEXT)
+                elif event.message is not None:
+                    await event.message.answer(THROTTLED_TEXT)
+            except Exception as e:
+                logger.error(f"Не удалось отправить предупреждение об ограничении: {e}", exc_info=True)
+        return None
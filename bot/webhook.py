@@ -0,0 +1,135 @@
+import asyncio
+import json
+import logging
+import secrets
+
+from aiohttp import web
+
+logger = logging.getLogger("bot_logger")
+
+# =======================
+# Приём обновлений через webhook
+# =======================
+#
+# aiohttp-сервер принимает обновления от Telegram, проверяет секретный токен
+# и раскладывает их по пулу воркеров. Воркер выбирается по user_id, поэтому
+# обновления одного пользователя обрабатываются строго по очереди, а разные
+# пользователи — параллельно. Очереди воркеров ограничены: при перегрузке
+# запрос Telegram ждёт места в очереди (Telegram повторит доставку сам).
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def extract_user_id(raw_update):
+    """user_id отправителя из «сырого» обновления без полной десериализации, либо None."""
+    for key, value in raw_update.items():
+        if key != "update_id" and isinstance(value, dict):
+            sender = value.get("from") or value.get("user")
+            if isinstance(sender, dict) and "id" in sender:
+                return sender["id"]
+    return None
+
+
+class KeyedWorkerPool:
+    """Пул воркеров с упорядочиванием по ключу: один ключ — всегда один воркер."""
+
+    def __init__(self, handler, workers=8, queue_size=1000):
+        self._handler = handler
+        self._queues = [asyncio.Queue(maxsize=queue_size) for _ in range(max(1, workers))]
+        self._tasks = []
+
+    @property
+    def workers(self):
+        return len(self._queues)
+
+    def start(self):
+        self._tasks = [
+            asyncio.create_task(self._worker(queue), name=f"webhook-worker-{index}")
+            for index, queue in enumerate(self._queues)
+        ]
+
+    async def submit(self, key, item):
+        await self._queues[hash(key) % len(self._queues)].put(item)
+
+    def pending(self):
+        return sum(queue.qsize() for queue in self._queues)
+
+    async def _worker(self, queue):
+        while True:
+            item = await queue.get()
+            try:
+                await self._handler(item)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке обновления: {e}", exc_info=True)
+            finally:
+                queue.task_done()
+
+    async def stop(self, drain=True):
+        if drain:
+            # Дорабатываем уже принятые обновления, чтобы не потерять их при остановке
+            await asyncio.gather(*(queue.join() for queue in self._queues))
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+def make_webhook_handler(submit, secret_token=None):
+    """aiohttp-хендлер: проверяет секрет и передаёт обновление в submit(ключ, обновление)."""
+    async def handle(request):
+        if secret_token and not secrets.compare_digest(request.headers.get(SECRET_HEADER, ""), secret_token):
+            logger.warning(f"Webhook: запрос с неверным секретным токеном от {request.remote}")
+            return web.Response(status=401)
+        try:
+            raw_update = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400)
+        await submit(routing_key(raw_update), raw_update)
+        return web.Response()
+
+    return handle
+
+
+def routing_key(raw_update):
+    # Обновления без пользователя распределяем по update_id
+    user_id = extract_user_id(raw_update)
+    return user_id if user_id is not None else raw_update.get("update_id")
+
+
+def create_webhook_app(dispatcher, bot, path="/webhook", secret_token=None, workers=8, queue_size=1000):
+    async def feed(raw_update):
+        await dispatcher.feed_raw_update(bot, raw_update)
+
+    pool = KeyedWorkerPool(feed, workers=workers, queue_size=queue_size)
+
+    async def on_startup(app):
+        pool.start()
+
+    async def on_shutdown(app):
+        await pool.stop()
+
+    app = web.Application()
+    app["worker_pool"] = pool
+    app.router.add_post(path, make_webhook_handler(pool.submit, secret_token))
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+async def run_webhook(dispatcher, bot, host="0.0.0.0", port=8080, path="/webhook",
+                      secret_token=None, webhook_url=None, workers=8, queue_size=1000):
+    """Запускает webhook-сервер и работает до отмены. webhook_url — публичный адрес для setWebhook."""
+    app = create_webhook_app(dispatcher, bot, path=path, secret_token=secret_token,
+                             workers=workers, queue_size=queue_size)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    logger.info(f"Webhook-сервер запущен на {host}:{port}{path}, воркеров: {workers}")
+    try:
+        if webhook_url:
+            await bot.set_webhook(webhook_url, secret_token=secret_token, drop_pending_updates=False)
+            logger.info(f"Webhook зарегистрирован: {webhook_url}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,84 @@
+"""
+Кодек callback_data: токены, разбор кнопок формата до кодека и преобразование
+значений прежних версий действия.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import asyncio
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+import callbacks  # noqa: E402
+from callbacks import BUY_BUILDING, LEADERBOARD, MENU_BUTTON, UPGRADE_CAFE  # noqa: E402
+
+
+class EncodeDecodeTest(unittest.TestCase):
+    def test_round_trip(self):
+        for action, values in ((BUY_BUILDING, (3,)), (UPGRADE_CAFE, ()), (LEADERBOARD, (2, 41)),
+                               (MENU_BUTTON, (1,)), (LEADERBOARD, (0, -5))):
+            token = callbacks.encode(action, *values)
+            self.assertTrue(token.startswith(callbacks.TOKEN_PREFIX))
+            self.assertEqual(callbacks.decode(token), (action, action.version, values))
+            self.assertEqual(callbacks.action_name(token), action.name)
+
+    def test_large_values_fit_limit(self):
+        token = callbacks.encode(LEADERBOARD, 255, 2 ** 62)
+        self.assertLessEqual(len(token), callbacks.MAX_CALLBACK_DATA)
+        self.assertEqual(callbacks.decode(token)[2], (255, 2 ** 62))
+
+    def test_wrong_value_count(self):
+        with self.assertRaises(ValueError):
+            callbacks.encode(BUY_BUILDING)
+        with self.assertRaises(ValueError):
+            callbacks.encode(UPGRADE_CAFE, 1)
+
+    def test_legacy_formats(self):
+        self.assertEqual(callbacks.decode("upgrade_cafe"), (UPGRADE_CAFE, 0, ()))
+        self.assertEqual(callbacks.decode("button2"), (MENU_BUTTON, 0, (2,)))
+        self.assertEqual(callbacks.decode("buy_Склад"), (BUY_BUILDING, 0, ("Склад",)))
+        self.assertEqual(callbacks.decode("lb:level:3"), (LEADERBOARD, 0, ("level", 3)))
+        self.assertEqual(callbacks.action_name("buy_Склад"), "buy")
+        self.assertEqual(callbacks.action_name("lb:balance:0"), "lb")
+
+    def test_unknown_data(self):
+        for data in (None, "", "nothing", "lb:level:x", "~", "~_w", "~" + "A" * 3):
+            self.assertIsNone(callbacks.decode(data), data)
+        self.assertIsNone(callbacks.action_name("nothing"))
+        # Оборванный varint
+        self.assertIsNone(callbacks.decode("~AQGA"))
+
+
+class CallbackRouterTest(unittest.TestCase):
+    def setUp(self):
+        self.router = callbacks.CallbackRouter()
+        self.calls = []
+
+        # Версия 0 хранила название здания; в текущей версии — building_id
+        @self.router.handler(BUY_BUILDING, upgrades={0: lambda values: ({"Склад": 2}[values[0]],)})
+        async def buy(query, building_id):
+            self.calls.append((query, building_id))
+
+    def test_dispatch_current_version(self):
+        query = type("Query", (), {"data": callbacks.encode(BUY_BUILDING, 7)})()
+        self.assertTrue(asyncio.run(self.router.dispatch(query)))
+        self.assertEqual(self.calls, [(query, 7)])
+
+    def test_legacy_button_upgraded(self):
+        handler, values = self.router.resolve("buy_Склад")
+        self.assertEqual(values, (2,))
+
+    def test_rejected_buttons(self):
+        # Неизвестное название, нет обработчика, версия новее текущей
+        self.assertIsNone(self.router.resolve("buy_Офис"))
+        self.assertIsNone(self.router.resolve(callbacks.encode(UPGRADE_CAFE)))
+        future = callbacks.TOKEN_PREFIX + "AQkG"
+        self.assertEqual(callbacks.decode(future)[1], 9)
+        self.assertIsNone(self.router.resolve(future))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+"""
+Групповой коммит: ошибка одной операции откатывает только её SAVEPOINT,
+остальные операции пачки записываются одним коммитом.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from group_commit import GroupCommitWriter  # noqa: E402
+
+
+def insert(conn, value):
+    conn.execute("INSERT INTO items (value) VALUES (?)", (value,))
+    return value
+
+
+def insert_then_fail(conn, value):
+    conn.execute("INSERT INTO items (value) VALUES (?)", (value,))
+    raise RuntimeError("отказ операции")
+
+
+class GroupCommitWriterTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, "test.db")
+        with sqlite3.connect(self.path) as conn:
+            conn.execute("CREATE TABLE items (value INTEGER UNIQUE)")
+        conn.close()
+        # Длинное окно сбора: все операции теста попадают в одну пачку
+        self.writer = GroupCommitWriter(lambda: sqlite3.connect(self.path, check_same_thread=False),
+                                        flush_interval_ms=200, max_batch_size=16)
+
+    def tearDown(self):
+        self.writer.close()
+        self.workdir.cleanup()
+
+    def stored(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return [value for value, in conn.execute("SELECT value FROM items ORDER BY value")]
+        finally:
+            conn.close()
+
+    async def test_failed_operation_rolled_back_alone(self):
+        results = await asyncio.gather(
+            self.writer.submit(insert, (1,)),
+            self.writer.submit(insert_then_fail, (2,)),
+            # Нарушение UNIQUE внутри пачки
+            self.writer.submit(insert, (1,)),
+            self.writer.submit(insert, (3,)),
+            return_exceptions=True
+        )
+        self.assertEqual(results[0], 1)
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertIsInstance(results[2], sqlite3.IntegrityError)
+        self.assertEqual(results[3], 3)
+        self.assertEqual(self.stored(), [1, 3])
+
+        stats = self.writer.stats.as_dict()
+        self.assertEqual(stats["batches"], 1)
+        self.assertEqual(stats["operations"], 4)
+        self.assertEqual(stats["failed_operations"], 2)
+
+    async def test_batches_limited_by_size(self):
+        self.writer.max_batch_size = 2
+        await asyncio.gather(*(self.writer.submit(insert, (value,)) for value in range(5)))
+        self.assertEqual(self.stored(), list(range(5)))
+        self.assertEqual(self.writer.stats.batches, 3)
+        self.assertEqual(self.writer.stats.max_batch_size, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+Хендлеры команд через настоящий Dispatcher bot_main: обновление Telegram
+проходит middleware и роутер, вызовы Bot API записываются заглушкой сессии.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+sys.path.insert(0, os.path.join(ROOT, "bot"))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+
+from fake_telegram import make_message_update  # noqa: E402
+
+# Настройки читаются из окружения при инициализации бота
+os.environ.update({
+    "TELEGRAM_BOT_TOKEN": "123456:test",
+    "WEB_APP_URL": "https://example.com",
+    "LOG_CONSOLE": "0",
+    "OUTBOUND_QUEUE": "0",
+    "DB_GROUP_COMMIT": "0",
+})
+
+import bot_main  # noqa: E402
+
+
+class RecordingSession(BaseSession):
+    """Сессия aiogram без сети: сохраняет вызванные методы Bot API."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+        self._message_ids = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        self._message_ids += 1
+        result = {
+            "message_id": self._message_ids,
+            "date": int(time.time()),
+            "chat": {"id": getattr(method, "chat_id", None) or 0, "type": "private"},
+            "text": getattr(method, "text", None) or "",
+        }
+        content = json.dumps({"ok": True, "result": result})
+        return self.check_response(bot=bot, method=method, status_code=200, content=content).result
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class HandlerTest(unittest.IsolatedAsyncioTestCase):
+    # Диспетчер и база создаются один раз на процесс (роутер нельзя подключить повторно),
+    # поэтому у каждого теста свой игрок
+    workdir = None
+
+    @classmethod
+    def setUpClass(cls):
+        cls.workdir = tempfile.TemporaryDirectory()
+        cls.cwd = os.getcwd()
+        # Картинок кофейни в рабочем каталоге нет — /my_cafe отвечает текстом
+        os.chdir(cls.workdir.name)
+        bot_main.db_path = os.path.join(cls.workdir.name, "game.db")
+        bot_main.init_storage()
+        bot_main.init_bot()
+        cls.session = RecordingSession()
+        bot_main.bot = Bot(token=os.environ["TELEGRAM_BOT_TOKEN"], session=cls.session)
+
+    @classmethod
+    def tearDownClass(cls):
+        asyncio.run(bot_main.stop_services())
+        os.chdir(cls.cwd)
+        cls.workdir.cleanup()
+
+    async def send(self, user_id, text):
+        """Текст сообщений, отправленных ботом в ответ на text."""
+        sent = len(self.session.requests)
+        update = Update.model_validate(make_message_update(user_id, text), context={"bot": bot_main.bot})
+        await bot_main.dispatcher.feed_update(bot_main.bot, update)
+        return self.session.requests[sent:]
+
+    async def test_start_registers_player(self):
+        (reply,) = await self.send(1001, "/start")
+        self.assertIn("Добро пожаловать", reply.text)
+        buttons = [button for row in reply.reply_markup.inline_keyboard for button in row]
+        self.assertEqual([button.text for button in buttons], ["Кнопка 1", "Кнопка 2", "Open Game"])
+        self.assertEqual(buttons[-1].url, "https://example.com")
+
+        row = await bot_main.db.fetchone("SELECT balance, level FROM players WHERE user_id = ?", (1001,))
+        self.assertIsNotNone(row)
+
+    async def test_my_cafe_requires_start(self):
+        (reply,) = await self.send(1002, "/my_cafe")
+        self.assertIn("/start", reply.text)
+
+    async def test_my_cafe_after_start(self):
+        await self.send(1003, "/start")
+        (reply,) = await self.send(1003, "/my_cafe")
+        self.assertIn("Кофейня", reply.text)
+        self.assertIn("Баланс", reply.text)
+        self.assertEqual(reply.reply_markup, bot_main.cafe_view.UPGRADE_KEYBOARD)
+
+        # Повторный просмотр без изменений — та же подпись из кэша
+        (again,) = await self.send(1003, "/my_cafe")
+        self.assertEqual(again.text, reply.text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+"""
+Пассивный доход: формула начисления и зачисление в базе без потери дробной части.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+import income  # noqa: E402
+from bootstrap import bootstrap_database  # noqa: E402
+
+START = 1_700_000_000
+
+
+class AccruedTest(unittest.TestCase):
+    def test_whole_coins_and_paid_seconds(self):
+        self.assertEqual(income.accrued(3600, 50), (50, 3600))
+        # 100 с при 50 в час: одна монета, оплачено 72 с
+        self.assertEqual(income.accrued(100, 50), (1, 72))
+        self.assertEqual(income.accrued(71, 50), (0, 0))
+
+    def test_nothing_to_accrue(self):
+        self.assertEqual(income.accrued(0, 50), (0, 0))
+        self.assertEqual(income.accrued(-10, 50), (0, 0))
+        self.assertEqual(income.accrued(3600, 0), (0, 0))
+
+    def test_income_rate(self):
+        self.assertEqual(income.income_rate(1, []), income.INCOME_PER_HOUR)
+        self.assertEqual(income.income_rate(2, [(2, 1), (3, 2)]), income.INCOME_PER_HOUR * 10)
+
+
+class SettleTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        bootstrap_database(self.conn)
+        self.conn.execute(
+            "INSERT INTO players (user_id, cafe_name, balance, last_income, level) VALUES (1, 'A', 100, ?, 1)",
+            (START,)
+        )
+        # Магазин (доход x2) уровня 2: 10 * (1 + 2 * 2) = 50 монет в час
+        self.conn.execute("""
+            INSERT INTO user_buildings (user_id, building_id, level)
+            SELECT 1, building_id, 2 FROM buildings WHERE name = 'Магазин'
+        """)
+
+    def tearDown(self):
+        self.conn.close()
+
+    def player(self):
+        return self.conn.execute("SELECT balance, last_income FROM players WHERE user_id = 1").fetchone()
+
+    def test_settle_full_hour(self):
+        self.assertEqual(income.settle(self.conn, 1, at=START + 3600), 150)
+        self.assertEqual(self.player(), (150, START + 3600))
+        # Повторно в тот же момент зачислять нечего
+        self.assertIsNone(income.settle(self.conn, 1, at=START + 3600))
+
+    def test_frequent_settles_keep_fractions(self):
+        self.assertIsNone(income.settle(self.conn, 1, at=START + 71))
+        self.assertEqual(income.settle(self.conn, 1, at=START + 100), 101)
+        # Зачтены только 72 с из 100: остаток не теряется
+        self.assertEqual(self.player(), (101, START + 72))
+        for at in range(START + 110, START + 3600, 37):
+            income.settle(self.conn, 1, at=at)
+        income.settle(self.conn, 1, at=START + 3600)
+        self.assertEqual(self.player(), (150, START + 3600))
+
+    def test_settle_only_given_player(self):
+        self.conn.execute(
+            "INSERT INTO players (user_id, cafe_name, balance, last_income, level) VALUES (2, 'B', 0, ?, 1)",
+            (START,)
+        )
+        income.settle(self.conn, 2, at=START + 3600)
+        self.assertEqual(self.player(), (100, START))
+        self.assertEqual(self.conn.execute("SELECT balance FROM players WHERE user_id = 2").fetchone(), (10,))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+"""
+IndexableSkipList лидерборда: ранг и срезы сверяются с отсортированным списком.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from leaderboard import IndexableSkipList  # noqa: E402
+
+
+class IndexableSkipListTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(1)
+
+    def assert_matches(self, entries, expected):
+        self.assertEqual(len(entries), len(expected))
+        self.assertEqual(entries.slice(0, len(expected) + 1), expected)
+        for position, key in enumerate(expected):
+            self.assertEqual(entries.rank(key), position)
+
+    def test_empty(self):
+        entries = IndexableSkipList(expected_size=16)
+        self.assertEqual(len(entries), 0)
+        self.assertEqual(entries.slice(0, 10), [])
+        with self.assertRaises(KeyError):
+            entries.rank((0, 1))
+        with self.assertRaises(KeyError):
+            entries.remove((0, 1))
+
+    def test_random_inserts_and_removes(self):
+        entries = IndexableSkipList(expected_size=256)
+        expected = []
+        for step in range(2000):
+            if expected and random.random() < 0.4:
+                key = expected.pop(random.randrange(len(expected)))
+                entries.remove(key)
+            else:
+                # Ключи как у рейтинга: (-значение, user_id)
+                key = (-random.randrange(50), step)
+                entries.insert(key)
+                expected.append(key)
+                expected.sort()
+        self.assert_matches(entries, expected)
+
+    def test_slice_pages(self):
+        entries = IndexableSkipList(expected_size=64)
+        keys = [(-balance, user_id) for user_id, balance in enumerate(random.sample(range(1000), 95))]
+        for key in keys:
+            entries.insert(key)
+        keys.sort()
+        for start in range(0, 100, 10):
+            self.assertEqual(entries.slice(start, start + 10), keys[start:start + 10])
+        self.assertEqual(entries.slice(94, 200), keys[94:])
+        self.assertEqual(entries.slice(95, 100), [])
+        self.assertEqual(entries.slice(5, 5), [])
+
+    def test_rank_of_missing_key(self):
+        entries = IndexableSkipList(expected_size=16)
+        entries.insert((-10, 1))
+        entries.insert((-5, 2))
+        with self.assertRaises(KeyError):
+            entries.rank((-7, 3))
+        entries.remove((-10, 1))
+        self.assertEqual(entries.rank((-5, 2)), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
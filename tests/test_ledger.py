@@ -0,0 +1,84 @@
+"""
+Журнал монет и ресурсов: сверка остатков с players/user_resources по всему
+журналу и по снимку с хвостом.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import os
+import sqlite3
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+import ledger  # noqa: E402
+from bootstrap import bootstrap_database  # noqa: E402
+
+MILK = "Молоко"
+
+
+class LedgerCheckTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = sqlite3.connect(":memory:", isolation_level=None)
+        bootstrap_database(self.conn)
+        for user_id, balance in ((1, 150), (2, 0)):
+            self.conn.execute(
+                "INSERT INTO players (user_id, cafe_name, balance, last_income, level) VALUES (?, 'A', ?, 0, 1)",
+                (user_id, balance)
+            )
+        self.set_quantity(1, MILK, 4)
+        ledger.record(self.conn, [
+            (1, ledger.COINS, 200, "opening"),
+            (1, ledger.COINS, -50, "upgrade_cafe"),
+            (1, MILK, 4, "collect"),
+            # Нулевые изменения не пишутся
+            (2, ledger.COINS, 0, "opening"),
+        ])
+
+    def tearDown(self):
+        self.conn.close()
+
+    def set_quantity(self, user_id, resource, quantity):
+        self.conn.execute("""
+            INSERT INTO user_resources (user_id, resource_id, quantity)
+            SELECT ?, resource_id, ? FROM resources WHERE name = ?
+            ON CONFLICT(user_id, resource_id) DO UPDATE SET quantity = excluded.quantity
+        """, (user_id, quantity, resource))
+
+    def test_consistent(self):
+        self.assertEqual(ledger.check(self.conn), {"checked": 3, "mismatches": 0, "details": []})
+        self.assertEqual(ledger.balances(self.conn, 1), {ledger.COINS: 150, MILK: 4})
+        self.assertFalse(self.conn.in_transaction)
+
+    def test_mismatches(self):
+        self.conn.execute("UPDATE players SET balance = 175 WHERE user_id = 1")
+        # Ресурс без записей в журнале и запись журнала без строки в базе
+        self.set_quantity(2, MILK, 3)
+        ledger.record(self.conn, [(2, "Сахар", 5, "collect")])
+        report = ledger.check(self.conn)
+        self.assertEqual(report["checked"], 5)
+        self.assertEqual(report["mismatches"], 3)
+        self.assertEqual(report["details"], [
+            (1, ledger.COINS, 175, 150),
+            (2, MILK, 3, 0),
+            (2, "Сахар", 0, 5),
+        ])
+
+    def test_snapshot_and_tail(self):
+        self.assertEqual(ledger.take_snapshot(self.conn, at=1), (3, 2))
+        self.assertEqual(ledger.take_snapshot(self.conn, at=2), (3, 0))
+        self.conn.execute("UPDATE players SET balance = 140 WHERE user_id = 1")
+        ledger.record(self.conn, [(1, ledger.COINS, -10, "buy")])
+        self.assertEqual(ledger.balances(self.conn, 1), {ledger.COINS: 140, MILK: 4})
+        for full in (True, False):
+            self.assertEqual(ledger.check(self.conn, full=full)["mismatches"], 0)
+
+        # Снимок расходится с журналом (например, испорчен вручную): видно только в быстрой проверке
+        self.conn.execute("UPDATE ledger_balances SET balance = 1 WHERE user_id = 1 AND asset = ?", (MILK,))
+        self.assertEqual(ledger.check(self.conn, full=True)["mismatches"], 0)
+        self.assertEqual(ledger.check(self.conn, full=False)["details"], [(1, MILK, 4, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+"""
+Горячее состояние игроков: изменения в памяти (collect, доход) не теряются,
+если игрок загружен в кэш во время write() или фоновой записи.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+import game_actions  # noqa: E402
+import ledger  # noqa: E402
+from achievement_rules import AchievementEngine  # noqa: E402
+from bootstrap import bootstrap_database  # noqa: E402
+from catalog import Catalog  # noqa: E402
+from db import Database  # noqa: E402
+from player_state import HotStore, load_state  # noqa: E402
+
+USER_ID = 42
+
+
+def slow_upgrade(conn, user_id, engine, started):
+    # Запись держит транзакцию, пока тест читает и меняет состояние игрока
+    started.set()
+    time.sleep(0.2)
+    return game_actions.upgrade_cafe(conn, user_id, engine)
+
+
+class HotStoreTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        path = os.path.join(self.workdir.name, "game.db")
+        conn = sqlite3.connect(path, isolation_level=None)
+        bootstrap_database(conn)
+        self.catalog = Catalog()
+        self.catalog.load(conn)
+        conn.close()
+        self.engine = AchievementEngine(self.catalog.snapshot.achievements)
+        self.db = Database(path)
+        self.store = HotStore(self.db, self.catalog, flush_interval=60)
+        self.resource = self.catalog.snapshot.resources[0]
+        # Регистрация в обход хранилища: игрока нет в кэше
+        await self.db.write(game_actions.register_player, USER_ID)
+
+    async def asyncTearDown(self):
+        self.db.close()
+        self.workdir.cleanup()
+
+    async def stored_quantity(self):
+        row = await self.db.fetchone(
+            "SELECT quantity FROM user_resources WHERE user_id = ? AND resource_id = ?",
+            (USER_ID, self.resource.resource_id)
+        )
+        return row[0] if row else None
+
+    async def test_collect_during_write_of_uncached_player(self):
+        started = threading.Event()
+        write = asyncio.create_task(self.store.write(slow_upgrade, USER_ID, self.engine, started))
+        await asyncio.to_thread(started.wait)
+
+        state = await self.store.get(USER_ID)
+        quantity, _ = self.store.collect(USER_ID, state, self.resource, 5, self.engine)
+        self.assertEqual(quantity, 5)
+        status, _ = await write
+        self.assertEqual(status, game_actions.OK)
+
+        # После записи в кэше — перечитанное состояние с отложенным сбором
+        state = await self.store.get(USER_ID)
+        self.assertEqual(state.level, 2)
+        self.assertEqual(state.resources[self.resource.resource_id], 5)
+
+        self.assertEqual(await self.store.flush(), 1)
+        self.assertEqual(await self.stored_quantity(), 5)
+        self.assertEqual((await self.db.read(ledger.check))["mismatches"], 0)
+
+    async def test_collect_during_write_then_next_write(self):
+        started = threading.Event()
+        write = asyncio.create_task(self.store.write(slow_upgrade, USER_ID, self.engine, started))
+        await asyncio.to_thread(started.wait)
+        state = await self.store.get(USER_ID)
+        self.store.collect(USER_ID, state, self.resource, 3, self.engine)
+        await write
+
+        # Отложенный сбор дописывается в транзакции следующего действия
+        await self.store.write(game_actions.add_coins, USER_ID, 10, self.engine)
+        self.assertEqual(await self.stored_quantity(), 3)
+        self.assertEqual(await self.store.flush(), 0)
+
+    async def test_render(self):
+        state = await self.store.get(USER_ID)
+        await self.store.get(USER_ID)
+        self.store.collect(USER_ID, state, self.resource, 1, self.engine)
+        lines = self.store.render()
+        self.assertIn("bot_hot_store_players 1", lines)
+        self.assertIn("bot_hot_store_dirty_players 1", lines)
+        self.assertIn('bot_hot_store_lookups_total{result="hit"} 1', lines)
+        self.assertIn('bot_hot_store_lookups_total{result="miss"} 1', lines)
+        await self.store.flush()
+        self.assertIn("bot_hot_store_flushed_players_total 1", self.store.render())
+
+    async def test_changes_refused_for_detached_state(self):
+        await self.store.get(USER_ID)
+        detached = await self.db.read(load_state, USER_ID)
+        with self.assertRaises(RuntimeError):
+            self.store.collect(USER_ID, detached, self.resource, 1, self.engine)
+        with self.assertRaises(RuntimeError):
+            self.store.settle_income(USER_ID, detached, self.engine, at=detached.last_income + 3600)
+        self.assertEqual(self.store.stats()["dirty"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Расписания планировщика: ближайший момент cron-выражения и интервал.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from scheduler import Cron, Interval  # noqa: E402
+
+
+class CronTest(unittest.TestCase):
+    def test_daily(self):
+        cron = Cron("30 4 * * *")
+        self.assertEqual(cron.next_after(datetime(2026, 3, 1, 4, 29, 59)), datetime(2026, 3, 1, 4, 30))
+        # Строго после: сам момент расписания не возвращается
+        self.assertEqual(cron.next_after(datetime(2026, 3, 1, 4, 30)), datetime(2026, 3, 2, 4, 30))
+        self.assertEqual(cron.next_after(datetime(2026, 12, 31, 23, 0)), datetime(2027, 1, 1, 4, 30))
+
+    def test_steps_ranges_and_lists(self):
+        cron = Cron("*/15 9-17 * * *")
+        self.assertEqual(cron.next_after(datetime(2026, 3, 1, 9, 0)), datetime(2026, 3, 1, 9, 15))
+        self.assertEqual(cron.next_after(datetime(2026, 3, 1, 17, 45)), datetime(2026, 3, 2, 9, 0))
+        cron = Cron("0,20 8 * * *")
+        self.assertEqual(cron.next_after(datetime(2026, 3, 1, 8, 5)), datetime(2026, 3, 1, 8, 20))
+
+    def test_weekday(self):
+        # 2026-03-01 — воскресенье; 0 и 7 — воскресенье
+        monday = Cron("0 12 * * 1")
+        self.assertEqual(monday.next_after(datetime(2026, 3, 1, 13, 0)), datetime(2026, 3, 2, 12, 0))
+        for expression in ("0 12 * * 0", "0 12 * * 7"):
+            self.assertEqual(Cron(expression).next_after(datetime(2026, 3, 2, 0, 0)), datetime(2026, 3, 8, 12, 0))
+
+    def test_day_of_month_or_weekday(self):
+        # Ограничены оба поля: достаточно совпадения одного (1-е число или понедельник)
+        cron = Cron("0 0 1 * 1")
+        self.assertEqual(cron.next_after(datetime(2026, 3, 1, 0, 0)), datetime(2026, 3, 2, 0, 0))
+        self.assertEqual(cron.next_after(datetime(2026, 3, 30, 0, 0)), datetime(2026, 4, 1, 0, 0))
+
+    def test_rare_dates(self):
+        self.assertEqual(Cron("0 0 29 2 *").next_after(datetime(2026, 3, 1)), datetime(2028, 2, 29))
+        self.assertEqual(Cron("0 0 31 * *").next_after(datetime(2026, 4, 1)), datetime(2026, 5, 31))
+
+    def test_invalid(self):
+        for expression in ("* * * *", "60 * * * *", "0 24 * * *", "*/0 * * * *", "5-1 * * * *"):
+            with self.assertRaises(ValueError):
+                Cron(expression)
+        with self.assertRaises(ValueError):
+            Cron("0 0 31 2 *").next_after(datetime(2026, 1, 1))
+
+    def test_delay(self):
+        now = datetime(2026, 3, 1, 10, 0, 30)
+        self.assertEqual(Cron("1 10 * * *").delay(now), 30.0)
+
+
+class IntervalTest(unittest.TestCase):
+    def test_interval(self):
+        self.assertEqual(Interval(90).delay(datetime(2026, 3, 1)), 90.0)
+        with self.assertRaises(ValueError):
+            Interval(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
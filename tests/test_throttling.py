@@ -0,0 +1,128 @@
+"""
+Ограничитель частоты: восполнение корзин, общий и командный лимиты, вытеснение
+корзин и поведение middleware при отказе.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import os
+import sys
+import unittest
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bot"))
+
+from throttling import GLOBAL_KEY, THROTTLED_TEXT, ThrottlingMiddleware, parse_rates  # noqa: E402
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def message_update(user_id, text):
+    replies = []
+
+    async def answer(reply_text):
+        replies.append(reply_text)
+
+    message = SimpleNamespace(from_user=SimpleNamespace(id=user_id), text=text, answer=answer)
+    return SimpleNamespace(message=message, callback_query=None), replies
+
+
+class TokenBucketTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.throttling = ThrottlingMiddleware(rates={GLOBAL_KEY: (3, 3.0), "/collect": (2, 10.0)},
+                                               clock=self.clock)
+
+    def test_capacity_then_refill(self):
+        allowed = [self.throttling.allow(1, "/collect") is None for _ in range(3)]
+        self.assertEqual(allowed, [True, True, False])
+        # Одна монета за 5 секунд
+        self.clock.now += 4.9
+        self.assertIsNotNone(self.throttling.allow(1, "/collect"))
+        self.clock.now += 0.2
+        self.assertIsNone(self.throttling.allow(1, "/collect"))
+        self.assertEqual(self.throttling.rejected, {"/collect": 2})
+
+    def test_global_bucket_shared_by_commands(self):
+        for _ in range(3):
+            self.assertIsNone(self.throttling.allow(1, "/my_cafe"))
+        self.assertIsNotNone(self.throttling.allow(1, "/leaderboard"))
+        self.assertEqual(self.throttling.rejected, {GLOBAL_KEY: 1})
+        # Другой пользователь не затронут
+        self.assertIsNone(self.throttling.allow(2, "/my_cafe"))
+
+    def test_rejected_request_does_not_spend_global_tokens(self):
+        self.assertIsNone(self.throttling.allow(1, "/collect"))
+        self.assertIsNone(self.throttling.allow(1, "/collect"))
+        self.assertIsNotNone(self.throttling.allow(1, "/collect"))
+        # Отказ по команде не списал токен общей корзины
+        self.assertIsNone(self.throttling.allow(1, "/my_cafe"))
+
+    def test_idle_buckets_evicted(self):
+        self.throttling.allow(1, "/collect")
+        # TTL не меньше самого долгого восполнения (10 с)
+        self.assertEqual(self.throttling.idle_ttl, 600.0)
+        self.clock.now += 601
+        self.throttling.allow(2, "/my_cafe")
+        self.assertEqual(self.throttling.metrics()["buckets"], 1)
+        self.assertEqual(self.throttling.evicted, 2)
+
+    def test_max_buckets(self):
+        throttling = ThrottlingMiddleware(rates={GLOBAL_KEY: (1, 1.0)}, max_buckets=2, clock=self.clock)
+        for user_id in range(5):
+            throttling.allow(user_id, None)
+        self.assertEqual(throttling.metrics()["buckets"], 2)
+        self.assertEqual(throttling.evicted, 3)
+
+    def test_render(self):
+        self.throttling.allow(1, "/collect")
+        self.throttling.allow(1, "/collect")
+        self.throttling.allow(1, "/collect")
+        lines = self.throttling.render()
+        self.assertIn('bot_throttle_rejected_total{key="/collect"} 1', lines)
+        self.assertIn('bot_throttle_rejected_total{key="*"} 0', lines)
+        self.assertIn("bot_throttle_buckets 2", lines)
+        self.assertIn("bot_throttle_evicted_total 0", lines)
+
+    def test_parse_rates(self):
+        self.assertEqual(parse_rates("/collect=5/10, buy=3/2.5,*=20,broken"),
+                         {"/collect": (5, 10.0), "buy": (3, 2.5), "*": (20, 1.0)})
+        self.assertEqual(parse_rates(""), {})
+
+
+class ThrottlingMiddlewareTest(unittest.IsolatedAsyncioTestCase):
+    async def test_rejected_update_skips_handler_and_warns_once(self):
+        throttling = ThrottlingMiddleware(rates={"/collect": (1, 10.0)}, clock=FakeClock())
+        handled = []
+
+        async def handler(event, data):
+            handled.append(event)
+            return "ok"
+
+        replies_by_call = []
+        for _ in range(3):
+            update, replies = message_update(7, "/collect@crypto_coffee_bot")
+            result = await throttling(handler, update, {})
+            replies_by_call.append((result, replies))
+
+        self.assertEqual(len(handled), 1)
+        self.assertEqual(replies_by_call, [("ok", []), (None, [THROTTLED_TEXT]), (None, [])])
+
+    async def test_updates_without_user_pass(self):
+        throttling = ThrottlingMiddleware(rates={GLOBAL_KEY: (0, 1.0)}, clock=FakeClock())
+        update = SimpleNamespace(message=None, callback_query=None)
+
+        async def handler(event, data):
+            return "ok"
+
+        self.assertEqual(await throttling(handler, update, {}), "ok")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+"""
+WebSocket-хаб: продолжение подписки с epoch и since после переподключения
+и снимок, если состояние канала создано заново.
+
+Запуск из корня репозитория:
+    python -m pytest -q tests
+"""
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web"))
+
+from ws_server import Hub  # noqa: E402
+
+CHANNEL = "cafe:1"
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.messages = []
+
+    async def send(self, message):
+        self.messages.append(json.loads(message))
+
+    async def close(self, code=1000, reason=""):
+        pass
+
+
+class HubResumeTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.hub = Hub(history_size=4, state_ttl=300.0)
+
+    async def subscribe(self, epoch=None, since=None):
+        websocket = RecordingWebSocket()
+        connection = self.hub.connect(websocket)
+        self.hub.subscribe(connection, CHANNEL, epoch=epoch, since=since)
+        await asyncio.sleep(0)
+        return connection, websocket.messages
+
+    async def test_resume_sends_missed_deltas(self):
+        connection, messages = await self.subscribe()
+        self.hub.apply(CHANNEL, {"balance": 10})
+        await asyncio.sleep(0)
+        self.hub.disconnect(connection)
+        last = messages[-1]
+        self.hub.apply(CHANNEL, {"balance": 20})
+        self.hub.apply(CHANNEL, {"level": 2})
+
+        _, resumed = await self.subscribe(epoch=last["epoch"], since=last["seq"])
+        self.assertEqual([(message["type"], message["seq"]) for message in resumed], [("delta", 2), ("delta", 3)])
+        self.assertEqual(self.hub.resumes, 1)
+
+    async def test_gap_beyond_history_gets_snapshot(self):
+        connection, messages = await self.subscribe()
+        self.hub.disconnect(connection)
+        for balance in range(6):
+            self.hub.apply(CHANNEL, {"balance": balance})
+
+        _, resumed = await self.subscribe(epoch=messages[-1]["epoch"], since=0)
+        self.assertEqual([message["type"] for message in resumed], ["snapshot"])
+        self.assertEqual(resumed[0]["seq"], 6)
+
+    async def test_expired_channel_gets_snapshot(self):
+        connection, messages = await self.subscribe()
+        self.hub.apply(CHANNEL, {"balance": 10})
+        await asyncio.sleep(0)
+        self.hub.disconnect(connection)
+        last = messages[-1]
+
+        # Канал без подписчиков удалён по TTL; изменения за это время не отслеживались
+        self.assertEqual(self.hub.expire_states(now=10 ** 9), 1)
+        self.assertIsNone(self.hub.apply(CHANNEL, {"balance": 30}))
+
+        # Новое состояние снова дошло до того же seq: старый since не должен считаться продолжением
+        _, fresh = await self.subscribe()
+        self.hub.apply(CHANNEL, {"balance": 40})
+        await asyncio.sleep(0)
+        self.assertEqual(fresh[-1]["seq"], last["seq"])
+
+        _, resumed = await self.subscribe(epoch=last["epoch"], since=last["seq"])
+        self.assertEqual([message["type"] for message in resumed], ["snapshot"])
+        self.assertEqual(resumed[0]["data"], {"balance": 40})
+        self.assertNotEqual(resumed[0]["epoch"], last["epoch"])
+        self.assertEqual(self.hub.resumes, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,194 @@
+// =======================
+// Живое состояние игры через WebSocket (см. ws_server.py)
+// =======================
+//
+// Клиент авторизуется initData Telegram Web App, подписывается на свою
+// кофейню (cafe:<user_id>) и лидерборд, применяет снимки и дельты к плоскому
+// словарю полей каждого канала ("balance", "buildings.Склад", места топа
+// "1".."10"). Для каждого канала запоминаются epoch и seq последнего
+// сообщения: после переподключения подписка идёт с epoch и since, и сервер
+// досылает только пропущенные дельты (или снимок, если не может). Пропуск
+// seq в потоке дельт — тоже повод переподписаться с since.
+
+const LEADERBOARD_CHANNEL = "leaderboard";
+const CAFE_CHANNEL_PREFIX = "cafe:";
+
+// Пауза перед переподключением растёт от 1 до 30 секунд
+const RECONNECT_DELAY_MIN = 1000;
+const RECONNECT_DELAY_MAX = 30000;
+
+class GameStateClient {
+    constructor(url, initData) {
+        this.url = url;
+        this.initData = initData;
+        this.userId = null;
+        // channel -> {fields, epoch, seq}
+        this.channels = new Map();
+        this.listeners = new Set();
+        this.socket = null;
+        this.reconnectDelay = RECONNECT_DELAY_MIN;
+        this.stopped = false;
+    }
+
+    // Поля канала или пустой объект, если данных ещё нет
+    fields(channel) {
+        const state = this.channels.get(channel);
+        return state ? state.fields : {};
+    }
+
+    cafeChannel() {
+        return this.userId === null ? null : `${CAFE_CHANNEL_PREFIX}${this.userId}`;
+    }
+
+    // listener(channel, fields, changes) вызывается после каждого снимка и дельты
+    onChange(listener) {
+        this.listeners.add(listener);
+        return () => this.listeners.delete(listener);
+    }
+
+    start() {
+        this.stopped = false;
+        this.subscribe(LEADERBOARD_CHANNEL);
+        this.connect();
+    }
+
+    stop() {
+        this.stopped = true;
+        if (this.socket) {
+            this.socket.close();
+        }
+    }
+
+    subscribe(channel) {
+        if (!this.channels.has(channel)) {
+            this.channels.set(channel, { fields: {}, epoch: null, seq: null });
+        }
+        this.sendSubscribe(channel);
+    }
+
+    // -----------------------
+    // Соединение
+    // -----------------------
+
+    connect() {
+        const socket = new WebSocket(this.url);
+        this.socket = socket;
+
+        socket.addEventListener("open", () => {
+            console.log("WebSocket connected");
+            this.reconnectDelay = RECONNECT_DELAY_MIN;
+            if (this.initData) {
+                // Канал кофейни — после ответа на auth (см. handleReply)
+                this.send({ op: "auth", init_data: this.initData });
+            }
+            for (const channel of this.channels.keys()) {
+                this.sendSubscribe(channel);
+            }
+        });
+
+        socket.addEventListener("message", (event) => {
+            let message;
+            try {
+                message = JSON.parse(event.data);
+            } catch (error) {
+                console.error("Некорректное сообщение от сервера:", event.data);
+                return;
+            }
+            if (message.channel) {
+                this.handleChannelMessage(message);
+            } else {
+                this.handleReply(message);
+            }
+        });
+
+        socket.addEventListener("close", (event) => {
+            console.log("WebSocket disconnected", event.code);
+            if (this.socket === socket) {
+                this.socket = null;
+            }
+            if (!this.stopped) {
+                setTimeout(() => this.connect(), this.reconnectDelay);
+                this.reconnectDelay = Math.min(this.reconnectDelay * 2, RECONNECT_DELAY_MAX);
+            }
+        });
+
+        socket.addEventListener("error", (error) => {
+            console.error("WebSocket error:", error);
+        });
+    }
+
+    send(command) {
+        if (this.socket && this.socket.readyState === WebSocket.OPEN) {
+            this.socket.send(JSON.stringify(command));
+        }
+    }
+
+    sendSubscribe(channel) {
+        const state = this.channels.get(channel);
+        const command = { op: "subscribe", channel };
+        if (state && state.epoch !== null) {
+            // Продолжение: сервер пришлёт дельты после since или снимок
+            command.epoch = state.epoch;
+            command.since = state.seq;
+        }
+        this.send(command);
+    }
+
+    // -----------------------
+    // Сообщения сервера
+    // -----------------------
+
+    handleReply(message) {
+        if (message.op === "ok" && message.user_id !== undefined) {
+            this.userId = message.user_id;
+            // После переподключения канал кофейни уже переподписан вслед за auth
+            if (!this.channels.has(this.cafeChannel())) {
+                this.subscribe(this.cafeChannel());
+            }
+        } else if (message.op === "error") {
+            console.error("Ошибка WebSocket-сервера:", message.error, message.channel || "");
+        }
+    }
+
+    handleChannelMessage(message) {
+        const state = this.channels.get(message.channel);
+        if (!state) {
+            // Уже отписались
+            return;
+        }
+        if (message.type === "snapshot") {
+            state.fields = { ...message.data };
+        } else if (message.type === "delta") {
+            if (state.epoch !== message.epoch || state.seq === null) {
+                // Дельта без снимка этого epoch: запрашиваем снимок
+                state.epoch = null;
+                this.sendSubscribe(message.channel);
+                return;
+            }
+            if (message.seq <= state.seq) {
+                // Уже применена (повтор после переподписки)
+                return;
+            }
+            if (message.seq !== state.seq + 1) {
+                // Пропуск в потоке: сервер дошлёт недостающие дельты после since
+                this.sendSubscribe(message.channel);
+                return;
+            }
+            Object.assign(state.fields, message.data);
+        } else {
+            return;
+        }
+        state.epoch = message.epoch;
+        state.seq = message.seq;
+        for (const listener of this.listeners) {
+            try {
+                listener(message.channel, state.fields, message.data);
+            } catch (error) {
+                console.error("Ошибка в обработчике состояния:", error);
+            }
+        }
+    }
+}
+
+window.GameStateClient = GameStateClient;
+window.LEADERBOARD_CHANNEL = LEADERBOARD_CHANNEL;
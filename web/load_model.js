@@ -46,6 +46,34 @@ window.addEventListener('DOMContentLoaded', () => {
         advancedTexture.addControl(textBlock);
         console.log("GUI текст добавлен");
 
+        // Кофейня игрока и лидер топа обновляются по дельтам с WebSocket-сервера (см. game_state.js)
+        const stateText = new BABYLON.GUI.TextBlock();
+        stateText.color = "white";
+        stateText.fontSize = 20;
+        stateText.textHorizontalAlignment = BABYLON.GUI.Control.HORIZONTAL_ALIGNMENT_LEFT;
+        stateText.textVerticalAlignment = BABYLON.GUI.Control.VERTICAL_ALIGNMENT_TOP;
+        stateText.paddingLeft = "12px";
+        stateText.paddingTop = "12px";
+        advancedTexture.addControl(stateText);
+
+        const renderState = () => {
+            const lines = [];
+            const cafeChannel = window.gameState.cafeChannel();
+            const cafe = cafeChannel ? window.gameState.fields(cafeChannel) : {};
+            if (cafe.cafe_name !== undefined) {
+                lines.push(`${cafe.cafe_name}: уровень ${cafe.level}, ${cafe.balance} монет`);
+            }
+            const leader = window.gameState.fields(LEADERBOARD_CHANNEL)["1"];
+            if (leader) {
+                lines.push(`Лидер: ${leader.cafe_name} (${leader.balance} монет)`);
+            }
+            stateText.text = lines.join("\n");
+        };
+        if (window.gameState) {
+            window.gameState.onChange(renderState);
+            renderState();
+        }
+
         // Запуск рендер-лупа
         engine.runRenderLoop(() => {
             try {
@@ -1,16 +1,526 @@
 import os
 import asyncio
+import functools
+import hashlib
+import hmac
+import json
+import logging
+import resource
+import secrets
+import sqlite3
+import time
+from collections import deque
+from urllib.parse import parse_qsl
+
 import websockets
 
-async def handler(websocket, path):
-    async for message in websocket:
-        print(f"Received message: {message}")
-        await websocket.send(f"Echo: {message}")
+logger = logging.getLogger("ws_server")
+
+# =======================
+# WebSocket-хаб подписок
+# =======================
+#
+# Клиент подписывается на каналы и получает сообщения только из них:
+#   leaderboard      — общий лидерборд;
+#   cafe:<user_id>   — состояние кофейни игрока (только после auth своим initData).
+#
+# Протокол (JSON, клиент веб-приложения — game_state.js):
+#   → {"op": "auth", "init_data": Telegram.WebApp.initData}
+#   → {"op": "subscribe", "channel": "leaderboard", "epoch": "...", "since": 42} / {"op": "unsubscribe", ...}
+#   → {"op": "ping"}
+#   ← {"channel": "...", "type": "snapshot", "epoch": "...", "seq": 42, "data": {поле: значение}}
+#   ← {"channel": "...", "type": "delta", "epoch": "...", "seq": 43, "data": {изменившиеся поля}}
+#   ← {"op": "ok"|"error"|"pong", ...} — ответы на команды
+#
+# Состояние канала — плоский словарь полей ("balance", "buildings.Склад",
+# места топа "1".."10"). Бот присылает изменения через локальный unix-сокет
+# (EVENTS_SOCKET, см. bot/events.py); сервер сравнивает их с текущим
+# состоянием и рассылает только действительно изменившиеся поля, увеличивая
+# seq канала на единицу. Клиент, переподключившийся с epoch и since последнего
+# полученного сообщения, получает пропущенные дельты из кольцевого буфера;
+# если буфер их уже не хранит или состояние канала создано заново (другой
+# epoch: перезапуск сервера или канал без подписчиков удалён по TTL) — снимок. Снимок при первой подписке читается из базы (WS_DB_PATHS).
+#
+# Сообщение канала сериализуется один раз и одна и та же строка уходит всем
+# подписчикам. У каждого соединения своя ограниченная очередь отправки: задача
+# отправки создаётся только когда очередь не пуста (простаивающее соединение
+# не держит задачу), а клиент, который не успевает читать и переполняет
+# очередь, отключается — он не замедляет остальных.
+
+LEADERBOARD_CHANNEL = "leaderboard"
+CAFE_CHANNEL_PREFIX = "cafe:"
+MAX_SUBSCRIPTIONS = 16
+
+# Код закрытия для медленных клиентов: «попробуйте позже»
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Connection:
+    __slots__ = ("websocket", "user_id", "channels", "pending", "sending", "closed")
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.user_id = None
+        self.channels = set()
+        self.pending = deque()
+        self.sending = False
+        self.closed = False
+
+
+class ChannelState:
+    __slots__ = ("epoch", "fields", "seq", "history", "loading", "waiters", "idle_since")
+
+    def __init__(self, history_size):
+        # Свой epoch у каждого нового состояния: seq начинается заново, и seq клиентов,
+        # полученные до перезапуска или до удаления канала по TTL, недействительны
+        self.epoch = secrets.token_hex(4)
+        self.fields = {}
+        self.seq = 0
+        # (seq, готовое сообщение-дельта) — для досылки пропущенного при переподключении
+        self.history = deque(maxlen=history_size)
+        self.loading = False
+        self.waiters = []
+        self.idle_since = None
+
+
+class Hub:
+    def __init__(self, send_queue_size=256, history_size=256, state_ttl=300.0, snapshot_loader=None):
+        self.send_queue_size = max(1, int(send_queue_size))
+        self.history_size = max(1, int(history_size))
+        self.state_ttl = state_ttl
+        self.snapshot_loader = snapshot_loader
+        self.channels = {}
+        self.states = {}
+        self.connections = set()
+        self.published = 0
+        self.deliveries = 0
+        self.snapshots = 0
+        self.resumes = 0
+        self.slow_disconnects = 0
+
+    def stats(self):
+        return {
+            "connections": len(self.connections),
+            "channels": len(self.channels),
+            "states": len(self.states),
+            "published": self.published,
+            "deliveries": self.deliveries,
+            "snapshots": self.snapshots,
+            "resumes": self.resumes,
+            "slow_disconnects": self.slow_disconnects,
+        }
+
+    # -----------------------
+    # Соединения и подписки
+    # -----------------------
+
+    def connect(self, websocket):
+        connection = Connection(websocket)
+        self.connections.add(connection)
+        return connection
+
+    def disconnect(self, connection):
+        connection.closed = True
+        connection.pending.clear()
+        for channel in connection.channels:
+            self._remove_subscriber(connection, channel)
+        connection.channels.clear()
+        self.connections.discard(connection)
+
+    def subscribe(self, connection, channel, epoch=None, since=None):
+        """Подписывает соединение и отправляет ему снимок канала или пропущенные дельты."""
+        connection.channels.add(channel)
+        self.channels.setdefault(channel, set()).add(connection)
+        state = self.states.get(channel)
+        if state is None:
+            state = self.states[channel] = ChannelState(self.history_size)
+            if self.snapshot_loader is not None:
+                state.loading = True
+                asyncio.create_task(self._load_snapshot(channel, state))
+        state.idle_since = None
+        if state.loading:
+            state.waiters.append(connection)
+        else:
+            self._sync(connection, channel, state, epoch, since)
+
+    def unsubscribe(self, connection, channel):
+        connection.channels.discard(channel)
+        self._remove_subscriber(connection, channel)
+
+    def _remove_subscriber(self, connection, channel):
+        subscribers = self.channels.get(channel)
+        if subscribers is None:
+            return
+        subscribers.discard(connection)
+        if not subscribers:
+            del self.channels[channel]
+            state = self.states.get(channel)
+            if state is not None:
+                # Состояние живёт ещё state_ttl секунд, чтобы переподключившийся клиент получил только дельты
+                state.idle_since = time.monotonic()
+
+    def expire_states(self, now=None):
+        """Удаляет состояния каналов без подписчиков старше state_ttl. Возвращает число удалённых."""
+        now = time.monotonic() if now is None else now
+        expired = [channel for channel, state in self.states.items()
+                   if state.idle_since is not None and now - state.idle_since >= self.state_ttl]
+        for channel in expired:
+            del self.states[channel]
+        return len(expired)
+
+    # -----------------------
+    # Состояние каналов
+    # -----------------------
+
+    async def _load_snapshot(self, channel, state):
+        try:
+            snapshot = await asyncio.to_thread(self.snapshot_loader, channel)
+        except Exception as e:
+            logger.error(f"Не удалось загрузить снимок канала {channel}: {e}", exc_info=True)
+            snapshot = {}
+        # Изменения, пришедшие во время чтения базы, новее снимка
+        state.fields = {**snapshot, **state.fields}
+        state.loading = False
+        waiters, state.waiters = state.waiters, []
+        for connection in waiters:
+            if not connection.closed and channel in connection.channels:
+                self._send_snapshot(connection, channel, state)
+
+    def apply(self, channel, changes):
+        """
+        Применяет изменения полей канала от бота. Рассылает подписчикам дельту
+        из действительно изменившихся полей; возвращает её seq или None.
+        Каналы, на которые никто не подписан, не отслеживаются.
+        """
+        state = self.states.get(channel)
+        if state is None:
+            return None
+        fields = state.fields
+        delta = {key: value for key, value in changes.items() if key not in fields or fields[key] != value}
+        if not delta:
+            return None
+        fields.update(delta)
+        state.seq += 1
+        message = _channel_message(channel, "delta", state.epoch, state.seq, delta)
+        state.history.append((state.seq, message))
+        if not state.loading:
+            self._broadcast(channel, message)
+        return state.seq
+
+    def _sync(self, connection, channel, state, epoch, since):
+        # Досылаем пропущенное, если клиент видел этот же epoch канала и буфер покрывает разрыв
+        if epoch == state.epoch and isinstance(since, int) and 0 <= since <= state.seq:
+            if since == state.seq or (state.history and state.history[0][0] <= since + 1):
+                self.resumes += 1
+                for seq, message in state.history:
+                    if seq > since:
+                        self.send(connection, message)
+                return
+        self._send_snapshot(connection, channel, state)
+
+    def _send_snapshot(self, connection, channel, state):
+        self.snapshots += 1
+        self.send(connection, _channel_message(channel, "snapshot", state.epoch, state.seq, state.fields))
+
+    # -----------------------
+    # Отправка
+    # -----------------------
+
+    def _broadcast(self, channel, message):
+        """Отправляет готовое сообщение всем подписчикам канала. Возвращает число получателей."""
+        subscribers = self.channels.get(channel)
+        if not subscribers:
+            return 0
+        self.published += 1
+        for connection in list(subscribers):
+            self.send(connection, message)
+        return len(subscribers)
+
+    def send(self, connection, message):
+        if connection.closed:
+            return
+        if len(connection.pending) >= self.send_queue_size:
+            self._drop_slow_consumer(connection)
+            return
+        connection.pending.append(message)
+        self.deliveries += 1
+        if not connection.sending:
+            connection.sending = True
+            asyncio.create_task(self._drain(connection))
+
+    async def _drain(self, connection):
+        # send() ждёт, пока буфер сокета опустеет ниже порога: это и есть обратное давление
+        try:
+            while connection.pending and not connection.closed:
+                await connection.websocket.send(connection.pending.popleft())
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            connection.sending = False
+
+    def _drop_slow_consumer(self, connection):
+        self.slow_disconnects += 1
+        logger.warning(f"Медленный клиент отключён (user_id={connection.user_id}, каналов: {len(connection.channels)})")
+        self.disconnect(connection)
+        asyncio.create_task(connection.websocket.close(SLOW_CONSUMER_CLOSE_CODE, "slow consumer"))
+
+
+def _channel_message(channel, kind, epoch, seq, data):
+    # Сериализуем один раз на всех подписчиков
+    return json.dumps({"channel": channel, "type": kind, "epoch": epoch, "seq": seq, "data": data},
+                      ensure_ascii=False, separators=(",", ":"))
+
+
+# -----------------------
+# Снимки из базы бота
+# -----------------------
+
+class SnapshotLoader:
+    """
+    Читает текущее состояние канала из баз бота (только чтение). Несколько
+    путей — шарды режима супервизора: игрок ищется во всех, топ собирается из всех.
+    """
+
+    def __init__(self, db_paths, top_size=10):
+        self.db_paths = list(db_paths)
+        self.top_size = top_size
+
+    def _connect(self, path):
+        return sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+
+    def __call__(self, channel):
+        if channel == LEADERBOARD_CHANNEL:
+            return self.leaderboard()
+        if channel.startswith(CAFE_CHANNEL_PREFIX):
+            return self.cafe(int(channel[len(CAFE_CHANNEL_PREFIX):]))
+        return {}
+
+    def cafe(self, user_id):
+        for path in self.db_paths:
+            conn = self._connect(path)
+            try:
+                row = conn.execute(
+                    "SELECT cafe_name, balance, level FROM players WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if row is None:
+                    continue
+                fields = {"cafe_name": row[0], "balance": row[1], "level": row[2]}
+                for name, level in conn.execute(
+                        "SELECT b.name, ub.level FROM user_buildings ub "
+                        "JOIN buildings b ON b.building_id = ub.building_id WHERE ub.user_id = ?", (user_id,)):
+                    fields[f"buildings.{name}"] = level
+                for name, quantity in conn.execute(
+                        "SELECT r.name, ur.quantity FROM user_resources ur "
+                        "JOIN resources r ON r.resource_id = ur.resource_id WHERE ur.user_id = ?", (user_id,)):
+                    fields[f"resources.{name}"] = quantity
+                return fields
+            finally:
+                conn.close()
+        return {}
+
+    def leaderboard(self):
+        rows = []
+        for path in self.db_paths:
+            conn = self._connect(path)
+            try:
+                rows.extend(conn.execute("""
+                    SELECT p.user_id, p.cafe_name, COALESCE(p.balance, 0), COALESCE(p.level, 1),
+                           (SELECT COUNT(*) FROM user_buildings ub WHERE ub.user_id = p.user_id)
+                    FROM players p
+                    ORDER BY COALESCE(p.balance, 0) DESC, p.user_id
+                    LIMIT ?
+                """, (self.top_size,)))
+            finally:
+                conn.close()
+        # Тот же порядок, что и в лидерборде бота: баланс по убыванию, при равенстве — меньший user_id
+        rows.sort(key=lambda row: (-row[2], row[0]))
+        top = {str(position): None for position in range(1, self.top_size + 1)}
+        for position, (user_id, cafe_name, balance, level, buildings) in enumerate(rows[:self.top_size], start=1):
+            top[str(position)] = {
+                "user_id": user_id, "cafe_name": cafe_name,
+                "balance": balance, "level": level, "buildings": buildings,
+            }
+        return top
+
+
+# -----------------------
+# Шина событий от бота
+# -----------------------
+
+async def serve_events(hub, socket_path):
+    """Принимает изменения от процессов бота: строки JSON {"channel", "changes"} через unix-сокет."""
+
+    async def on_connection(reader, writer):
+        logger.info("Процесс бота подключился к шине событий")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    event = json.loads(line)
+                    channel, changes = event["channel"], event["changes"]
+                except (ValueError, KeyError, TypeError):
+                    logger.warning(f"Некорректное событие отброшено: {line[:200]!r}")
+                    continue
+                if isinstance(channel, str) and isinstance(changes, dict):
+                    hub.apply(channel, changes)
+        except (ConnectionError, ValueError) as e:
+            logger.warning(f"Соединение шины событий закрыто с ошибкой: {e}")
+        finally:
+            writer.close()
+
+    if os.path.exists(socket_path):
+        # Сокет остался от предыдущего запуска
+        os.unlink(socket_path)
+    # Лидерборд целиком — несколько килобайт; лимит строки с запасом
+    return await asyncio.start_unix_server(on_connection, socket_path, limit=1 << 20)
+
+
+async def expire_states_loop(hub, interval=60.0):
+    while True:
+        await asyncio.sleep(interval)
+        expired = hub.expire_states()
+        if expired:
+            logger.debug(f"Удалено состояний каналов: {expired}")
+
+
+# -----------------------
+# Авторизация Telegram Web App
+# -----------------------
+
+def validate_init_data(init_data, bot_token):
+    """
+    Проверяет подпись initData Telegram Web App. Возвращает user_id или None.
+    См. https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
+    """
+    if not init_data or not bot_token:
+        return None
+    fields = dict(parse_qsl(init_data, keep_blank_values=True))
+    received_hash = fields.pop("hash", None)
+    if not received_hash:
+        return None
+    data_check_string = "\n".join(f"{key}={value}" for key, value in sorted(fields.items()))
+    secret_key = hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+    expected_hash = hmac.new(secret_key, data_check_string.encode(), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected_hash, received_hash):
+        return None
+    try:
+        return int(json.loads(fields.get("user", "{}"))["id"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+# -----------------------
+# Обработка команд клиента
+# -----------------------
+
+def _reply(op, **fields):
+    return json.dumps({"op": op, **fields}, ensure_ascii=False, separators=(",", ":"))
+
+
+def _can_subscribe(connection, channel):
+    if channel == LEADERBOARD_CHANNEL:
+        return True
+    if channel.startswith(CAFE_CHANNEL_PREFIX):
+        return connection.user_id is not None and channel == f"{CAFE_CHANNEL_PREFIX}{connection.user_id}"
+    return False
+
+
+def handle_command(hub, connection, raw_message, bot_token):
+    try:
+        command = json.loads(raw_message)
+        op = command["op"]
+    except (ValueError, KeyError, TypeError):
+        return _reply("error", error="bad_request")
+
+    if op == "ping":
+        return _reply("pong")
+    if op == "auth":
+        user_id = validate_init_data(command.get("init_data"), bot_token)
+        if user_id is None:
+            return _reply("error", error="unauthorized")
+        connection.user_id = user_id
+        return _reply("ok", user_id=user_id)
+    if op in ("subscribe", "unsubscribe"):
+        channel = command.get("channel")
+        if not isinstance(channel, str):
+            return _reply("error", error="bad_channel")
+        if op == "unsubscribe":
+            hub.unsubscribe(connection, channel)
+            return _reply("ok", channel=channel)
+        if not _can_subscribe(connection, channel):
+            return _reply("error", error="forbidden", channel=channel)
+        if len(connection.channels) >= MAX_SUBSCRIPTIONS and channel not in connection.channels:
+            return _reply("error", error="too_many_subscriptions")
+        # Подтверждение уходит раньше снимка или дельт канала
+        hub.send(connection, _reply("ok", channel=channel))
+        hub.subscribe(connection, channel, epoch=command.get("epoch"), since=command.get("since"))
+        return None
+    return _reply("error", error="unknown_op")
+
+
+async def handler(hub, bot_token, websocket):
+    connection = hub.connect(websocket)
+    try:
+        async for message in websocket:
+            reply = handle_command(hub, connection, message, bot_token)
+            if reply is not None:
+                hub.send(connection, reply)
+    except websockets.ConnectionClosed:
+        pass
+    finally:
+        hub.disconnect(connection)
+
+
+def raise_open_files_limit():
+    # Каждое соединение — файловый дескриптор; поднимаем мягкий лимит до жёсткого
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    return hard
+
 
 async def main():
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"),
+                        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
     port = int(os.environ.get("PORT", 8765))
-    async with websockets.serve(handler, "0.0.0.0", port):
-        await asyncio.Future()  # Run forever
+    # permessage-deflate экономит трафик, но держит состояние zlib на каждое соединение
+    compression = "deflate" if os.environ.get("WS_COMPRESSION", "none") == "deflate" else None
+    bot_token = os.environ.get("TELEGRAM_BOT_TOKEN")
+    if not bot_token:
+        logger.warning("TELEGRAM_BOT_TOKEN не установлен: каналы кофеен недоступны, работает только лидерборд.")
+
+    db_paths = [path for path in os.environ.get("WS_DB_PATHS", "").split(",") if path]
+    hub = Hub(
+        send_queue_size=int(os.environ.get("WS_SEND_QUEUE", "256")),
+        history_size=int(os.environ.get("WS_HISTORY", "256")),
+        state_ttl=float(os.environ.get("WS_STATE_TTL", "300")),
+        snapshot_loader=SnapshotLoader(db_paths) if db_paths else None,
+    )
+    if not db_paths:
+        logger.warning("WS_DB_PATHS не задан: снимки каналов строятся только из полученных событий.")
+    events_socket = os.environ.get("EVENTS_SOCKET")
+    events_server = None
+    if events_socket:
+        events_server = await serve_events(hub, events_socket)
+        logger.info(f"Шина событий слушает {events_socket}")
+    expire_task = asyncio.create_task(expire_states_loop(hub))
+    limit = raise_open_files_limit()
+    async with websockets.serve(
+        functools.partial(handler, hub, bot_token), "0.0.0.0", port,
+        compression=compression,
+        max_size=int(os.environ.get("WS_MAX_MESSAGE", "65536")),
+        max_queue=4,
+        ping_interval=float(os.environ.get("WS_PING_INTERVAL", "30")) or None,
+    ):
+        logger.info(f"WebSocket-сервер запущен на порту {port}, сжатие: {compression or 'нет'}, лимит файлов: {limit}")
+        try:
+            await asyncio.Future()  # Run forever
+        finally:
+            expire_task.cancel()
+            if events_server is not None:
+                events_server.close()
 
 if __name__ == "__main__":
     asyncio.run(main())